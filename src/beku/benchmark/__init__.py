@@ -0,0 +1 @@
+"""Benchmarks for the test expansion pipeline."""
@@ -0,0 +1,105 @@
+"""Benchmark entry point.
+
+Run the benchmark on a generated workload and store the results:
+
+    python -m beku.benchmark run --tests 20 --files 40 --output results.json
+
+Fail if a run is more than 20% slower than a stored baseline:
+
+    python -m beku.benchmark run --baseline baseline.json --threshold 0.2
+    python -m beku.benchmark compare baseline.json results.json --threshold 0.2
+"""
+
+import json
+import logging
+import sys
+import tempfile
+from argparse import ArgumentParser, Namespace
+from dataclasses import fields
+from typing import Any, Dict, List, Optional
+
+from .runner import PHASES, compare, run
+from .workload import Workload
+
+
+def parse_cli_args(args: Optional[List[str]] = None) -> Namespace:
+    """Parse command line args."""
+    parser = ArgumentParser(description="Benchmark the beku expansion pipeline")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmark.")
+    for f in fields(Workload):
+        run_parser.add_argument(
+            f"--{f.name.replace('_', '-')}",
+            help=f"Workload parameter. Default: {f.default}",
+            type=type(f.default),
+            required=False,
+            default=f.default,
+        )
+    run_parser.add_argument(
+        "-w",
+        "--workload_dir",
+        help="Run on an existing folder with a test definition instead of generating a workload.",
+        type=str,
+        required=False,
+    )
+    run_parser.add_argument("-s", "--suite", help="Test suite to expand. Default: default", default="default")
+    run_parser.add_argument("-r", "--repeat", help="Number of runs. Default: 3", type=int, default=3)
+    run_parser.add_argument("-j", "--jobs", help="Jobs for the expand phase. Default: 1", type=int, default=1)
+    run_parser.add_argument("-o", "--output", help="Write the results to this JSON file.", type=str, required=False)
+    run_parser.add_argument("--baseline", help="Compare the results with this JSON file.", type=str, required=False)
+    run_parser.add_argument("--threshold", help="Allowed slowdown as a fraction. Default: 0.1", type=float, default=0.1)
+
+    compare_parser = commands.add_parser("compare", help="Compare results with a baseline.")
+    compare_parser.add_argument("baseline", help="Baseline JSON file.", type=str)
+    compare_parser.add_argument("result", help="Result JSON file.", type=str)
+    compare_parser.add_argument(
+        "--threshold", help="Allowed slowdown as a fraction. Default: 0.1", type=float, default=0.1
+    )
+
+    return parser.parse_args(args)
+
+
+def _load(file_name: str) -> Dict[str, Any]:
+    with open(file_name, encoding="utf8") as stream:
+        return json.load(stream)
+
+
+def _report(result: Dict[str, Any]) -> None:
+    print(", ".join(f"{k}: {v}" for k, v in result["stats"].items()))
+    for phase in PHASES:
+        timing = result["phases"][phase]
+        print(f"{phase:>8}: min {timing['min']:.4f}s median {timing['median']:.4f}s")
+
+
+def _check(baseline: Dict[str, Any], result: Dict[str, Any], threshold: float) -> int:
+    regressions = compare(baseline, result, threshold)
+    for regression in regressions:
+        print(regression, file=sys.stderr)
+    return 1 if regressions else 0
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    """Main"""
+    cli_args = parse_cli_args(args)
+    logging.basicConfig(level=logging.WARNING)
+    if cli_args.command == "compare":
+        return _check(_load(cli_args.baseline), _load(cli_args.result), cli_args.threshold)
+
+    workload = Workload(**{f.name: getattr(cli_args, f.name) for f in fields(Workload)})
+    with tempfile.TemporaryDirectory() as root:
+        tests_dir = cli_args.workload_dir or workload.generate(root)
+        result = run(tests_dir, cli_args.suite, cli_args.repeat, cli_args.jobs)
+    if not cli_args.workload_dir:
+        result["workload"] = workload.to_dict()
+    _report(result)
+    if cli_args.output:
+        with open(cli_args.output, encoding="utf8", mode="w") as stream:
+            json.dump(result, stream, indent=2)
+    if cli_args.baseline:
+        return _check(_load(cli_args.baseline), result, cli_args.threshold)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
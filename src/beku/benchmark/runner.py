@@ -0,0 +1,133 @@
+"""Time the phases of the expansion pipeline."""
+
+from __future__ import annotations
+
+import os
+import platform
+import re
+import tempfile
+from os import path
+from statistics import median
+from time import perf_counter
+from typing import Any, Dict, List, Tuple
+
+import jinja2
+from yaml import load
+
+from ..kuttl import (
+    PATTERN_EXTENSION_JINJA,
+    SafeLoader,
+    TestDefinitionIndex,
+    TestDefinitions,
+    expand,
+    make_test_env,
+    test_names,
+)
+from ..render import RenderCache
+from ..sink import link_file, write_rendered
+from ..version import __version__
+
+PHASES: List[str] = ["parse", "resolve", "render", "write", "expand"]
+
+# Phases that change by less than this many seconds are never reported as regressions.
+DEFAULT_NOISE: float = 0.005
+
+
+def run(tests_dir: str, suite: str = "default", repeat: int = 3, jobs: int = 1) -> Dict[str, Any]:
+    """Run the benchmark on the test definition in tests_dir and return the results.
+
+    The phases are:
+    * parse : load the test definition YAML file.
+    * resolve : resolve the test suite and create all its test cases.
+    * render : render all templates of all test cases in memory.
+    * write : write the rendered templates and copy the other files, without rendering.
+    * expand : the complete expansion with kuttl.expand(), like the beku command does it.
+    """
+    test_definition = path.join(tests_dir, "test-definition.yaml")
+    template_dir = path.join(tests_dir, "templates", "kuttl")
+    kuttl_tests = path.join(tests_dir, "kuttl-test.yaml.jinja2")
+    timings: Dict[str, List[float]] = {phase: [] for phase in PHASES}
+    stats: Dict[str, int] = {}
+    for _ in range(repeat):
+        with open(test_definition, mode="rb") as stream:
+            content = stream.read()
+
+        start = perf_counter()
+        test_definitions = TestDefinitions.from_dict(load(content, Loader=SafeLoader))
+        timings["parse"].append(perf_counter() - start)
+
+        start = perf_counter()
+        ets = test_definitions.resolve(suite, test_definition)
+        test_cases = list(ets.test_cases)
+        timings["resolve"].append(perf_counter() - start)
+
+        start = perf_counter()
+        indexes = {name: TestDefinitionIndex.scan(path.join(template_dir, name)) for name in test_names(test_cases)}
+        render_caches = {name: RenderCache(make_test_env(path.join(template_dir, name)), False) for name in indexes}
+        rendered: Dict[Tuple[str, str, str], str] = {}
+        for tc in test_cases:
+            namespace = tc.namespace("")
+            for entry in indexes[tc.name].entries:
+                if entry.template_name is not None:
+                    rendered[(tc.tid, entry.rel_dir, entry.file_name)] = "".join(
+                        render_caches[tc.name].generate(entry.template_name, tc.values, namespace)
+                    )
+        timings["render"].append(perf_counter() - start)
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            start = perf_counter()
+            for tc in test_cases:
+                td_root = path.join(template_dir, tc.name)
+                tc_root = path.join(output_dir, tc.name, tc.tid)
+                os.makedirs(tc_root, exist_ok=True)
+                for dir_name in indexes[tc.name].dirs:
+                    os.makedirs(path.join(tc_root, dir_name), exist_ok=True)
+                for entry in indexes[tc.name].entries:
+                    source = path.join(td_root, entry.rel_dir, entry.file_name)
+                    if entry.template_name is not None:
+                        dest = path.join(tc_root, entry.rel_dir, re.sub(PATTERN_EXTENSION_JINJA, "", entry.file_name))
+                        write_rendered(dest, [rendered[(tc.tid, entry.rel_dir, entry.file_name)]])
+                        os.chmod(dest, entry.mode)
+                    else:
+                        link_file(source, path.join(tc_root, entry.rel_dir, entry.file_name), "copy")
+            timings["write"].append(perf_counter() - start)
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            start = perf_counter()
+            expand(suite, [ets], template_dir, path.join(output_dir, "tests"), kuttl_tests, "", jobs=jobs)
+            timings["expand"].append(perf_counter() - start)
+
+        stats = {
+            "test_cases": len(test_cases),
+            "templates": len(rendered),
+            "files": sum(len(indexes[tc.name].entries) for tc in test_cases),
+            "rendered_bytes": sum(len(r.encode("utf-8")) for r in rendered.values()),
+        }
+
+    return {
+        "beku": __version__,
+        "jinja2": jinja2.__version__,
+        "python": platform.python_version(),
+        "suite": suite,
+        "repeat": repeat,
+        "jobs": jobs,
+        "stats": stats,
+        "phases": {phase: {"min": min(t), "median": median(t)} for phase, t in timings.items()},
+    }
+
+
+def compare(
+    baseline: Dict[str, Any], result: Dict[str, Any], threshold: float, noise: float = DEFAULT_NOISE
+) -> List[str]:
+    """Compare the minimum time of each phase with the baseline.
+    Return a message for every phase that is slower than the baseline by more than threshold (a fraction)."""
+    regressions = []
+    for phase, timing in result["phases"].items():
+        if phase not in baseline["phases"]:
+            continue
+        before = baseline["phases"][phase]["min"]
+        after = timing["min"]
+        if after > before * (1 + threshold) and after - before > noise:
+            change = f"{(after / before - 1) * 100:+.1f}%" if before else "new"
+            regressions.append(f"Phase [{phase}] regressed from {before:.4f}s to {after:.4f}s ({change})")
+    return regressions
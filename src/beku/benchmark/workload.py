@@ -0,0 +1,120 @@
+"""Generate synthetic test definitions and template trees."""
+
+from __future__ import annotations
+
+import os
+import random
+from dataclasses import asdict, dataclass
+from os import path, makedirs
+from typing import Any, Dict, List
+
+import yaml
+
+KUTTL_TEST_TEMPLATE: str = """---
+apiVersion: kuttl.dev/v1beta1
+kind: TestSuite
+testDirs:
+{% for testcase in testinput.tests %}
+  - ./tests/{{ testcase.name }}
+{% endfor %}
+"""
+
+
+@dataclass(frozen=True)
+class Workload:
+    """Parameters of a synthetic workload.
+
+    Attributes:
+        dimensions (int) : Number of test dimensions.
+        values (int) : Number of values per dimension.
+        tests (int) : Number of test definitions.
+        dims_per_test (int) : Number of dimensions used by each test definition.
+        files (int) : Number of files per test definition.
+        file_size (int) : Approximate size of each file in bytes.
+        template_ratio (float) : Fraction of the files that are templates.
+        seed (int) : Seed for the random generator. The same parameters always generate the same workload.
+    """
+
+    dimensions: int = 4
+    values: int = 3
+    tests: int = 8
+    dims_per_test: int = 3
+    files: int = 20
+    file_size: int = 2048
+    template_ratio: float = 0.5
+    seed: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    def test_definition(self, rnd: random.Random) -> Dict[str, Any]:
+        dimensions: List[Dict[str, Any]] = [
+            {"name": f"dim{d}", "values": [f"{v}.0.0-stackable0.0.0-dev" for v in range(self.values)]}
+            for d in range(self.dimensions)
+        ]
+        tests = [
+            {
+                "name": f"test{t}",
+                "dimensions": sorted(
+                    rnd.sample([d["name"] for d in dimensions], min(self.dims_per_test, len(dimensions)))
+                ),
+            }
+            for t in range(self.tests)
+        ]
+        suites = [
+            {"name": "latest", "patch": [{"dimensions": [{"expr": "last"}]}]},
+            {"name": "first-half", "select": [t["name"] for t in tests[: max(1, len(tests) // 2)]]},
+        ]
+        return {"dimensions": dimensions, "tests": tests, "suites": suites}
+
+    def generate(self, root: str) -> str:
+        """Write the workload below root and return the path of the generated "tests" folder."""
+        rnd = random.Random(self.seed)
+        tests_dir = path.join(root, "tests")
+        template_dir = path.join(tests_dir, "templates", "kuttl")
+        makedirs(template_dir, exist_ok=True)
+        test_definition = self.test_definition(rnd)
+        with open(path.join(tests_dir, "test-definition.yaml"), encoding="utf8", mode="w") as stream:
+            yaml.safe_dump(test_definition, stream, sort_keys=False)
+        with open(path.join(tests_dir, "kuttl-test.yaml.jinja2"), encoding="utf8", mode="w") as stream:
+            stream.write(KUTTL_TEST_TEMPLATE)
+        templates = round(self.files * self.template_ratio)
+        for test in test_definition["tests"]:
+            td_root = path.join(template_dir, test["name"])
+            makedirs(td_root, exist_ok=True)
+            for f in range(self.files):
+                if f < templates:
+                    file_name = f"{f:02d}-install.yaml.j2"
+                    content = _template_content(rnd, test["dimensions"], self.file_size)
+                else:
+                    file_name = f"{f:02d}-assert.yaml"
+                    content = _static_content(rnd, self.file_size)
+                with open(path.join(td_root, file_name), encoding="utf8", mode="w") as stream:
+                    stream.write(content)
+                if f % 5 == 4:
+                    os.chmod(path.join(td_root, file_name), 0o755)
+        return tests_dir
+
+
+def _static_content(rnd: random.Random, size: int) -> str:
+    lines: List[str] = ["---", "apiVersion: v1", "kind: ConfigMap", "data:"]
+    while sum(len(line) + 1 for line in lines) < size:
+        lines.append(f"  key{len(lines)}: {rnd.getrandbits(64):016x}")
+    return "\n".join(lines) + "\n"
+
+
+def _template_content(rnd: random.Random, dimensions: List[str], size: int) -> str:
+    """A template that uses a random subset of the test dimensions, NAMESPACE and some Jinja statements."""
+    used = rnd.sample(dimensions, rnd.randint(0, len(dimensions))) if dimensions else []
+    lines: List[str] = ["---", "apiVersion: v1", "kind: ConfigMap", "metadata:"]
+    if rnd.random() < 0.5:
+        lines.append("  namespace: {{ NAMESPACE }}")
+    lines.append("data:")
+    for dim in used:
+        lines.append(f"  {dim}: \"{{{{ test_scenario['values']['{dim}'] }}}}\"")
+        lines.append(f"{{% if test_scenario['values']['{dim}'].startswith('0.') %}}")
+        lines.append(f'  {dim}-first: "true"')
+        lines.append("{% endif %}")
+    while sum(len(line) + 1 for line in lines) < size:
+        lines.append(f"  key{len(lines)}: {rnd.getrandbits(64):016x}")
+    return "\n".join(lines) + "\n"
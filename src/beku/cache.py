@@ -0,0 +1,213 @@
+"""Persistent caches for compiled templates and resolved test suites."""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import tempfile
+from hashlib import sha256
+from os import path, makedirs
+from typing import Any, Optional
+
+import jinja2
+from jinja2 import Environment
+from jinja2.bccache import Bucket, FileSystemBytecodeCache
+
+from .version import __version__
+
+ENV_CACHE_DIR: str = "BEKU_CACHE_DIR"
+DEFAULT_CACHE_MAX_SIZE: int = 64 * 1024 * 1024
+CACHE_FILE_PATTERN: str = "beku-%s.cache"
+SUITE_CACHE_FILE_PATTERN: str = "beku-suites-%s.cache"
+USAGE_CACHE_FILE_PATTERN: str = "beku-usage-%s.cache"
+
+
+class SuiteCache:
+    """Persist resolved test suites between beku runs.
+
+    Entries are JSON documents keyed by the content of the test definition file, the resolved suite, the selected
+    test cases and the beku version. They live in the same directory as the template cache and are evicted
+    together with its entries.
+    """
+
+    def __init__(self, directory: str) -> None:
+        makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def key(self, content: bytes, suite: Optional[str], selection: str = "") -> str:
+        """Return the key of the test definition file content resolved for the suite and test case selection."""
+        return sha256(
+            b"\0".join([__version__.encode("utf-8"), str(suite).encode("utf-8"), selection.encode("utf-8"), content])
+        ).hexdigest()
+
+    def _file_name(self, key: str) -> str:
+        return path.join(self.directory, SUITE_CACHE_FILE_PATTERN % key)
+
+    def load(self, key: str) -> Optional[Any]:
+        """Return the cached data or None if there is no (readable) entry for the key."""
+        file_name = self._file_name(key)
+        try:
+            with open(file_name, encoding="utf8") as stream:
+                data = json.load(stream)
+            os.utime(file_name)
+        except (OSError, ValueError):
+            return None
+        logging.debug("Suite cache hit %s", key)
+        return data
+
+    def store(self, key: str, data: Any) -> None:
+        logging.debug("Suite cache store %s", key)
+        file_name = self._file_name(key)
+        with tempfile.NamedTemporaryFile(
+            mode="w", encoding="utf8", dir=self.directory, prefix=path.basename(file_name), suffix=".tmp", delete=False
+        ) as stream:
+            json.dump(data, stream)
+        try:
+            os.replace(stream.name, file_name)
+        except OSError:
+            os.remove(stream.name)
+
+
+class TemplateCache(FileSystemBytecodeCache):
+    """A Jinja bytecode cache that persists compiled templates between beku runs.
+
+    Entries are keyed by the template name, the template source hash, the environment options that affect
+    compilation and the beku and Jinja versions. They are independent of the absolute location of the template
+    directory, so checkouts in different directories share the same entries.
+
+    Next to the compiled templates, the cache keeps the test case variables every template uses, so the render
+    cache doesn't need to parse the templates in a warm run.
+
+    The size of the cache directory is capped to max_size bytes. When the cap is exceeded, the least recently used
+    entries are evicted.
+    """
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_CACHE_MAX_SIZE) -> None:
+        makedirs(directory, exist_ok=True)
+        super().__init__(directory, CACHE_FILE_PATTERN)
+        self.max_size = max_size
+
+    def get_bucket(self, environment: Environment, name: str, filename: Optional[str], source: str) -> Bucket:
+        bucket = Bucket(environment, self._key(environment, name, source), self.get_source_checksum(source))
+        self.load_bytecode(bucket)
+        return bucket
+
+    def _key(self, environment: Environment, name: str, source: str) -> str:
+        return sha256(
+            "\0".join(
+                [
+                    __version__,
+                    jinja2.__version__,
+                    _compile_options(environment),
+                    name,
+                    self.get_source_checksum(source),
+                ]
+            ).encode("utf-8")
+        ).hexdigest()
+
+    def load_usage(self, environment: Environment, name: str, source: str) -> Optional[Any]:
+        """Return the stored analysis of the template source or None if there is no (readable) entry."""
+        file_name = path.join(self.directory, USAGE_CACHE_FILE_PATTERN % self._key(environment, name, source))
+        try:
+            with open(file_name, encoding="utf8") as stream:
+                data = json.load(stream)
+            os.utime(file_name)
+        except (OSError, ValueError):
+            return None
+        logging.debug("Template usage cache hit %s", name)
+        return data
+
+    def store_usage(self, environment: Environment, name: str, source: str, data: Any) -> None:
+        """Store the analysis of the template source as JSON."""
+        file_name = path.join(self.directory, USAGE_CACHE_FILE_PATTERN % self._key(environment, name, source))
+        with tempfile.NamedTemporaryFile(
+            mode="w", encoding="utf8", dir=self.directory, prefix=path.basename(file_name), suffix=".tmp", delete=False
+        ) as stream:
+            json.dump(data, stream)
+        try:
+            os.replace(stream.name, file_name)
+        except OSError:
+            os.remove(stream.name)
+
+    def load_bytecode(self, bucket: Bucket) -> None:
+        super().load_bytecode(bucket)
+        if bucket.code is not None:
+            logging.debug("Template cache hit %s", bucket.key)
+            # Record the access for LRU eviction.
+            try:
+                os.utime(self._get_cache_filename(bucket))
+            except OSError:
+                pass
+
+    def dump_bytecode(self, bucket: Bucket) -> None:
+        logging.debug("Template cache store %s", bucket.key)
+        super().dump_bytecode(bucket)
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache size is below max_size."""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith("beku-") and entry.name.endswith(".cache"):
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+        if total <= self.max_size:
+            return
+        for _, size, entry_path in sorted(entries):
+            if total <= self.max_size:
+                break
+            logging.debug("Template cache evict %s", entry_path)
+            try:
+                os.remove(entry_path)
+            except OSError:
+                continue
+            total -= size
+
+
+def _compile_options(env: Environment) -> str:
+    """Return a string with the environment options that change the compiled code of a template."""
+    return repr(
+        (
+            env.block_start_string,
+            env.block_end_string,
+            env.variable_start_string,
+            env.variable_end_string,
+            env.comment_start_string,
+            env.comment_end_string,
+            env.line_statement_prefix,
+            env.line_comment_prefix,
+            env.trim_blocks,
+            env.lstrip_blocks,
+            env.newline_sequence,
+            env.keep_trailing_newline,
+            env.optimized,
+            env.autoescape if isinstance(env.autoescape, bool) else None,
+            sorted(env.extensions),
+        )
+    )
+
+
+def template_cache_from(cache_dir: Optional[str], max_size: int = DEFAULT_CACHE_MAX_SIZE) -> Optional[TemplateCache]:
+    """Create a template cache in cache_dir or in the directory given by the BEKU_CACHE_DIR environment variable.
+    Return None if neither is set, which disables the cache."""
+    directory = cache_dir or os.environ.get(ENV_CACHE_DIR)
+    if not directory:
+        return None
+    logging.debug("Using template cache in %s", directory)
+    return TemplateCache(path.abspath(directory), max_size)
+
+
+def suite_cache_from(cache_dir: Optional[str]) -> Optional[SuiteCache]:
+    """Create a suite cache in cache_dir or in the directory given by the BEKU_CACHE_DIR environment variable.
+    Return None if neither is set, which disables the cache."""
+    directory = cache_dir or os.environ.get(ENV_CACHE_DIR)
+    if not directory:
+        return None
+    return SuiteCache(path.abspath(directory))
@@ -0,0 +1,172 @@
+"""Check the templates of the test definitions without expanding the test suite."""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from os import path
+from typing import Any, Dict, List, Optional, Tuple
+
+from jinja2 import Environment, FileSystemLoader, StrictUndefined, TemplateSyntaxError
+
+from .kuttl import (
+    PATTERN_EXTENSION_JINJA,
+    EffectiveTestSuite,
+    TestCase,
+    TestCases,
+    TestDefinitionIndex,
+    make_test_env,
+)
+
+
+@dataclass(frozen=True)
+class CheckError:
+    """An error found in a template.
+
+    Attributes:
+        file_name (str) : The template or directory that has the error.
+        line (Optional[int]) : Line of the error in the template, if known.
+        message (str) : Description of the error.
+    """
+
+    file_name: str
+    line: Optional[int]
+    message: str
+
+    def __str__(self) -> str:
+        if self.line is None:
+            return f"{self.file_name}: {self.message}"
+        return f"{self.file_name}:{self.line}: {self.message}"
+
+
+@dataclass(frozen=True)
+class _CheckTask:
+    """Templates found below root that are checked by the same worker.
+
+    Attributes:
+        root (str) : Root of the template loader.
+        template_names (Tuple[str, ...]) : Names of the templates relative to root.
+        context (Optional[Dict[str, Any]]) : If given, every template is rendered once with this context.
+        test_definition (bool) : True if the templates belong to a test definition and are loaded like expand()
+                                 does, False for the kuttl test suite template.
+    """
+
+    root: str
+    template_names: Tuple[str, ...]
+    context: Optional[Dict[str, Any]]
+    test_definition: bool = True
+
+
+def check(
+    suites: List[str],
+    effective_test_suites: List[EffectiveTestSuite],
+    template_dir: str,
+    kuttl_tests: str,
+    namespace: str,
+    jobs: int = 1,
+) -> List[CheckError]:
+    """Compile every template below template_dir and the kuttl test suite template with up to jobs worker processes,
+    without writing anything. The templates of every test definition used by the test suites are also rendered
+    once with a representative test case, the first one of the test definition, and the kuttl test suite template
+    is rendered with the tests of the test suites. Undefined variables are errors when rendering.
+    Return the errors of all templates.
+    """
+    selected = [ets for ets in effective_test_suites if ets.name in suites]
+    representatives = representative_test_cases(selected)
+    errors: List[CheckError] = []
+    tasks: List[_CheckTask] = []
+    with os.scandir(template_dir) as it:
+        entries = sorted(it, key=lambda e: e.name)
+    for entry in entries:
+        if entry.is_dir():
+            try:
+                index = TestDefinitionIndex.scan(entry.path)
+            except (OSError, ValueError) as exc:
+                errors.append(CheckError(entry.path, None, str(exc)))
+                continue
+            tc = representatives.get(entry.name)
+            context = {"test_scenario": {"values": tc.values}, "NAMESPACE": tc.namespace(namespace)} if tc else None
+            template_names = tuple(e.template_name for e in index.entries if e.template_name is not None)
+            tasks.append(_CheckTask(entry.path, template_names, context))
+        elif re.search(PATTERN_EXTENSION_JINJA, entry.name):
+            tasks.append(_CheckTask(template_dir, (entry.name,), None))
+    for name in representatives:
+        if not path.isdir(path.join(template_dir, name)):
+            errors.append(CheckError(path.join(template_dir, name), None, "Test definition directory not found"))
+    if path.isfile(kuttl_tests):
+        context = {"testinput": {"tests": [{"name": name} for name in representatives]}}
+        tasks.append(_CheckTask(path.dirname(kuttl_tests), (path.basename(kuttl_tests),), context, False))
+    else:
+        errors.append(CheckError(kuttl_tests, None, "Kuttl test config template not found"))
+
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as executor:
+            results = list(executor.map(_check_templates, tasks))
+    else:
+        results = [_check_templates(task) for task in tasks]
+    for result in results:
+        errors.extend(result)
+    logging.info(
+        "Checked %d templates, rendered %d test definitions: %d error(s)",
+        sum(len(task.template_names) for task in tasks),
+        sum(1 for task in tasks if task.test_definition and task.context is not None),
+        len(errors),
+    )
+    return errors
+
+
+def representative_test_cases(effective_test_suites: List[EffectiveTestSuite]) -> Dict[str, TestCase]:
+    """Return the first test case of every test definition of the effective test suites. The test cases of test
+    matrices are not created, only the first one of each matrix."""
+    result: Dict[str, TestCase] = {}
+    for ets in effective_test_suites:
+        test_cases = ets.test_cases
+        if isinstance(test_cases, TestCases):
+            for matrix in test_cases.matrices:
+                if len(matrix) and matrix.name not in result:
+                    result[matrix.name] = matrix[0]
+        else:
+            for tc in test_cases:
+                result.setdefault(tc.name, tc)
+    return result
+
+
+def _check_templates(task: _CheckTask) -> List[CheckError]:
+    """Compile and, if the task has a context, render the templates of the task. Return their errors."""
+    if task.test_definition:
+        env = make_test_env(task.root)
+    else:
+        env = Environment(loader=FileSystemLoader(task.root))
+    env.undefined = StrictUndefined
+    errors = []
+    for template_name in task.template_names:
+        file_name = path.join(task.root, template_name)
+        try:
+            template = env.get_template(template_name)
+        except TemplateSyntaxError as exc:
+            errors.append(CheckError(exc.filename or file_name, exc.lineno, exc.message or str(exc)))
+            continue
+        except (OSError, UnicodeDecodeError) as exc:
+            errors.append(CheckError(file_name, None, f"{type(exc).__name__}: {exc}"))
+            continue
+        if task.context is None:
+            continue
+        try:
+            for _ in template.generate(task.context):
+                pass
+        except Exception as exc:
+            errors.append(CheckError(*_template_location(exc, file_name), f"{type(exc).__name__}: {exc}"))
+    return errors
+
+
+def _template_location(exc: BaseException, file_name: str) -> Tuple[str, Optional[int]]:
+    """Return the template and line where the exception was raised. Jinja rewrites the tracebacks of render
+    errors so they point to the lines of the templates, including templates that are included by others."""
+    for frame in reversed(traceback.extract_tb(exc.__traceback__)):
+        if re.search(PATTERN_EXTENSION_JINJA, frame.filename):
+            return frame.filename, frame.lineno
+    return file_name, None
@@ -0,0 +1,80 @@
+"""Generate covering arrays for n-wise reduction of test matrices."""
+
+from __future__ import annotations
+
+from itertools import combinations, product
+from typing import List, Optional, Set, Tuple
+
+# A t-tuple of dimension values: the indices of t-1 earlier dimensions with their value indices and
+# the value index of the current dimension.
+_Interaction = Tuple[Tuple[int, ...], Tuple[int, ...]]
+
+
+def covering_array(sizes: List[int], strength: int) -> List[Tuple[int, ...]]:
+    """Return rows of value indices such that every combination of values of any strength dimensions appears in
+    at least one row. sizes is the number of values of every dimension.
+
+    The rows are built with the in-parameter-order (IPOG) strategy: the product of the first strength dimensions
+    is extended one dimension at a time, first by choosing the value of the new dimension that covers the most
+    missing combinations in every existing row and then by adding rows for the combinations that are still
+    missing. Dimensions are processed from the largest to the smallest. The result only depends on sizes and
+    strength.
+    """
+    if any(size == 0 for size in sizes):
+        return []
+    if strength >= len(sizes):
+        return list(product(*(range(size) for size in sizes)))
+    order = sorted(range(len(sizes)), key=lambda d: (-sizes[d], d))
+    ordered = [sizes[d] for d in order]
+    rows: List[List[Optional[int]]] = [list(r) for r in product(*(range(size) for size in ordered[:strength]))]
+    for dim in range(strength, len(ordered)):
+        column_sets = list(combinations(range(dim), strength - 1))
+        uncovered: Set[_Interaction] = {
+            (cols, values + (value,))
+            for cols in column_sets
+            for values in product(*(range(ordered[c]) for c in cols))
+            for value in range(ordered[dim])
+        }
+        # Horizontal growth: extend the existing rows with the best value of the new dimension.
+        for row in rows:
+            best_value, best_gain = 0, -1
+            for value in range(ordered[dim]):
+                gain = sum(1 for interaction in _interactions(row, column_sets, value) if interaction in uncovered)
+                if gain > best_gain:
+                    best_value, best_gain = value, gain
+            row.append(best_value)
+            uncovered.difference_update(_interactions(row, column_sets, best_value))
+        # Vertical growth: add rows for the combinations that are still missing. Values that don't matter are
+        # left open so later combinations can use them.
+        open_rows = [row for row in rows if None in row]
+        for cols, values in sorted(uncovered):
+            for row in open_rows:
+                if row[dim] == values[-1] and all(row[c] is None or row[c] == v for c, v in zip(cols, values[:-1])):
+                    break
+            else:
+                row = [None] * dim + [values[-1]]
+                rows.append(row)
+                open_rows.append(row)
+            for c, v in zip(cols, values[:-1]):
+                row[c] = v
+    result = []
+    for row in rows:
+        filled = [0 if v is None else v for v in row]
+        # Back to the order of the dimensions given by sizes
+        result.append(tuple(filled[order.index(d)] for d in range(len(sizes))))
+    return result
+
+
+def _interactions(row: List[Optional[int]], column_sets: List[Tuple[int, ...]], value: int) -> List[_Interaction]:
+    """The interactions of the value of the new dimension with the values of the row. Open values are skipped."""
+    result = []
+    for cols in column_sets:
+        values: List[int] = []
+        for c in cols:
+            v = row[c]
+            if v is None:
+                break
+            values.append(v)
+        else:
+            result.append((cols, (*values, value)))
+    return result
@@ -2,22 +2,52 @@
 
 from __future__ import annotations
 
+import json
 import logging
 import os
 import re
-from dataclasses import dataclass, field
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
+from dataclasses import FrozenInstanceError, dataclass, field
 from functools import cached_property
 from hashlib import sha256
-from itertools import product, chain
-from os import walk, path, makedirs
-from shutil import copy2
-from typing import Dict, List, Tuple, Any, Optional
-
-from jinja2 import Environment, FileSystemLoader
-from yaml import safe_load
+from functools import reduce
+from itertools import chain, islice, product
+from operator import mul
+from os import path
+from shutil import rmtree
+from time import perf_counter
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, overload
+
+from jinja2 import BaseLoader, BytecodeCache, Environment, FileSystemLoader
+from yaml import load
+
+try:
+    # Use the much faster libyaml loader when it is available
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # pragma: no cover
+    from yaml import SafeLoader  # type: ignore[assignment]
+
+from .cache import SuiteCache
+from .covering import covering_array
+from .render import RenderCache
+from .shard import Shard
+from .sink import DirectorySink, MemorySink, OutputSink
+from .timings import Timings, phase
+from .manifest import Manifest, hash_test_case, hash_test_definition
 
 PATTERN_EXTENSION_JINJA: str = r"\.j(inja)?2$"
 
+# Maximum number of test cases sent to a worker process at once.
+MAX_CHUNK_SIZE: int = 64
+
+# Maximum nesting level of directories in a test definition, including the test definition root itself.
+MAX_DIR_LEVEL: int = 8
+
+# Writes to the file system when no other output sink is given.
+FILE_SYSTEM: OutputSink = DirectorySink()
+
 
 def ansible_lookup(loc: str, what: str) -> str:
     """
@@ -35,6 +65,48 @@ def ansible_lookup(loc: str, what: str) -> str:
     return result
 
 
+class MemoryLoader(FileSystemLoader):
+    """A file system loader that reads every template source only once and keeps it in memory.
+
+    The sources are only reported as outdated after they have been invalidated, so Jinja doesn't stat the
+    template files again when a compiled template is looked up in the environment cache.
+    """
+
+    def __init__(self, searchpath: str) -> None:
+        super().__init__(searchpath)
+        self._sources: Dict[str, Tuple[str, str]] = {}
+
+    def get_source(self, environment: Environment, template: str) -> Tuple[str, str, Callable[[], bool]]:
+        if template not in self._sources:
+            source, file_name, _ = super().get_source(environment, template)
+            self._sources[template] = (source, file_name)
+        entry = self._sources[template]
+        return entry[0], entry[1], lambda: self._sources.get(template) is entry
+
+    def invalidate(self, template: str) -> None:
+        """Forget the source of the template. It is read and compiled again the next time it is used."""
+        self._sources.pop(template, None)
+
+
+def make_test_env(
+    td_root: str, loader: Optional[BaseLoader] = None, bytecode_cache: Optional[BytecodeCache] = None
+) -> Environment:
+    """Create the Jinja environment used to render the templates of the test definition found in td_root.
+    The environment is shared by all test cases of the test definition, so every template is compiled only once.
+    Test case specific variables like NAMESPACE are passed as render context and not as globals.
+    If given, the bytecode_cache persists the compiled templates between runs.
+    """
+    env = Environment(
+        loader=loader or MemoryLoader(td_root),
+        trim_blocks=True,
+        auto_reload=True,
+        cache_size=-1,
+        bytecode_cache=bytecode_cache,
+    )
+    env.globals["lookup"] = ansible_lookup
+    return env
+
+
 @dataclass(frozen=True)
 class TestFile:
     """An input test file, not a template."""
@@ -42,18 +114,17 @@ class TestFile:
     dest_dir: str
     source_dir: str
     file_name: str
+    link_mode: str = "copy"
+    sink: OutputSink = FILE_SYSTEM
 
     def build_destination(self) -> str:
-        """Copies the file name to the destination directory.
+        """Copies (or links) the file name to the destination directory of the sink.
         Returns the destination file name.
         """
         source = path.join(self.source_dir, self.file_name)
         dest = path.join(self.dest_dir, self.file_name)
-        logging.debug("Copy file %s to %s", source, dest)
-        copy2(source, dest)
-        logging.debug("Update file mode for %s", dest)
-        f_mode = os.stat(source).st_mode
-        os.chmod(dest, f_mode)
+        logging.debug("%s file %s to %s", self.link_mode.capitalize(), source, dest)
+        self.sink.copy(source, dest, self.link_mode)
         return dest
 
 
@@ -64,37 +135,149 @@ class TestTemplate:
     dest_dir: str
     source_dir: str
     file_name: str
+    template_name: str
     env: Environment
     values: Dict[str, str]
+    namespace: str
+    mode: Optional[int] = None
+    render_cache: Optional[RenderCache] = None
+    timings: Optional[Timings] = None
+    sink: OutputSink = FILE_SYSTEM
 
     def build_destination(self) -> str:
-        """Renders the template to file in the destination directory. The resulting file has the same name as the
-        template but with the .j2 or .jinja2 ending removed.
+        """Renders the template to file in the destination directory of the sink. The resulting file has the same
+        name as the template but with the .j2 or .jinja2 ending removed. The file mode is copied from the template
+        unless it is given by the mode attribute.
         Returns the rendered file name.
         """
         source = path.join(self.source_dir, self.file_name)
         dest = path.join(self.dest_dir, re.sub(PATTERN_EXTENSION_JINJA, "", self.file_name))
         logging.debug("Render template %s to %s", source, dest)
-        template = self.env.get_template(self.file_name)
-        with open(dest, encoding="utf8", mode="w") as stream:
-            print(template.render({"test_scenario": {"values": self.values}}), file=stream)
-        logging.debug("Update file mode for %s", dest)
-        f_mode = os.stat(source).st_mode
-        os.chmod(dest, f_mode)
+        start = perf_counter()
+        # The template is compiled the first time it is requested
+        template = self.env.get_template(self.template_name)
+        compiled = perf_counter()
+        if self.render_cache is not None:
+            chunks = self.render_cache.generate(self.template_name, self.values, self.namespace)
+        else:
+            chunks = template.generate({"test_scenario": {"values": self.values}, "NAMESPACE": self.namespace})
+        f_mode = os.stat(source).st_mode if self.mode is None else self.mode
+        written = self.sink.bytes_written
+        self.sink.write(dest, chunks, f_mode)
+        if self.timings is not None:
+            self.timings.add_template(
+                source, compiled - start, perf_counter() - compiled, self.sink.bytes_written - written
+            )
         return dest
 
 
-def make_test_source_with_context(
-    file_name: str, source_dir: str, dest_dir: str, env: Environment, values: Dict[str, str]
-) -> TestFile | TestTemplate:
-    """Construct a test source object (file or template) from the given arguments."""
-    if re.search(PATTERN_EXTENSION_JINJA, file_name):
-        return TestTemplate(file_name=file_name, source_dir=source_dir, dest_dir=dest_dir, env=env, values=values)
+@dataclass(frozen=True)
+class TestSourceEntry:
+    """A file of a test definition as found by scanning the test definition directory.
 
-    return TestFile(file_name=file_name, source_dir=source_dir, dest_dir=dest_dir)
+    Attributes:
+        rel_dir (str) : Directory of the file relative to the test definition root. Empty for the root itself.
+        file_name (str) : Name of the file.
+        template_name (Optional[str]) : Name of the template in the Jinja environment or None if the file is not
+                                        a template.
+        mode (int) : File mode to apply to the destination file.
+    """
+
+    rel_dir: str
+    file_name: str
+    template_name: Optional[str]
+    mode: int
+
+    def destination(self, tc_root: str) -> str:
+        """Return the name of the file built from this entry in the test case directory tc_root."""
+        file_name = re.sub(PATTERN_EXTENSION_JINJA, "", self.file_name) if self.template_name else self.file_name
+        return path.join(tc_root, self.rel_dir, file_name)
+
+    def make_test_source(
+        self,
+        td_root: str,
+        tc_root: str,
+        env: Environment,
+        values: Dict[str, str],
+        namespace: str,
+        link_mode: str = "copy",
+        render_cache: Optional[RenderCache] = None,
+        timings: Optional[Timings] = None,
+        sink: OutputSink = FILE_SYSTEM,
+    ) -> TestFile | TestTemplate:
+        """Construct the test source object (file or template) that builds this file for a test case in the sink.
+        If given, the render_cache shares rendered templates with other test cases and timings records the
+        compile and render times of templates."""
+        source_dir = path.join(td_root, self.rel_dir)
+        dest_dir = path.join(tc_root, self.rel_dir)
+        if self.template_name is not None:
+            return TestTemplate(
+                file_name=self.file_name,
+                source_dir=source_dir,
+                dest_dir=dest_dir,
+                template_name=self.template_name,
+                env=env,
+                values=values,
+                namespace=namespace,
+                mode=self.mode,
+                render_cache=render_cache,
+                timings=timings,
+                sink=sink,
+            )
+        return TestFile(
+            file_name=self.file_name, source_dir=source_dir, dest_dir=dest_dir, link_mode=link_mode, sink=sink
+        )
 
 
 @dataclass(frozen=True)
+class TestDefinitionIndex:
+    """The directories and files of a test definition. Test definitions are scanned once per run and all their test
+    cases are expanded from the same index.
+
+    Attributes:
+        td_root (str) : Root directory of the test definition.
+        dirs (Tuple[str, ...]) : Sub-directories relative to td_root. Parents are listed before their children.
+        entries (Tuple[TestSourceEntry, ...]) : Files of the test definition.
+    """
+
+    td_root: str
+    dirs: Tuple[str, ...]
+    entries: Tuple[TestSourceEntry, ...]
+
+    @classmethod
+    def scan(cls, td_root: str) -> TestDefinitionIndex:
+        """Scan the test definition directory. Symbolic links to directories are created in the test case but
+        not followed, the same as os.walk() does. Entries are sorted by name.
+        Raises ValueError if the directories are nested deeper than MAX_DIR_LEVEL."""
+        dirs: List[str] = []
+        entries: List[TestSourceEntry] = []
+        pending: List[Tuple[str, int]] = [("", 1)]
+        while pending:
+            rel_dir, level = pending.pop(0)
+            if level == MAX_DIR_LEVEL:
+                # Sanity check
+                raise ValueError(f"Maximum recursive level ({MAX_DIR_LEVEL}) reached.")
+            with os.scandir(path.join(td_root, rel_dir)) as it:
+                # Sorted, so the files are always expanded in the same order
+                for entry in sorted(it, key=lambda e: e.name):
+                    rel_path = path.join(rel_dir, entry.name)
+                    if entry.is_dir():
+                        dirs.append(rel_path)
+                        if not entry.is_symlink():
+                            pending.append((rel_path, level + 1))
+                    else:
+                        is_template = re.search(PATTERN_EXTENSION_JINJA, entry.name)
+                        entries.append(
+                            TestSourceEntry(
+                                rel_dir=rel_dir,
+                                file_name=entry.name,
+                                template_name="/".join(rel_path.split(os.sep)) if is_template else None,
+                                mode=entry.stat().st_mode,
+                            )
+                        )
+        return cls(td_root=td_root, dirs=tuple(dirs), entries=tuple(entries))
+
+
 class TestCase:
     """A test case is an instance of  test definition together with a set of Jinja variables used to render all
     templates that are part of the said test definition.
@@ -103,50 +286,144 @@ class TestCase:
     * "test-definition" is the name of the test
     * "name_k" is the name of a Jinja variable
     * "value_k" is the value of the Jinja variable.
+
+    Test matrices create millions of test cases, so they are kept small: the test cases of a matrix share the tuple
+    of dimension names, the values are a tuple in the same order and all strings are interned. Test matrices
+    compute the test ids in bulk. Test cases are immutable and compare equal if they have the same name and values.
+
+    Attributes:
+        name (str) : Name of the test definition.
+        dimension_names (Tuple[str, ...]) : Names of the Jinja variables.
+        row (Tuple[str, ...]) : Values of the Jinja variables in the order of dimension_names.
     """
 
+    __slots__ = ("name", "dimension_names", "row", "_tid", "_namespace")
+
     name: str
-    values: Dict[str, str]
+    dimension_names: Tuple[str, ...]
+    row: Tuple[str, ...]
+    _tid: Optional[str]
+    _namespace: Optional[str]
+
+    def __init__(self, name: str, values: Dict[str, str]) -> None:
+        _init_test_case(
+            self,
+            _intern(name),
+            tuple(_intern(k) for k in values),
+            tuple(_intern(v) for v in values.values()),
+            None,
+        )
 
-    @cached_property
+    @classmethod
+    def from_row(
+        cls, name: str, dimension_names: Tuple[str, ...], row: Tuple[str, ...], tid: Optional[str] = None
+    ) -> TestCase:
+        """Create a test case from interned strings without copying them. If given, tid is the test id."""
+        test_case = cls.__new__(cls)
+        _init_test_case(test_case, name, dimension_names, row, tid)
+        return test_case
+
+    @property
+    def values(self) -> Dict[str, str]:
+        """The values of the Jinja variables by name. Returns a new dictionary on every call."""
+        return dict(zip(self.dimension_names, self.row))
+
+    @property
     def tid(self) -> str:
         """Return the test id. Used as destination folder name for the generated test case.
         The result is part of a full directory name of the test case. Therefore, the OS filesystem
         directory separator is replaced with underscore.
         """
-        return re.sub(
-            f"[{os.sep}:]",
-            "_",
-            "_".join(
-                chain(
-                    [self.name],
-                    [f"{k}-{v}" for k, v in self.values.items()],
-                )
-            ),
-        )
-
-    def expand(self, template_dir: str, target_dir: str, namespace: str) -> None:
-        """Expand test case This will create the target folder, copy files and render render templates."""
+        if self._tid is None:
+            tid = _safe_tid("_".join(chain([self.name], [f"{k}-{v}" for k, v in zip(self.dimension_names, self.row)])))
+            object.__setattr__(self, "_tid", tid)
+            return tid
+        return self._tid
+
+    def namespace(self, prefered_namespace: str) -> str:
+        """Return the namespace of the test case like determine_namespace() does. The generated namespace is only
+        computed once."""
+        if prefered_namespace:
+            return prefered_namespace
+        if self._namespace is None:
+            namespace = determine_namespace(self.tid, "")
+            object.__setattr__(self, "_namespace", namespace)
+            return namespace
+        return self._namespace
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise FrozenInstanceError(f"cannot assign to field '{name}'")
+
+    def __delattr__(self, name: str) -> None:
+        raise FrozenInstanceError(f"cannot delete field '{name}'")
+
+    def __eq__(self, other: object) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        assert isinstance(other, TestCase)
+        if self.name != other.name:
+            return False
+        if self.dimension_names == other.dimension_names:
+            return self.row == other.row
+        # Values in a different order are still the same values
+        return self.values == other.values
+
+    def __hash__(self) -> int:
+        return hash((self.name, frozenset(zip(self.dimension_names, self.row))))
+
+    def __repr__(self) -> str:
+        return f"TestCase(name={self.name!r}, values={self.values!r})"
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return TestCase.from_row, (self.name, self.dimension_names, self.row, self._tid)
+
+    def expand(
+        self,
+        template_dir: str,
+        target_dir: str,
+        namespace: str,
+        env: Optional[Environment] = None,
+        link_mode: str = "copy",
+        index: Optional[TestDefinitionIndex] = None,
+        render_cache: Optional[RenderCache] = None,
+        timings: Optional[Timings] = None,
+        sink: OutputSink = FILE_SYSTEM,
+    ) -> List[str]:
+        """Expand test case This will create the target folder, copy files and render render templates.
+        If given, env is the (shared) Jinja environment of the test definition, otherwise a new one is created.
+        The link_mode determines how files that are not templates are placed in the target folder.
+        If given, index lists the files of the test definition, otherwise the test definition is scanned.
+        If given, the render_cache shares rendered templates with other test cases of the same test definition.
+        If given, timings records the compile and render times of templates.
+        The files are written to the sink, by default to the file system.
+        Returns the names of the files created in the target folder.
+        """
         logging.info("Expanding test case id [%s]", self.tid)
         td_root = path.join(template_dir, self.name)
         tc_root = path.join(target_dir, self.name, self.tid)
-        _mkdir_ignore_exists(tc_root)
-        test_env = Environment(loader=FileSystemLoader(path.join(template_dir, self.name)), trim_blocks=True)
-        test_env.globals["lookup"] = ansible_lookup
-        test_env.globals["NAMESPACE"] = determine_namespace(self.tid, namespace)
-        sub_level: int = 0
-        for root, dirs, files in walk(td_root):
-            sub_level += 1
-            if sub_level == 8:
-                # Sanity check
-                raise ValueError("Maximum recursive level (8) reached.")
-            for dir_name in dirs:
-                _mkdir_ignore_exists(path.join(tc_root, root[len(td_root) + 1 :], dir_name))
-            for file_name in files:
-                test_source = make_test_source_with_context(
-                    file_name, root, path.join(tc_root, root[len(td_root) + 1 :]), test_env, self.values
-                )
-                test_source.build_destination()
+        sink.mkdir(tc_root)
+        test_env = env or make_test_env(td_root)
+        test_index = index or TestDefinitionIndex.scan(td_root)
+        tc_namespace = self.namespace(namespace)
+        for dir_name in test_index.dirs:
+            sink.mkdir(path.join(tc_root, dir_name))
+        dests = []
+        for entry in test_index.entries:
+            test_source = entry.make_test_source(
+                td_root, tc_root, test_env, self.values, tc_namespace, link_mode, render_cache, timings, sink
+            )
+            dests.append(test_source.build_destination())
+        return dests
+
+
+def _init_test_case(
+    test_case: TestCase, name: str, dimension_names: Tuple[str, ...], row: Tuple[str, ...], tid: Optional[str]
+) -> None:
+    object.__setattr__(test_case, "name", name)
+    object.__setattr__(test_case, "dimension_names", dimension_names)
+    object.__setattr__(test_case, "row", row)
+    object.__setattr__(test_case, "_tid", tid)
+    object.__setattr__(test_case, "_namespace", None)
 
 
 @dataclass(frozen=True, eq=True)
@@ -192,20 +469,31 @@ class TestSuitePatchDimension:
         result = []
         for dim in dims:
             if not self.name or self.name == dim.name:
-                patched_values = dim.values
-                if self.expr == "last":
-                    patched_values = [dim.values[-1]]
-                elif self.expr == "first":
-                    patched_values = [dim.values[0]]
-                elif self.expr:
-                    patched_values = [self.expr]
-
+                patched_values = _patch_values(self.expr, dim.values)
                 logging.debug(f"Patching dimension [{test_name}].[{dim.name}] value [{patched_values}]")
                 result.append(TestDimension(name=dim.name, values=patched_values))
             else:
                 result.append(dim)
         return result
 
+    def compose(self, previous: Optional[str]) -> Optional[str]:
+        """Return the expression that has the same effect as patching a dimension with the previous expression
+        and then with this one. After any expression, a dimension has a single value, which first and last keep."""
+        if not self.expr or (previous is not None and self.expr in ("first", "last")):
+            return previous
+        return self.expr
+
+
+def _patch_values(expr: Optional[str], values: List[str]) -> List[str]:
+    """Return the values of a dimension after patching them with expr."""
+    if expr == "last":
+        return [values[-1]]
+    if expr == "first":
+        return [values[0]]
+    if expr:
+        return [expr]
+    return values
+
 
 @dataclass(frozen=True)
 class TestSuitePatch:
@@ -259,11 +547,14 @@ class TestSuite:
         name (str) : Name of the test suite.
         select (List[str]) : Names of test definitions to select.
         patches : List of patches to apply to the selected tests.
+        strength (Optional[int]) : If given, the test cases of every test are reduced to a covering array in which
+                                   every combination of values of any strength dimensions appears at least once.
     """
 
     name: str
     select: List[str]
     patches: List[TestSuitePatch]
+    strength: Optional[int] = None
 
     @classmethod
     def from_dict(cls, _dict: Dict[str, Any]) -> TestSuite:
@@ -273,18 +564,40 @@ class TestSuite:
             name=_dict["name"],
             select=_dict.get("select", []),
             patches=[TestSuitePatch.from_dict(p) for p in _dict.get("patch", [])],
+            strength=_reduce_strength(_dict),
         )
 
+    @cached_property
+    def selection(self) -> FrozenSet[str]:
+        """The names of the selected test definitions."""
+        return frozenset(self.select)
+
+    @cached_property
+    def patch_table(self) -> Dict[Optional[str], Dict[Optional[str], Optional[str]]]:
+        """The patches compiled to one expression per test and dimension that has the same effect as applying all
+        of them in order. The table maps the names of the tests with patches of their own, or None for all other
+        tests, to the expressions by dimension name, or None for all other dimensions."""
+        table = {}
+        for test_name in [None, *dict.fromkeys(p.test for p in self.patches if p.test)]:
+            exprs: Dict[Optional[str], Optional[str]] = {None: None}
+            for patch in self.patches:
+                if patch.test and patch.test != test_name:
+                    continue
+                for pd in patch.patches:
+                    if pd.name:
+                        exprs[pd.name] = pd.compose(exprs.get(pd.name, exprs[None]))
+                    else:
+                        for dim_name, expr in exprs.items():
+                            exprs[dim_name] = pd.compose(expr)
+            table[test_name] = exprs
+        return table
+
     def select_tests(self, tests: List[TestDefinition]) -> List[TestDefinition]:
         """Return tests that match the selection list and discard all others. Return the given tests if the selection
         list is empty.
         """
         if self.select:
-            result = []
-            for input_test in tests:
-                if input_test.name in self.select:
-                    result.append(input_test)
-            return result
+            return [input_test for input_test in tests if input_test.name in self.selection]
         return tests
 
     def patch_dimensions(self, test_name: str, dims: List[TestDimension]) -> List[TestDimension]:
@@ -298,12 +611,275 @@ class TestSuite:
         Return:
             The dimensions after applying all patches.
         """
-        if self.patches:
-            result = {p.name: p for p in self.patches[0].patch_dimensions(test_name, dims)}
-            for patch in self.patches[1:]:
-                result = {p.name: p for p in patch.patch_dimensions(test_name, list(result.values()))}
-            return list(result.values())
-        return dims
+        exprs = self.patch_table.get(test_name, self.patch_table[None])
+        if not any(exprs.values()):
+            return dims
+        result = []
+        for dim in dims:
+            expr = exprs.get(dim.name, exprs[None])
+            if expr is None:
+                result.append(dim)
+            else:
+                patched_values = _patch_values(expr, dim.values)
+                logging.debug(f"Patching dimension [{test_name}].[{dim.name}] value [{patched_values}]")
+                result.append(TestDimension(name=dim.name, values=patched_values))
+        return result
+
+
+def _reduce_strength(_dict: Dict[str, Any]) -> Optional[int]:
+    """Return the strength of the reduction of a test suite given as "reduce: pairwise" or "n-wise: <k>"."""
+    if "reduce" in _dict and "n-wise" in _dict:
+        raise ValueError(f"Test suite [{_dict['name']}] must not have both [reduce] and [n-wise] properties")
+    if "reduce" in _dict:
+        if _dict["reduce"] != "pairwise":
+            raise ValueError(f"Test suite [{_dict['name']}] has an invalid [reduce] property [{_dict['reduce']}]")
+        return 2
+    if "n-wise" in _dict:
+        strength = _dict["n-wise"]
+        if not isinstance(strength, int) or isinstance(strength, bool) or strength < 1:
+            raise ValueError(f"Test suite [{_dict['name']}] has an invalid [n-wise] property [{strength}]")
+        return strength
+    return None
+
+
+class TestMatrix(Sequence[TestCase]):
+    """The test cases of a test definition, i.e. the Cartesian product of its effective dimensions.
+
+    Test cases are created lazily when the matrix is iterated or indexed, so the matrix can be iterated
+    multiple times and its length is known without creating any test case.
+    """
+
+    def __init__(self, name: str, dimensions: List[TestDimension]) -> None:
+        self.name = _intern(name)
+        self.dimensions = dimensions
+
+    @cached_property
+    def dimension_names(self) -> Tuple[str, ...]:
+        """The names of the dimensions, shared by all test cases of the matrix."""
+        return tuple(_intern(d.name) for d in self.dimensions)
+
+    @cached_property
+    def columns(self) -> List[List[Tuple[str, str]]]:
+        """The interned values of every dimension together with their part of the test id."""
+        return [[(_intern(v), _safe_tid(f"{d.name}-{v}")) for v in d.values] for d in self.dimensions]
+
+    def __len__(self) -> int:
+        return reduce(mul, (len(d.values) for d in self.dimensions), 1)
+
+    def __iter__(self) -> Iterator[TestCase]:
+        prefix = _safe_tid(self.name)
+        for cells in product(*self.columns):
+            yield TestCase.from_row(
+                self.name,
+                self.dimension_names,
+                tuple(value for value, _ in cells),
+                "_".join(chain([prefix], (part for _, part in cells))),
+            )
+
+    def _test_case(self, indices: Iterable[int]) -> TestCase:
+        """Create the test case with the value indices of every dimension."""
+        cells = [column[i] for column, i in zip(self.columns, indices)]
+        return TestCase.from_row(
+            self.name,
+            self.dimension_names,
+            tuple(value for value, _ in cells),
+            "_".join(chain([_safe_tid(self.name)], (part for _, part in cells))),
+        )
+
+    @overload
+    def __getitem__(self, index: int) -> TestCase: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[TestCase]: ...
+
+    def __getitem__(self, index: int | slice) -> TestCase | List[TestCase]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError(f"Test case index out of range [{index}]")
+        # The last dimension varies fastest, the same as in itertools.product()
+        indices = []
+        for dim in reversed(self.dimensions):
+            index, i = divmod(index, len(dim.values))
+            indices.append(i)
+        return self._test_case(reversed(indices))
+
+
+class CoveringArray(TestMatrix):
+    """The test cases of a test definition reduced to a covering array of its effective dimensions: every
+    combination of values of any strength dimensions is part of at least one test case.
+
+    The array is generated the first time it is accessed and only depends on the dimensions and the strength.
+    """
+
+    def __init__(self, name: str, dimensions: List[TestDimension], strength: int) -> None:
+        super().__init__(name, dimensions)
+        self.strength = strength
+
+    @cached_property
+    def rows(self) -> List[Tuple[int, ...]]:
+        return covering_array([len(d.values) for d in self.dimensions], self.strength)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[TestCase]:
+        for row in self.rows:
+            yield self._test_case(row)
+
+    @overload
+    def __getitem__(self, index: int) -> TestCase: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[TestCase]: ...
+
+    def __getitem__(self, index: int | slice) -> TestCase | List[TestCase]:
+        if isinstance(index, slice):
+            return [self._test_case(row) for row in self.rows[index]]
+        return self._test_case(self.rows[index])
+
+
+def make_test_matrix(name: str, dimensions: List[TestDimension], strength: Optional[int] = None) -> TestMatrix:
+    """Return the full test matrix or, if strength is given, a covering array of the given strength."""
+    if strength is None or strength >= len(dimensions):
+        return TestMatrix(name=name, dimensions=dimensions)
+    return CoveringArray(name=name, dimensions=dimensions, strength=strength)
+
+
+@dataclass(frozen=True)
+class TestCaseFilter:
+    """Select a subset of the test cases of a test suite while it is resolved.
+    The filter is applied to the effective dimensions of every test, so only the selected test cases are ever
+    created. Criteria that are empty select all test cases.
+
+    Attributes:
+        tests (FrozenSet[str]) : Names of the tests to select.
+        tids (FrozenSet[str]) : Ids of the test cases to select.
+        where (Dict[str, FrozenSet[str]]) : Values to select by dimension name. Tests that don't use one of
+                                            these dimensions are not selected.
+    """
+
+    tests: FrozenSet[str] = frozenset()
+    tids: FrozenSet[str] = frozenset()
+    where: Dict[str, FrozenSet[str]] = field(default_factory=dict)
+
+    @classmethod
+    def from_criteria(
+        cls, tests: Iterable[str] = (), tids: Iterable[str] = (), where: Iterable[Tuple[str, str]] = ()
+    ) -> TestCaseFilter:
+        """Create a filter from lists of criteria. Values of the same dimension are alternatives."""
+        values: Dict[str, Set[str]] = {}
+        for dim, value in where:
+            values.setdefault(dim, set()).add(value)
+        return cls(tests=frozenset(tests), tids=frozenset(tids), where={k: frozenset(v) for k, v in values.items()})
+
+    def key(self) -> str:
+        """A string that identifies the filter independent of the order of its criteria."""
+        return json.dumps(
+            [sorted(self.tests), sorted(self.tids), sorted((k, sorted(v)) for k, v in self.where.items())]
+        )
+
+    def matrices(self, name: str, dimensions: List[TestDimension], strength: Optional[int] = None) -> List[TestMatrix]:
+        """Return the test matrices with the selected test cases of the test with the given effective dimensions.
+        If given, the selected values are reduced to a covering array of that strength. Test cases selected by id
+        are always expanded, even if they are not part of the covering array."""
+        if self.tests and name not in self.tests:
+            return []
+        if not set(self.where).issubset(d.name for d in dimensions):
+            return []
+        # Values are selected in the form they have in the test case ids, e.g. 30 and False for YAML numbers and
+        # booleans
+        dimensions = [
+            TestDimension(d.name, [v for v in d.values if str(v) in self.where[d.name]]) if d.name in self.where else d
+            for d in dimensions
+        ]
+        if not self.tids:
+            return [make_test_matrix(name, dimensions, strength)]
+        return [
+            TestMatrix(name=name, dimensions=[TestDimension(d.name, [v]) for d, v in zip(dimensions, values)])
+            for values in _match_tids(_safe_tid(name), dimensions, self.tids)
+        ]
+
+
+def _match_tids(prefix: str, dimensions: List[TestDimension], tids: FrozenSet[str]) -> Iterator[List[str]]:
+    """Generate the dimension values of the test cases with one of the tids.
+    Only the values that continue the prefix of one of the tids are followed."""
+    if not dimensions:
+        if prefix in tids:
+            yield []
+        return
+    dim = dimensions[0]
+    for value in dim.values:
+        dim_prefix = f"{prefix}_{_safe_tid(f'{dim.name}-{value}')}"
+        if any(tid.startswith(dim_prefix) for tid in tids):
+            for values in _match_tids(dim_prefix, dimensions[1:], tids):
+                yield [value, *values]
+
+
+def _intern(value: Any) -> Any:
+    """Intern value if it is a string. YAML also gives numbers and booleans for unquoted values."""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _safe_tid(tid: str) -> str:
+    """Replace the characters that are not allowed in directory names."""
+    return re.sub(f"[{os.sep}:]", "_", tid)
+
+
+class TestCases(Sequence[TestCase]):
+    """The test cases of a test suite: a lazy concatenation of test matrices.
+
+    Test cases compare equal to any sequence with the same test cases in the same order.
+    """
+
+    def __init__(self, matrices: List[TestMatrix]) -> None:
+        self.matrices = matrices
+
+    @property
+    def test_names(self) -> List[str]:
+        """Names of the test definitions with at least one test case."""
+        return list(dict.fromkeys(m.name for m in self.matrices if len(m)))
+
+    def __len__(self) -> int:
+        return sum(len(m) for m in self.matrices)
+
+    def __iter__(self) -> Iterator[TestCase]:
+        return chain.from_iterable(self.matrices)
+
+    @overload
+    def __getitem__(self, index: int) -> TestCase: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[TestCase]: ...
+
+    def __getitem__(self, index: int | slice) -> TestCase | List[TestCase]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        for matrix in self.matrices:
+            if 0 <= index < len(matrix):
+                return matrix[index]
+            index -= len(matrix)
+        raise IndexError(f"Test case index out of range [{index}]")
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __repr__(self) -> str:
+        return f"TestCases({list(self)!r})"
+
+
+def test_names(test_cases: Iterable[TestCase]) -> List[str]:
+    """Return the names of the test definitions of the test cases in order of appearance."""
+    if isinstance(test_cases, TestCases):
+        return test_cases.test_names
+    return list(dict.fromkeys(tc.name for tc in test_cases))
 
 
 @dataclass(frozen=True)
@@ -311,7 +887,171 @@ class EffectiveTestSuite:
     """Test suite template."""
 
     name: str = field()
-    test_cases: List[TestCase] = field(default_factory=list)
+    test_cases: Sequence[TestCase] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the test suite by its test matrices. Only resolved test suites can be serialized."""
+        if not isinstance(self.test_cases, TestCases):
+            raise TypeError(f"Cannot serialize the test cases of test suite [{self.name}]")
+        return {
+            "name": self.name,
+            "matrices": [
+                {
+                    "name": m.name,
+                    "dimensions": [{"name": d.name, "values": d.values} for d in m.dimensions],
+                    "strength": m.strength if isinstance(m, CoveringArray) else None,
+                }
+                for m in self.test_cases.matrices
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, _dict: Dict[str, Any]) -> EffectiveTestSuite:
+        return EffectiveTestSuite(
+            name=_dict["name"],
+            test_cases=TestCases(
+                [
+                    make_test_matrix(
+                        m["name"], [TestDimension(d["name"], d["values"]) for d in m["dimensions"]], m.get("strength")
+                    )
+                    for m in _dict["matrices"]
+                ]
+            ),
+        )
+
+
+class TestCaseExpander:
+    """Expand test cases of one or more suites, reusing one Jinja environment, one index and one render cache per
+    test definition.
+
+    Instances are sent to worker processes when expanding in parallel. The Jinja environments and render caches
+    are not sent, the workers create their own. Sinks that are not parallel safe are replaced by a MemorySink
+    for that. Copies share the environments and render caches with the original.
+    """
+
+    def __init__(
+        self,
+        template_dir: str,
+        output_dir: str,
+        namespace: str,
+        bytecode_cache: Optional[BytecodeCache] = None,
+        link_mode: str = "copy",
+        test_indexes: Optional[Dict[str, TestDefinitionIndex]] = None,
+        timings: Optional[Timings] = None,
+        sink: OutputSink = FILE_SYSTEM,
+    ) -> None:
+        self.template_dir = template_dir
+        self.output_dir = output_dir
+        self.namespace = namespace
+        self.bytecode_cache = bytecode_cache
+        self.link_mode = link_mode
+        self.test_indexes: Dict[str, TestDefinitionIndex] = dict(test_indexes or {})
+        self.test_envs: Dict[str, Environment] = {}
+        self.render_caches: Dict[str, RenderCache] = {}
+        self.kuttl_envs: Dict[str, Environment] = {}
+        self.timings = timings
+        self.sink = sink
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {**self.__dict__, "test_envs": {}, "render_caches": {}, "kuttl_envs": {}}
+
+    def __copy__(self) -> TestCaseExpander:
+        clone = object.__new__(TestCaseExpander)
+        clone.__dict__.update(self.__dict__)
+        return clone
+
+    def environment(self, name: str) -> Tuple[Environment, RenderCache]:
+        """Return the Jinja environment and the render cache of the test definition, creating them if needed."""
+        if name not in self.test_envs:
+            td_root = path.join(self.template_dir, name)
+            self.test_envs[name] = make_test_env(td_root, bytecode_cache=self.bytecode_cache)
+            self.render_caches[name] = RenderCache(self.test_envs[name], bool(self.namespace))
+        return self.test_envs[name], self.render_caches[name]
+
+    def kuttl_environment(self, kuttl_tests: str) -> Environment:
+        """Return the Jinja environment of the kuttl test suite template, creating it if needed."""
+        root = path.dirname(kuttl_tests)
+        if root not in self.kuttl_envs:
+            self.kuttl_envs[root] = Environment(loader=FileSystemLoader(root), bytecode_cache=self.bytecode_cache)
+        return self.kuttl_envs[root]
+
+    def index(self, name: str) -> TestDefinitionIndex:
+        """Return the index of the test definition, scanning it if needed."""
+        if name not in self.test_indexes:
+            self.test_indexes[name] = TestDefinitionIndex.scan(path.join(self.template_dir, name))
+        return self.test_indexes[name]
+
+    def __call__(
+        self, test_case: TestCase, sink: Optional[OutputSink] = None, output_dir: Optional[str] = None
+    ) -> Optional[str]:
+        """Expand the test case to the sink and the output_dir, by default those of the expander, and return an
+        error message if that fails. Files may still be written in the background afterwards, see _expand_chunk()."""
+        sink = sink or self.sink
+        try:
+            env, render_cache = self.environment(test_case.name)
+            index = self.index(test_case.name)
+            start = perf_counter()
+            written = sink.bytes_written
+            test_case.expand(
+                self.template_dir,
+                output_dir or self.output_dir,
+                self.namespace,
+                env,
+                self.link_mode,
+                index,
+                render_cache,
+                self.timings,
+                sink,
+            )
+            if self.timings is not None:
+                self.timings.add_test_case(test_case.tid, perf_counter() - start, sink.bytes_written - written)
+        except Exception as exc:
+            return f"{type(exc).__name__}: {exc}"
+        return None
+
+
+# The test case expander of a worker process.
+_worker_expander: Optional[TestCaseExpander] = None
+
+
+def _init_worker(expander: TestCaseExpander, log_level: int) -> None:
+    global _worker_expander
+    logging.getLogger().setLevel(log_level)
+    _worker_expander = expander
+
+
+def _expand_chunk_in_worker(
+    items: List[Tuple[TestCase, str]],
+) -> Tuple[List[Optional[str]], Optional[Dict[str, Any]], Optional[MemorySink]]:
+    """Expand the test cases, each one to its output folder, and return their error messages and the timings
+    recorded by the worker. If the sink is not parallel safe, the files are collected in memory and returned too."""
+    assert _worker_expander is not None
+    files = None if _worker_expander.sink.parallel_safe else MemorySink(_worker_expander.sink.root)
+    errors = _expand_chunk(_worker_expander, items, files)
+    return errors, _worker_expander.timings.drain() if _worker_expander.timings is not None else None, files
+
+
+def _expand_chunk(
+    expander: TestCaseExpander, items: List[Tuple[TestCase, str]], sink: Optional[OutputSink] = None
+) -> List[Optional[str]]:
+    """Expand the test cases, each one to its output folder, and wait until all their files are written.
+    Return the error message of every test case.
+
+    Sinks may write files in the background while the next test cases are rendered, so an error writing a file
+    is reported for the test case that is expanded when the error is noticed. An error noticed at the end is
+    reported for all test cases of the chunk that didn't fail before."""
+    errors = [expander(test_case, sink, output_dir) for test_case, output_dir in items]
+    flush_error = _flush_error(sink or expander.sink)
+    return [error or flush_error for error in errors]
+
+
+def _flush_error(sink: OutputSink) -> Optional[str]:
+    """Wait until the files handed to the sink are written. Return the error message if that failed."""
+    try:
+        sink.flush()
+    except Exception as exc:
+        return f"{type(exc).__name__}: {exc}"
+    return None
 
 
 def expand(
@@ -321,20 +1061,272 @@ def expand(
     output_dir: str,
     kuttl_tests: str,
     namespace: str,
+    bytecode_cache: Optional[BytecodeCache] = None,
+    jobs: int = 1,
+    incremental: bool = False,
+    link_mode: str = "copy",
+    timings: Optional[Timings] = None,
+    shard: Optional[Shard] = None,
+    costs: Optional[Dict[str, float]] = None,
+    sink: Optional[OutputSink] = None,
+    expander: Optional[TestCaseExpander] = None,
 ) -> int:
-    """Expand test suite."""
-    try:
-        ets = next((s for s in effective_test_suites if suite == s.name))
-        _sanity_checks(ets.test_cases, template_dir, kuttl_tests)
-        _mkdir_ignore_exists(output_dir)
-        _expand_kuttl_tests(ets.test_cases, output_dir, kuttl_tests)
-        for test_case in ets.test_cases:
-            test_case.expand(template_dir, output_dir, namespace)
-    except StopIteration as exc:
-        raise ValueError(f"Cannot expand test suite [{suite}] because cannot find it in [{kuttl_tests}]") from exc
+    """Expand test suite.
+    If given, the bytecode_cache persists the compiled templates between runs.
+    Test cases are expanded by up to jobs worker processes. All test cases are expanded even if some of them fail,
+    and the failures are reported together at the end.
+
+    In incremental mode, a manifest with the inputs of every expanded test case is written next to the output_dir.
+    Only test cases whose inputs changed since the manifest was written are expanded again and the directories
+    of test cases that are not part of the suite anymore are deleted. Without a usable manifest, the output_dir
+    is rebuilt from scratch. Other expansions don't hash the inputs and don't write a manifest.
+
+    The link_mode determines how files that are not templates are placed in the test case directories.
+    If given, timings records the time spent in each phase, test case and template.
+
+    If a shard is given, only the test cases of that shard are expanded and listed in the kuttl test suite. The
+    test cases are balanced between the shards by their costs in seconds by test case id.
+
+    The files are written to the sink, by default to the file system. The parent of the output_dir is the root
+    of the sink. Sinks that don't write to a directory can't be updated incrementally and receive copies of
+    the files.
+
+    If given, the expander keeps the Jinja environments, indexes and render caches of the test definitions
+    between expansions. It must have the same template_dir, namespace, bytecode_cache and link_mode.
+    """
+    return expand_suites(
+        {suite: output_dir},
+        effective_test_suites,
+        template_dir,
+        kuttl_tests,
+        namespace,
+        bytecode_cache,
+        jobs,
+        incremental,
+        link_mode,
+        timings,
+        shard,
+        costs,
+        sink or DirectorySink(path.dirname(output_dir)),
+        expander,
+    )
+
+
+def expand_suites(
+    output_dirs: Dict[str, str],
+    effective_test_suites: List[EffectiveTestSuite],
+    template_dir: str,
+    kuttl_tests: str,
+    namespace: str,
+    bytecode_cache: Optional[BytecodeCache] = None,
+    jobs: int = 1,
+    incremental: bool = False,
+    link_mode: str = "copy",
+    timings: Optional[Timings] = None,
+    shard: Optional[Shard] = None,
+    costs: Optional[Dict[str, float]] = None,
+    sink: Optional[OutputSink] = None,
+    expander: Optional[TestCaseExpander] = None,
+) -> int:
+    """Expand several test suites like expand() does, each one to its own output folder. output_dirs maps the
+    names of the test suites to their output folders.
+
+    The work is shared between the test suites: every test definition is scanned once, every template is compiled
+    once and the render caches are shared. The test cases of all test suites are expanded by the same worker
+    processes. A test case with the same id and values in more than one test suite is only expanded for the first
+    of them. If the sink is a directory, it is then copied to the other test suites.
+    """
+    for suite in output_dirs:
+        if not any(suite == ets.name for ets in effective_test_suites):
+            raise ValueError(f"Cannot expand test suite [{suite}] because cannot find it in [{kuttl_tests}]")
+    sink = sink or DirectorySink()
+    if not sink.is_directory and incremental:
+        raise ValueError("Cannot expand incrementally to an archive or to memory")
+    if not sink.is_directory and link_mode != "copy":
+        raise ValueError(f"Cannot {link_mode} files to an archive or to memory")
+    use_manifest = incremental
+    definition_hashes: Dict[str, str] = {}
+
+    def input_hash(tc: TestCase) -> str:
+        return hash_test_case(definition_hashes[tc.name], tc.tid, tc.values, tc.namespace(namespace), link_mode)
+
+    if expander is None:
+        expander = TestCaseExpander(template_dir, "", namespace, bytecode_cache, link_mode)
+    else:
+        # Shares the environments, indexes and render caches with the given expander
+        expander = copy(expander)
+    expander.timings = Timings() if timings is not None else None
+    expander.sink = sink
+    selected: Dict[str, Sequence[TestCase]] = {}
+    manifests: Dict[str, Manifest] = {}
+    count = 0
+    for suite, output_dir in output_dirs.items():
+        all_test_cases = next(ets.test_cases for ets in effective_test_suites if suite == ets.name)
+        if shard is not None:
+            with phase(timings, "shard"):
+                all_test_cases = shard.select(all_test_cases, costs)
+        with phase(timings, "sanity_checks"):
+            _sanity_checks(all_test_cases, template_dir, kuttl_tests)
+        manifest_dir = path.dirname(output_dir)
+        manifest = Manifest.load(manifest_dir) if incremental else None
+        if manifest is None:
+            if incremental:
+                logging.info("No usable manifest found in [%s]. Expanding all test cases.", manifest_dir)
+                rmtree(output_dir, ignore_errors=True)
+            manifest = Manifest(manifest_dir)
+        sink.mkdir(output_dir)
+        with phase(timings, "kuttl_test"):
+            _expand_kuttl_tests(
+                all_test_cases, output_dir, kuttl_tests, sink=sink, env=expander.kuttl_environment(kuttl_tests)
+            )
+            sink.flush()
+        current: List[str] = []
+        if use_manifest:
+            with phase(timings, "manifest"):
+                for name in test_names(all_test_cases):
+                    if name not in definition_hashes:
+                        definition_hashes[name] = hash_test_definition(path.join(template_dir, name))
+                current = [tc.tid for tc in all_test_cases if manifest.is_current(tc.tid, input_hash(tc))]
+                manifest.remove_stale(current)
+        if current:
+            logging.info("Skipping %d up to date test cases", len(current))
+        selected[suite] = all_test_cases
+        manifests[suite] = manifest
+        count += len(all_test_cases) - len(current)
+    with phase(timings, "scan"):
+        if count:
+            for name in dict.fromkeys(chain.from_iterable(test_names(tcs) for tcs in selected.values())):
+                expander.index(name)
+    # The output folder of the first test suite that expands a test case, by test case id and values. Only needed
+    # if there is more than one test suite.
+    first_dirs: Dict[Tuple[str, Tuple[str, ...]], str] = {}
+    track_first_dirs = len(output_dirs) > 1
+    copies: List[Tuple[str, TestCase, str]] = []
+
+    def pending() -> Iterator[Tuple[TestCase, str]]:
+        for suite, output_dir in output_dirs.items():
+            for tc in selected[suite]:
+                if tc.tid in manifests[suite].test_cases:
+                    continue
+                if track_first_dirs:
+                    key = (tc.tid, tc.row)
+                    if sink.is_directory and first_dirs.get(key, output_dir) != output_dir:
+                        copies.append((suite, tc, first_dirs[key]))
+                        continue
+                    first_dirs[key] = output_dir
+                yield tc, output_dir
+
+    suites_by_dir = {output_dir: suite for suite, output_dir in output_dirs.items()}
+    failed: List[Tuple[str, str, str]] = []
+
+    def record(suite: str, test_case: TestCase, error: Optional[str]) -> None:
+        if error:
+            failed.append((suite, test_case.tid, error))
+        elif use_manifest:
+            manifest = manifests[suite]
+            manifest.test_cases[test_case.tid] = {
+                "name": test_case.name,
+                "hash": input_hash(test_case),
+                "path": path.relpath(path.join(output_dirs[suite], test_case.name, test_case.tid), manifest.base_dir),
+            }
+
+    with phase(timings, "test_cases"):
+        for test_case, output_dir, error in _expand_test_cases(expander, pending(), count, jobs):
+            record(suites_by_dir[output_dir], test_case, error)
+    if copies:
+        with phase(timings, "copies"):
+            logging.info("Copying %d test cases that are part of more than one test suite", len(copies))
+            errors = {(suite, tid): error for suite, tid, error in failed}
+            copied = []
+            for suite, test_case, first_dir in copies:
+                error = errors.get((suites_by_dir[first_dir], test_case.tid))
+                if error is None:
+                    try:
+                        _copy_test_case(
+                            path.join(first_dir, test_case.name, test_case.tid),
+                            path.join(output_dirs[suite], test_case.name, test_case.tid),
+                            link_mode,
+                            sink,
+                        )
+                        copied.append((suite, test_case))
+                        continue
+                    except OSError as exc:
+                        error = f"{type(exc).__name__}: {exc}"
+                record(suite, test_case, error)
+            error = _flush_error(sink)
+            for suite, test_case in copied:
+                record(suite, test_case, error)
+    if timings is not None and expander.timings is not None:
+        timings.merge(expander.timings.drain())
+    if use_manifest:
+        with phase(timings, "manifest"):
+            for manifest in manifests.values():
+                manifest.save()
+    for _, tid, error in failed:
+        logging.error("Failed to expand test case [%s]: %s", tid, error)
+    if failed:
+        failed_suites = ", ".join(dict.fromkeys(suite for suite, _, _ in failed))
+        raise ValueError(f"Failed to expand {len(failed)} test case(s) of test suite [{failed_suites}]")
     return 0
 
 
+def _copy_test_case(source_dir: str, dest_dir: str, link_mode: str, sink: OutputSink) -> None:
+    """Copy an expanded test case to another output folder. Symbolic links are created again with the same target.
+    Other files are placed according to the link mode but never linked symbolically, so the copy doesn't depend
+    on the output folder of another test suite."""
+    logging.info("Copying test case [%s] from [%s]", path.basename(dest_dir), source_dir)
+    for dir_path, _, file_names in os.walk(source_dir):
+        target_dir = path.normpath(path.join(dest_dir, path.relpath(dir_path, source_dir)))
+        sink.mkdir(target_dir)
+        for file_name in file_names:
+            source = path.join(dir_path, file_name)
+            if path.islink(source):
+                os.symlink(os.readlink(source), path.join(target_dir, file_name))
+            else:
+                sink.copy(source, path.join(target_dir, file_name), "hardlink" if link_mode == "symlink" else link_mode)
+
+
+def _expand_test_cases(
+    expander: TestCaseExpander, items: Iterable[Tuple[TestCase, str]], count: int, jobs: int
+) -> Iterator[Tuple[TestCase, str, Optional[str]]]:
+    """Expand up to count test cases, each one to its output folder, with up to jobs worker processes. The test
+    cases are taken from the iterable in batches, so only a bounded number of them is in flight at any time.
+    Yield each test case and its output folder together with the error message if it failed. The test cases are
+    expanded in chunks and the sink is flushed after every chunk, see _expand_chunk().
+    If the sink of the expander is not parallel safe, the workers return the files and they are written to the
+    sink in the order of the test cases."""
+    if jobs > 1 and count > 1:
+        workers = min(jobs, count)
+        chunksize = max(1, min(count // (workers * 4), MAX_CHUNK_SIZE))
+        logging.debug("Expanding %d test cases with %d workers", count, workers)
+        # No files are written in the background while the worker processes are forked
+        expander.sink.flush()
+        worker_expander = expander
+        if not expander.sink.parallel_safe:
+            worker_expander = copy(expander)
+            worker_expander.sink = MemorySink(expander.sink.root)
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(worker_expander, logging.getLogger().getEffectiveLevel()),
+        ) as executor:
+            it = iter(items)
+            while batch := list(islice(it, workers * chunksize * 4)):
+                chunks = [batch[i : i + chunksize] for i in range(0, len(batch), chunksize)]
+                for chunk, (errors, timings, files) in zip(chunks, executor.map(_expand_chunk_in_worker, chunks)):
+                    if timings is not None and expander.timings is not None:
+                        expander.timings.merge(timings)
+                    if files is not None:
+                        files.replay(expander.sink)
+                    for (test_case, output_dir), error in zip(chunk, errors):
+                        yield test_case, output_dir, error
+    else:
+        it = iter(items)
+        while chunk := list(islice(it, MAX_CHUNK_SIZE)):
+            for (test_case, output_dir), error in zip(chunk, _expand_chunk(expander, chunk)):
+                yield test_case, output_dir, error
+
+
 def determine_namespace(testcase_name: str, prefered_namespace: str) -> str:
     """Generate a namespace name for the given test case unless a prefered namespace name is given.
 
@@ -355,70 +1347,154 @@ def determine_namespace(testcase_name: str, prefered_namespace: str) -> str:
         return f"kuttl-{hash[:10]}"
 
 
-def _expand_kuttl_tests(test_cases, output_dir: str, kuttl_tests: str) -> None:
-    """Generate the kuttl-tests.yaml file and fill in paths to tests."""
-    env = Environment(loader=FileSystemLoader(path.dirname(kuttl_tests)))
+def _expand_kuttl_tests(
+    test_cases,
+    output_dir: str,
+    kuttl_tests: str,
+    bytecode_cache: Optional[BytecodeCache] = None,
+    sink: OutputSink = FILE_SYSTEM,
+    env: Optional[Environment] = None,
+) -> None:
+    """Generate the kuttl-tests.yaml file and fill in paths to tests. The template is loaded with env if given."""
+    if env is None:
+        env = Environment(loader=FileSystemLoader(path.dirname(kuttl_tests)), bytecode_cache=bytecode_cache)
     kt_base_name = path.basename(kuttl_tests)
     template = env.get_template(kt_base_name)
     kt_dest_name = re.sub(PATTERN_EXTENSION_JINJA, "", kt_base_name)
     # Compatibility warning: Assume output_dir ends with 'tests' and remove
     # it from the destination file
     dest = path.join(path.dirname(output_dir), kt_dest_name)
-    kuttl_vars = {"testinput": {"tests": [{"name": tn} for tn in {tc.name for tc in test_cases}]}}
+    # The tests are listed in the order of the test cases so the file is the same in every run
+    kuttl_vars = {"testinput": {"tests": [{"name": tn} for tn in test_names(test_cases)]}}
     logging.debug("kuttl vars %s", kuttl_vars)
-    with open(dest, encoding="utf8", mode="w") as stream:
-        print(template.render(kuttl_vars), file=stream)
+    sink.write(dest, template.generate(kuttl_vars))
 
 
-def renderer_from_file(file_name: str) -> List[EffectiveTestSuite]:
-    with open(file_name, encoding="utf8") as stream:
-        return renderer_from_stream(stream)
-
+@dataclass(frozen=True)
+class TestDefinitions:
+    """The content of a test definition file, before any test suite is resolved.
 
-def renderer_from_stream(stream) -> List[EffectiveTestSuite]:
-    tin = safe_load(stream)
-    dimensions = [TestDimension(d["name"], d["values"]) for d in tin["dimensions"]]
-    test_def = [TestDefinition(t["name"], t["dimensions"]) for t in tin["tests"]]
+    Attributes:
+        dimensions (List[TestDimension]) : All test dimensions.
+        tests (List[TestDefinition]) : All test definitions.
+        suites (Dict[str, TestSuite]) : Test suites by name, including the default test suite.
+    """
 
-    test_suites = []
-    if "suites" in tin:
-        test_suites.extend([TestSuite.from_dict(t) for t in tin["suites"]])
-    # Add the default test suite so that it can always be selected regardless of whether other test suites
-    # are defined or not.
-    test_suites.append(TestSuite(name="default", select=[], patches=[]))
+    dimensions: List[TestDimension]
+    tests: List[TestDefinition]
+    suites: Dict[str, TestSuite]
 
-    return _resolve_effective_test_suites(dimensions, test_def, test_suites)
+    @classmethod
+    def from_dict(cls, tin: Dict[str, Any]) -> TestDefinitions:
+        dimensions = [TestDimension(d["name"], d["values"]) for d in tin["dimensions"]]
+        test_def = [TestDefinition(t["name"], t["dimensions"]) for t in tin["tests"]]
+
+        test_suites = []
+        if "suites" in tin:
+            test_suites.extend([TestSuite.from_dict(t) for t in tin["suites"]])
+        # Add the default test suite so that it can always be selected regardless of whether other test suites
+        # are defined or not.
+        test_suites.append(TestSuite(name="default", select=[], patches=[]))
+
+        suites: Dict[str, TestSuite] = {}
+        for test_suite in test_suites:
+            # The first suite with a given name wins.
+            suites.setdefault(test_suite.name, test_suite)
+        return TestDefinitions(dimensions=dimensions, tests=test_def, suites=suites)
+
+    def resolve(
+        self, suite: str, source: str = "test definition", test_filter: Optional[TestCaseFilter] = None
+    ) -> EffectiveTestSuite:
+        """Resolve only the given test suite. Raises ValueError if the suite is not defined in source.
+        If given, only the test cases selected by the test_filter are part of the effective test suite."""
+        if suite not in self.suites:
+            raise ValueError(f"Cannot expand test suite [{suite}] because cannot find it in [{source}]")
+        return _resolve_effective_test_suites(self.dimensions, self.tests, [self.suites[suite]], test_filter)[0]
+
+    def resolve_all(self, test_filter: Optional[TestCaseFilter] = None) -> List[EffectiveTestSuite]:
+        """Resolve all test suites."""
+        return _resolve_effective_test_suites(self.dimensions, self.tests, list(self.suites.values()), test_filter)
+
+
+def renderer_from_file(
+    file_name: str,
+    suite: Optional[str] = None,
+    suite_cache: Optional[SuiteCache] = None,
+    timings: Optional[Timings] = None,
+    test_filter: Optional[TestCaseFilter] = None,
+) -> List[EffectiveTestSuite]:
+    """Resolve the test suites of the test definition file. If suite is given, only that test suite is resolved.
+    If given, the suite_cache is used to skip parsing and resolution when the file has been resolved before."""
+    with open(file_name, mode="rb") as stream:
+        content = stream.read()
+    if suite_cache is None:
+        return renderer_from_stream(content, suite, file_name, timings, test_filter)
+    key = suite_cache.key(content, suite, test_filter.key() if test_filter is not None else "")
+    with phase(timings, "suite_cache"):
+        cached = suite_cache.load(key)
+        if cached is not None:
+            try:
+                return [EffectiveTestSuite.from_dict(ets) for ets in cached]
+            except (KeyError, TypeError) as exc:
+                logging.debug("Ignoring invalid suite cache entry %s: %s", key, exc)
+    effective_test_suites = renderer_from_stream(content, suite, file_name, timings, test_filter)
+    with phase(timings, "suite_cache"):
+        suite_cache.store(key, [ets.to_dict() for ets in effective_test_suites])
+    return effective_test_suites
 
 
-def _resolve_effective_test_suites(dims: List[TestDimension], tests: List[TestDefinition], suites: List[TestSuite]):
+def renderer_from_stream(
+    stream,
+    suite: Optional[str] = None,
+    source: str = "test definition",
+    timings: Optional[Timings] = None,
+    test_filter: Optional[TestCaseFilter] = None,
+) -> List[EffectiveTestSuite]:
+    """Resolve the test suites of the test definition stream. If suite is given, only that test suite is resolved
+    and ValueError is raised if it is not defined in source. If given, the test_filter selects the test cases
+    of the effective test suites."""
+    with phase(timings, "yaml_load"):
+        data = load(stream, Loader=SafeLoader)
+    with phase(timings, "resolve"):
+        test_definitions = TestDefinitions.from_dict(data)
+        if suite is not None:
+            return [test_definitions.resolve(suite, source, test_filter)]
+        return test_definitions.resolve_all(test_filter)
+
+
+def _resolve_effective_test_suites(
+    dims: List[TestDimension],
+    tests: List[TestDefinition],
+    suites: List[TestSuite],
+    test_filter: Optional[TestCaseFilter] = None,
+):
     effective_test_suites = []
     for suite in suites:
         logging.debug(f"Resolving effective test suite [{suite.name}]")
-        test_cases = []
+        matrices = []
         for test in suite.select_tests(tests):
+            if test_filter is not None and test_filter.tests and test.name not in test_filter.tests:
+                continue
             logging.debug(f"Selected test [{suite.name}].[{test.name}]")
             used_dims = [d for d in dims if d.name in test.dimensions]
             effective_dimensions = suite.patch_dimensions(test.name, used_dims)
-            expanded_test_dims: List[List[Tuple[str, str]]] = [d.expand() for d in effective_dimensions]
-            test_cases.extend(
-                [TestCase(name=test.name, values=dict(tc_dim)) for tc_dim in product(*expanded_test_dims)]
-            )
-        ets = EffectiveTestSuite(name=suite.name, test_cases=test_cases)
+            if test_filter is None:
+                matrices.append(make_test_matrix(test.name, effective_dimensions, suite.strength))
+            else:
+                matrices.extend(test_filter.matrices(test.name, effective_dimensions, suite.strength))
+        ets = EffectiveTestSuite(name=suite.name, test_cases=TestCases(matrices))
+        if test_filter is not None and not len(ets.test_cases):
+            logging.warning(f"The filter does not select any test case of test suite [{suite.name}]")
+        elif test_filter is not None and test_filter.tids:
+            for tid in sorted(test_filter.tids.difference(tc.tid for tc in ets.test_cases)):
+                logging.warning(f"Test case [{tid}] is not part of test suite [{suite.name}]")
         effective_test_suites.append(ets)
     return effective_test_suites
 
 
-def _mkdir_ignore_exists(dir_name: str) -> None:
-    try:
-        logging.debug("Creating directory %s", dir_name)
-        makedirs(dir_name)
-    except FileExistsError:
-        pass
-
-
 def _sanity_checks(test_cases, template_dir: str, kuttl_tests: str) -> None:
-    for test_case in test_cases:
-        td_root = path.join(template_dir, test_case.name)
+    for name in test_names(test_cases):
+        td_root = path.join(template_dir, name)
         if not path.isdir(td_root):
             raise ValueError(f"Test definition directory not found [{td_root}]")
     if not path.isfile(kuttl_tests):
@@ -1,11 +1,31 @@
 """Main entry point."""
 
+import cProfile
+import json
 import logging
-from argparse import ArgumentParser, Namespace
+import os
+from argparse import ArgumentParser, ArgumentTypeError, Namespace
 from os import path
 from shutil import rmtree
+from typing import Dict, List, Optional, Tuple
 
-from beku.kuttl import renderer_from_file, expand
+from beku.cache import DEFAULT_CACHE_MAX_SIZE, ENV_CACHE_DIR, suite_cache_from, template_cache_from
+from beku.kuttl import EffectiveTestSuite, TestCaseFilter, expand_suites, renderer_from_file
+from beku.check import check
+from beku.plan import PLAN_FORMATS, format_plan, plan
+from beku.shard import Shard, load_costs
+from beku.sink import (
+    DEFAULT_WRITE_QUEUE_DEPTH,
+    LINK_MODES,
+    OUTPUT_FORMATS,
+    STORE_DIR,
+    BackgroundSink,
+    OutputSink,
+    open_sink,
+    output_format,
+)
+from beku.timings import Timings, phase
+from beku.watch import DEFAULT_DEBOUNCE, WatchSession
 from .version import __version__
 
 
@@ -35,7 +55,8 @@ def parse_cli_args() -> Namespace:
     parser.add_argument(
         "-o",
         "--output_dir",
-        help="Output folder for the expanded test cases.",
+        help="Output folder for the expanded test cases or an archive ending with .tar, .tar.gz, .tgz or .zip. "
+        "Use - to write a tar archive to the standard output.",
         type=str,
         required=False,
         default="tests/_work",
@@ -63,12 +84,20 @@ def parse_cli_args() -> Namespace:
     parser.add_argument(
         "-s",
         "--suite",
-        help="Name of the test suite to expand. Default: default",
+        help="Name of the test suite to expand or a comma separated list of test suites. "
+        "Several test suites are expanded to sub-folders of the output folder named after them. Default: default",
         type=str,
         required=False,
         default="default",
     )
 
+    parser.add_argument(
+        "--all-suites",
+        help="Expand all test suites to sub-folders of the output folder named after them.",
+        action="store_true",
+        required=False,
+    )
+
     parser.add_argument(
         "-n",
         "--namespace",
@@ -77,9 +106,217 @@ def parse_cli_args() -> Namespace:
         required=False,
     )
 
+    parser.add_argument(
+        "--cache-dir",
+        help=f"Folder to persist compiled templates and resolved test suites between runs. Default: ${ENV_CACHE_DIR} or no cache.",
+        type=str,
+        required=False,
+    )
+
+    parser.add_argument(
+        "--cache-max-size",
+        help=f"Maximum size of the template cache in bytes. Default: {DEFAULT_CACHE_MAX_SIZE}",
+        type=int,
+        required=False,
+        default=DEFAULT_CACHE_MAX_SIZE,
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of test cases to expand in parallel. Default: number of CPUs",
+        type=_positive_int,
+        required=False,
+        default=os.cpu_count() or 1,
+    )
+
+    parser.add_argument(
+        "--incremental",
+        help="Keep the output folder and only expand test cases that changed since the previous run.",
+        action="store_true",
+        required=False,
+    )
+
+    parser.add_argument(
+        "--link-mode",
+        help="How to place files that are not templates in the test cases. "
+        "Linked files must not be modified in the output folder. Default: copy",
+        type=str,
+        required=False,
+        choices=LINK_MODES,
+        default="copy",
+    )
+
+    parser.add_argument(
+        "--dedupe",
+        help=f"Write every distinct file once to a content-addressed store ({STORE_DIR}) in the output folder "
+        "and hard link it into the test cases. Archives contain hard links instead of duplicate files. "
+        "Deduplicated files must not be modified in the output folder.",
+        action="store_true",
+        required=False,
+    )
+
+    parser.add_argument(
+        "--writers",
+        help="Number of threads that write the files of every worker process while templates are rendered. "
+        "Helps on file systems with a high latency. Default: 0 (write on the rendering thread)",
+        type=_non_negative_int,
+        required=False,
+        default=0,
+    )
+
+    parser.add_argument(
+        "--write-queue",
+        help=f"Maximum number of rendered files waiting for the writer threads. Default: {DEFAULT_WRITE_QUEUE_DEPTH}",
+        type=_positive_int,
+        required=False,
+        default=DEFAULT_WRITE_QUEUE_DEPTH,
+    )
+
+    parser.add_argument(
+        "--output-format",
+        help="Write the expanded test cases to a folder or to an archive. Default: guessed from the output name",
+        type=str,
+        required=False,
+        choices=OUTPUT_FORMATS,
+    )
+
+    parser.add_argument(
+        "--test",
+        help="Only expand the test cases of this test. Can be given multiple times.",
+        type=str,
+        required=False,
+        action="append",
+        default=[],
+    )
+
+    parser.add_argument(
+        "--tid",
+        help="Only expand the test case with this id. Can be given multiple times.",
+        type=str,
+        required=False,
+        action="append",
+        default=[],
+    )
+
+    parser.add_argument(
+        "--where",
+        help="Only expand test cases where the dimension DIM has the value VALUE, given as DIM=VALUE. "
+        "Can be given multiple times. Values of the same dimension are alternatives.",
+        type=_dimension_value,
+        required=False,
+        action="append",
+        default=[],
+    )
+
+    parser.add_argument(
+        "--shard",
+        help="Only expand the test cases of one shard given as INDEX/COUNT, for example 2/4. "
+        "The kuttl test suite file only lists the tests of the shard.",
+        type=_shard,
+        required=False,
+    )
+
+    parser.add_argument(
+        "--shard-costs",
+        help="JSON file with the cost in seconds by test case id, or a kuttl JUnit report, "
+        "used to balance the shards. Default: all test cases have the same cost",
+        type=str,
+        required=False,
+    )
+
+    parser.add_argument(
+        "--check",
+        help="Compile all templates and render the templates of every test definition once with its first test "
+        "case, without writing anything. Print every error with its file and line and exit with 1 on errors.",
+        action="store_true",
+        required=False,
+    )
+
+    parser.add_argument(
+        "--plan",
+        help="Print the test cases and the files that would be expanded without writing anything.",
+        action="store_true",
+        required=False,
+    )
+
+    parser.add_argument(
+        "--stats",
+        help="Like --plan but only print the number of test cases and files per test.",
+        action="store_true",
+        required=False,
+    )
+
+    parser.add_argument(
+        "--plan-format",
+        help="Output format of --plan and --stats. Default: text",
+        type=str,
+        required=False,
+        choices=PLAN_FORMATS,
+        default="text",
+    )
+
+    parser.add_argument(
+        "--watch",
+        help="After the expansion, watch the test definition, the kuttl test suite template and the templates "
+        "and expand the test cases affected by every change again. Stop with Ctrl-C.",
+        action="store_true",
+        required=False,
+    )
+
+    parser.add_argument(
+        "--watch-debounce",
+        help=f"Seconds to wait for further changes before expanding again. Default: {DEFAULT_DEBOUNCE}",
+        type=float,
+        required=False,
+        default=DEFAULT_DEBOUNCE,
+    )
+
+    parser.add_argument(
+        "--timings",
+        help="Write a JSON report with the time spent in each phase and the slowest test cases and templates to this file.",
+        type=str,
+        required=False,
+    )
+
+    parser.add_argument(
+        "--profile",
+        help="Write cProfile statistics to this file. Only the main process is profiled.",
+        type=str,
+        required=False,
+    )
+
     return parser.parse_args()
 
 
+def _positive_int(cli_arg: str) -> int:
+    value = int(cli_arg)
+    if value < 1:
+        raise ArgumentTypeError(f"must be at least 1 [{cli_arg}]")
+    return value
+
+
+def _non_negative_int(cli_arg: str) -> int:
+    value = int(cli_arg)
+    if value < 0:
+        raise ArgumentTypeError(f"must not be negative [{cli_arg}]")
+    return value
+
+
+def _dimension_value(cli_arg: str) -> Tuple[str, str]:
+    dim, sep, value = cli_arg.partition("=")
+    if not sep or not dim:
+        raise ArgumentTypeError(f"expected DIM=VALUE [{cli_arg}]")
+    return dim, value
+
+
+def _shard(cli_arg: str) -> Shard:
+    try:
+        return Shard.parse(cli_arg)
+    except ValueError as exc:
+        raise ArgumentTypeError(str(exc)) from exc
+
+
 def _cli_log_level(cli_arg: str) -> int:
     if cli_arg == "debug":
         return logging.DEBUG
@@ -90,15 +327,138 @@ def main() -> int:
     """Main"""
     cli_args = parse_cli_args()
     logging.basicConfig(encoding="utf-8", level=_cli_log_level(cli_args.log_level))
-    effective_test_suites = renderer_from_file(cli_args.test_definition)
-    rmtree(path=cli_args.output_dir, ignore_errors=True)
+    timings = Timings() if cli_args.timings else None
+    profiler = cProfile.Profile() if cli_args.profile else None
+    try:
+        if profiler is not None:
+            return profiler.runcall(_run, cli_args, timings)
+        return _run(cli_args, timings)
+    finally:
+        if profiler is not None:
+            logging.info("Writing profile to %s", cli_args.profile)
+            profiler.dump_stats(cli_args.profile)
+        if timings is not None:
+            timings.write(cli_args.timings)
+
+
+def _run(cli_args: Namespace, timings: Optional[Timings]) -> int:
+    test_filter = (
+        TestCaseFilter.from_criteria(cli_args.test, cli_args.tid, cli_args.where)
+        if cli_args.test or cli_args.tid or cli_args.where
+        else None
+    )
+    suites = [suite.strip() for suite in cli_args.suite.split(",") if suite.strip()]
+    if not suites and not cli_args.all_suites:
+        raise ValueError(f"No test suite given [{cli_args.suite}]")
+    # Several test suites are resolved together. Test cases are only created when they are expanded.
+    single_suite = suites[0] if len(suites) == 1 and not cli_args.all_suites else None
+    effective_test_suites = renderer_from_file(
+        cli_args.test_definition, single_suite, suite_cache_from(cli_args.cache_dir), timings, test_filter
+    )
+    if cli_args.all_suites:
+        suites = [ets.name for ets in effective_test_suites]
+    if cli_args.check:
+        with phase(timings, "check"):
+            errors = check(
+                suites,
+                effective_test_suites,
+                cli_args.template_dir,
+                cli_args.kuttl_test,
+                cli_args.namespace,
+                cli_args.jobs,
+            )
+        for error in errors:
+            print(error)
+        return 1 if errors else 0
+    costs = load_costs(cli_args.shard_costs) if cli_args.shard_costs else None
+    if cli_args.plan or cli_args.stats:
+        with phase(timings, "plan"):
+            results = [
+                plan(
+                    suite,
+                    effective_test_suites,
+                    cli_args.template_dir,
+                    cli_args.kuttl_test,
+                    cli_args.namespace,
+                    cli_args.shard,
+                    costs,
+                    with_test_cases=not cli_args.stats,
+                )
+                for suite in suites
+            ]
+        if cli_args.plan_format == "json":
+            print(json.dumps(results[0] if single_suite else results, indent=2))
+        else:
+            print("\n".join(format_plan(result) for result in results))
+        return 0
     # Compatibility warning: add 'tests' to output_dir
-    output_dir = path.join(cli_args.output_dir, "tests")
-    return expand(
-        cli_args.suite,
+    if single_suite:
+        output_dirs = {single_suite: path.join(cli_args.output_dir, "tests")}
+    else:
+        output_dirs = {suite: path.join(cli_args.output_dir, suite, "tests") for suite in suites}
+    fmt = output_format(cli_args.output_dir, cli_args.output_format)
+    if fmt != "dir":
+        if cli_args.watch:
+            raise ValueError("Cannot watch when writing an archive")
+        if cli_args.writers:
+            raise ValueError("Background writers can only write to a directory")
+        with open_sink(cli_args.output_dir, fmt, cli_args.dedupe) as sink:
+            return _expand(cli_args, output_dirs, effective_test_suites, timings, costs, sink)
+    if not cli_args.incremental:
+        with phase(timings, "clean"):
+            rmtree(path=cli_args.output_dir, ignore_errors=True)
+    if cli_args.watch:
+        if not single_suite:
+            raise ValueError("Cannot watch more than one test suite")
+        if cli_args.dedupe:
+            raise ValueError("Cannot deduplicate files in watch mode")
+        session = WatchSession(
+            cli_args.test_definition,
+            single_suite,
+            cli_args.template_dir,
+            output_dirs[single_suite],
+            cli_args.kuttl_test,
+            cli_args.namespace,
+            template_cache_from(cli_args.cache_dir, cli_args.cache_max_size),
+            cli_args.jobs,
+            cli_args.link_mode,
+            test_filter,
+            cli_args.shard,
+            costs,
+        )
+        try:
+            session.expand_all(cli_args.incremental, effective_test_suites)
+        except ValueError as exc:
+            logging.error("%s", exc)
+        session.run(cli_args.watch_debounce)
+        return 0
+    output_sink: OutputSink = open_sink(cli_args.output_dir, fmt, cli_args.dedupe)
+    if cli_args.writers:
+        output_sink = BackgroundSink(output_sink, cli_args.writers, cli_args.write_queue)
+    with output_sink:
+        return _expand(cli_args, output_dirs, effective_test_suites, timings, costs, output_sink)
+
+
+def _expand(
+    cli_args: Namespace,
+    output_dirs: Dict[str, str],
+    effective_test_suites: List[EffectiveTestSuite],
+    timings: Optional[Timings],
+    costs: Optional[Dict[str, float]],
+    sink: OutputSink,
+) -> int:
+    return expand_suites(
+        output_dirs,
         effective_test_suites,
         cli_args.template_dir,
-        output_dir,
         cli_args.kuttl_test,
         cli_args.namespace,
+        template_cache_from(cli_args.cache_dir, cli_args.cache_max_size),
+        cli_args.jobs,
+        cli_args.incremental,
+        cli_args.link_mode,
+        timings,
+        cli_args.shard,
+        costs,
+        sink,
     )
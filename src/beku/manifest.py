@@ -0,0 +1,116 @@
+"""Track the inputs of expanded test cases to support incremental expansion."""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+from hashlib import sha256
+from os import path
+from shutil import rmtree
+from typing import Dict, Iterable, List, Optional
+
+import jinja2
+
+from .version import __version__
+
+MANIFEST_FILE: str = ".beku-manifest.json"
+
+# Matches the environment variables looked up by templates with lookup('env', '<name>').
+PATTERN_LOOKUP_ENV: str = r"""lookup\(\s*['"]env['"]\s*,\s*['"]([^'"]+)['"]\s*\)"""
+
+
+def hash_test_definition(td_root: str) -> str:
+    """Return a hash over the names, modes and contents of all files of a test definition.
+
+    The values of environment variables looked up by the templates with lookup('env', ...) are also part of the
+    hash, because they change the rendered output.
+    """
+    digest = sha256()
+    env_names = set()
+    for root, dirs, files in os.walk(td_root):
+        dirs.sort()
+        for file_name in sorted(files):
+            file_path = path.join(root, file_name)
+            with open(file_path, mode="rb") as stream:
+                content = stream.read()
+            digest.update(path.relpath(file_path, td_root).encode("utf-8") + b"\0")
+            digest.update(str(os.stat(file_path).st_mode).encode("utf-8") + b"\0")
+            digest.update(sha256(content).digest())
+            env_names.update(re.findall(PATTERN_LOOKUP_ENV, content.decode("utf-8", errors="replace")))
+    for env_name in sorted(env_names):
+        digest.update(f"{env_name}={os.environ.get(env_name, '')}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def hash_test_case(
+    definition_hash: str, tid: str, values: Dict[str, str], namespace: str, link_mode: str = "copy"
+) -> str:
+    """Return a hash over all inputs of a test case."""
+    inputs = [__version__, jinja2.__version__, definition_hash, tid, values, namespace, link_mode]
+    return sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class Manifest:
+    """The manifest of an output directory lists the expanded test cases together with a hash of their inputs
+    and the directory they were expanded to.
+
+    Attributes:
+        base_dir (str) : Directory where the manifest file is stored and that all test case paths are relative to.
+        test_cases (Dict[str, Dict[str, str]]) : Manifest entries by test case id.
+    """
+
+    def __init__(self, base_dir: str, test_cases: Optional[Dict[str, Dict[str, str]]] = None) -> None:
+        self.base_dir = base_dir
+        self.test_cases: Dict[str, Dict[str, str]] = test_cases or {}
+
+    @classmethod
+    def load(cls, base_dir: str) -> Optional[Manifest]:
+        """Load the manifest from base_dir. Return None if there is no usable manifest."""
+        try:
+            with open(path.join(base_dir, MANIFEST_FILE), encoding="utf8") as stream:
+                content = json.load(stream)
+        except (OSError, ValueError) as exc:
+            logging.debug("Cannot load manifest from %s: %s", base_dir, exc)
+            return None
+        if not isinstance(content, dict) or content.get("version") != __version__:
+            logging.debug("Ignoring manifest written by another beku version")
+            return None
+        return cls(base_dir, content.get("test_cases", {}))
+
+    def save(self) -> None:
+        dest = path.join(self.base_dir, MANIFEST_FILE)
+        logging.debug("Write manifest %s", dest)
+        with open(dest, encoding="utf8", mode="w") as stream:
+            json.dump({"version": __version__, "test_cases": self.test_cases}, stream, indent=2, sort_keys=True)
+
+    def is_current(self, tid: str, input_hash: str) -> bool:
+        """Return True if the test case was expanded from the same inputs and its directory still exists."""
+        entry = self.test_cases.get(tid)
+        return (
+            entry is not None
+            and entry.get("hash") == input_hash
+            and path.isdir(path.join(self.base_dir, entry.get("path", "")))
+        )
+
+    def remove_stale(self, keep: Iterable[str]) -> List[str]:
+        """Delete the directories of all test cases that are not listed in keep and drop them from the manifest.
+        Return the ids of the deleted test cases."""
+        keep = set(keep)
+        stale = [tid for tid in self.test_cases if tid not in keep]
+        for tid in stale:
+            entry = self.test_cases.pop(tid)
+            tc_root = path.join(self.base_dir, entry.get("path", ""))
+            if entry.get("path") and path.normpath(tc_root) != path.normpath(self.base_dir):
+                logging.debug("Delete stale test case %s", tc_root)
+                rmtree(tc_root, ignore_errors=True)
+                _rmdir_if_empty(path.dirname(tc_root))
+        return stale
+
+
+def _rmdir_if_empty(dir_name: str) -> None:
+    try:
+        os.rmdir(dir_name)
+    except OSError:
+        pass
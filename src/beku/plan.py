@@ -0,0 +1,107 @@
+"""Report what an expansion would do without writing anything."""
+
+from __future__ import annotations
+
+from collections import Counter
+from os import path
+from typing import Any, Dict, List, Optional, Sequence
+
+from .kuttl import (
+    EffectiveTestSuite,
+    TestCase,
+    TestCases,
+    TestDefinitionIndex,
+    _sanity_checks,
+    test_names,
+)
+from .shard import Shard
+
+PLAN_FORMATS: List[str] = ["text", "json"]
+
+
+def plan(
+    suite: str,
+    effective_test_suites: List[EffectiveTestSuite],
+    template_dir: str,
+    kuttl_tests: str,
+    namespace: str,
+    shard: Optional[Shard] = None,
+    costs: Optional[Dict[str, float]] = None,
+    with_test_cases: bool = True,
+) -> Dict[str, Any]:
+    """Plan the expansion of the test suite like expand() would do it, without writing anything."""
+    try:
+        ets = next((s for s in effective_test_suites if suite == s.name))
+    except StopIteration as exc:
+        raise ValueError(f"Cannot plan test suite [{suite}] because cannot find it") from exc
+    test_cases: Sequence[TestCase] = ets.test_cases
+    if shard is not None:
+        test_cases = shard.select(ets.test_cases, costs)
+    _sanity_checks(test_cases, template_dir, kuttl_tests)
+    return make_plan(ets, test_cases, template_dir, namespace, with_test_cases)
+
+
+def make_plan(
+    ets: EffectiveTestSuite,
+    test_cases: Sequence[TestCase],
+    template_dir: str,
+    namespace: str,
+    with_test_cases: bool = True,
+) -> Dict[str, Any]:
+    """Return the statistics of the expansion of the test cases of the effective test suite.
+
+    The number of test cases per test is taken from the test matrices when possible, so statistics of large
+    matrices are computed without creating the test cases. Rendered bytes are estimated with the size of the
+    template sources. If with_test_cases is True, the ids and namespaces of all test cases are listed too.
+    """
+    if isinstance(test_cases, TestCases):
+        counts: Counter[str] = Counter()
+        for matrix in test_cases.matrices:
+            counts[matrix.name] += len(matrix)
+    else:
+        counts = Counter(tc.name for tc in test_cases)
+    ids: Dict[str, List[Dict[str, str]]] = {}
+    if with_test_cases:
+        for tc in test_cases:
+            ids.setdefault(tc.name, []).append({"tid": tc.tid, "namespace": tc.namespace(namespace)})
+    tests = []
+    for name in test_names(test_cases):
+        index = TestDefinitionIndex.scan(path.join(template_dir, name))
+        templates = [e for e in index.entries if e.template_name is not None]
+        files = [e for e in index.entries if e.template_name is None]
+        size = sum(path.getsize(path.join(index.td_root, e.rel_dir, e.file_name)) for e in index.entries)
+        test: Dict[str, Any] = {
+            "name": name,
+            "test_cases": counts[name],
+            "rendered_files": len(templates) * counts[name],
+            "copied_files": len(files) * counts[name],
+            "estimated_bytes": size * counts[name],
+        }
+        if with_test_cases:
+            test["test_case_ids"] = ids[name]
+        tests.append(test)
+    return {
+        "suite": ets.name,
+        "test_cases": sum(t["test_cases"] for t in tests),
+        "rendered_files": sum(t["rendered_files"] for t in tests),
+        "copied_files": sum(t["copied_files"] for t in tests),
+        "estimated_bytes": sum(t["estimated_bytes"] for t in tests),
+        "tests": tests,
+    }
+
+
+def format_plan(plan: Dict[str, Any]) -> str:
+    """Format the plan returned by make_plan() as text."""
+    lines = [f"Test suite [{plan['suite']}]: {_summary(plan)}"]
+    for test in plan["tests"]:
+        lines.append(f"  Test [{test['name']}]: {_summary(test)}")
+        for tc in test.get("test_case_ids", []):
+            lines.append(f"    {tc['tid']} {tc['namespace']}")
+    return "\n".join(lines)
+
+
+def _summary(stats: Dict[str, Any]) -> str:
+    return (
+        f"{stats['test_cases']} test cases, {stats['rendered_files']} rendered files, "
+        f"{stats['copied_files']} copied files, ~{stats['estimated_bytes']} bytes"
+    )
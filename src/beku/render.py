@@ -0,0 +1,182 @@
+"""Share rendered templates between test cases that use the same variables."""
+
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Hashable, Iterable, Iterator, Optional, Set, Tuple
+
+from jinja2 import Environment, nodes
+
+from .cache import TemplateCache
+
+# Names of the variables that differ between the test cases of a test definition.
+VAR_TEST_SCENARIO: str = "test_scenario"
+VAR_NAMESPACE: str = "NAMESPACE"
+
+# Stands in for test case values that are not defined.
+_MISSING = object()
+
+
+class _Unknown(Exception):
+    """The template uses test case variables in a way the analysis cannot follow."""
+
+
+@dataclass(frozen=True)
+class TemplateUsage:
+    """The test case variables referenced by a template.
+
+    Attributes:
+        keys (FrozenSet[str]) : Keys of test_scenario['values'] used by the template.
+        namespace (bool) : True if the template uses NAMESPACE.
+    """
+
+    keys: FrozenSet[str]
+    namespace: bool
+
+
+def analyse_template(env: Environment, template_name: str, source: Optional[str] = None) -> Optional[TemplateUsage]:
+    """Statically determine the test case variables a template references. If not given, the source is read
+    from the loader of the environment.
+
+    Return None if that can't be determined, for example because the template includes other templates, assigns
+    the test case variables or accesses test_scenario['values'] with keys that are not constant.
+    """
+    if source is None:
+        source, _, _ = env.loader.get_source(env, template_name)  # type: ignore[union-attr]
+    ast = env.parse(source, template_name)
+    if any(True for _ in ast.find_all((nodes.Extends, nodes.Include, nodes.Import, nodes.FromImport))):
+        return None
+    keys: Set[str] = set()
+    try:
+        uses_namespace = _walk(ast, keys)
+    except _Unknown:
+        return None
+    return TemplateUsage(keys=frozenset(keys), namespace=uses_namespace)
+
+
+def _walk(node: nodes.Node, keys: Set[str]) -> bool:
+    """Collect the keys of test_scenario['values'] used below node. Return True if NAMESPACE is used."""
+    key = _values_key(node)
+    if key is not None:
+        keys.add(key)
+        return False
+    if isinstance(node, nodes.Name) and node.name in (VAR_TEST_SCENARIO, VAR_NAMESPACE):
+        if node.name == VAR_TEST_SCENARIO or node.ctx != "load":
+            raise _Unknown()
+        return True
+    uses_namespace = False
+    for child in node.iter_child_nodes():
+        uses_namespace = _walk(child, keys) or uses_namespace
+    return uses_namespace
+
+
+def _values_key(node: nodes.Node) -> Optional[str]:
+    """Return the key if node is test_scenario['values']['<key>'] or test_scenario['values'].<key>"""
+    if isinstance(node, nodes.Getitem) and isinstance(node.arg, nodes.Const) and isinstance(node.arg.value, str):
+        key = node.arg.value
+    elif isinstance(node, nodes.Getattr) and not hasattr(dict, node.attr):
+        key = node.attr
+    else:
+        return None
+    values = node.node
+    if (
+        isinstance(values, nodes.Getitem)
+        and isinstance(values.arg, nodes.Const)
+        and values.arg.value == "values"
+        and isinstance(values.node, nodes.Name)
+        and values.node.name == VAR_TEST_SCENARIO
+        and values.node.ctx == "load"
+    ):
+        return key
+    return None
+
+
+class RenderCache:
+    """Render the templates of a test definition once per distinct set of variable values they use.
+
+    Templates that reference only some of the test case values are rendered once for every combination of the
+    referenced values and the result is reused by all test cases with the same combination. Templates that can't be
+    analysed, or whose output is unique per test case anyway, are rendered for every test case and not cached.
+
+    If the bytecode cache of the environment is a TemplateCache, the analysis of the templates is persisted
+    together with the compiled templates, so warm runs don't parse the templates again.
+
+    Attributes:
+        env (Environment) : The Jinja environment of the test definition.
+        shared_namespace (bool) : True if all test cases use the same NAMESPACE.
+    """
+
+    def __init__(self, env: Environment, shared_namespace: bool) -> None:
+        self.env = env
+        self.shared_namespace = shared_namespace
+        self._usages: Dict[str, Optional[TemplateUsage]] = {}
+        self._rendered: Dict[Tuple[Hashable, ...], str] = {}
+        self.hits = 0
+
+    def usage(self, template_name: str) -> Optional[TemplateUsage]:
+        if template_name not in self._usages:
+            try:
+                self._usages[template_name] = self._analyse(template_name)
+            except Exception as exc:
+                logging.debug("Cannot analyse template %s: %s", template_name, exc)
+                self._usages[template_name] = None
+            logging.debug("Template %s uses %s", template_name, self._usages[template_name])
+        return self._usages[template_name]
+
+    def _analyse(self, template_name: str) -> Optional[TemplateUsage]:
+        """Analyse the template or load the analysis from the template cache."""
+        cache = self.env.bytecode_cache
+        if not isinstance(cache, TemplateCache):
+            return analyse_template(self.env, template_name)
+        source, _, _ = self.env.loader.get_source(self.env, template_name)  # type: ignore[union-attr]
+        data = cache.load_usage(self.env, template_name, source)
+        if data is not None:
+            if data["keys"] is None:
+                return None
+            return TemplateUsage(keys=frozenset(data["keys"]), namespace=data["namespace"])
+        usage = analyse_template(self.env, template_name, source)
+        cache.store_usage(
+            self.env,
+            template_name,
+            source,
+            {"keys": None} if usage is None else {"keys": sorted(usage.keys), "namespace": usage.namespace},
+        )
+        return usage
+
+    def cache_key(self, template_name: str, values: Dict[str, str], namespace: str) -> Optional[Tuple[Hashable, ...]]:
+        """Return the key of the rendered template in the cache or None if it should not be cached."""
+        usage = self.usage(template_name)
+        if usage is None or (usage.namespace and not self.shared_namespace) or usage.keys.issuperset(values):
+            return None
+        return (
+            template_name,
+            tuple((k, values.get(k, _MISSING)) for k in sorted(usage.keys)),
+            namespace if usage.namespace else None,
+        )
+
+    def generate(self, template_name: str, values: Dict[str, str], namespace: str) -> Iterator[str]:
+        """Generate the output of the template for a test case. Templates that are not cached are streamed."""
+        key = self.cache_key(template_name, values, namespace)
+        if key is not None and key in self._rendered:
+            logging.debug("Reuse rendered template %s", template_name)
+            self.hits += 1
+            yield self._rendered[key]
+            return
+        context = {VAR_TEST_SCENARIO: {"values": values}, VAR_NAMESPACE: namespace}
+        template = self.env.get_template(template_name)
+        if key is None:
+            yield from template.generate(context)
+        else:
+            self._rendered[key] = template.render(context)
+            yield self._rendered[key]
+
+    def invalidate(self, template_names: Iterable[str]) -> None:
+        """Forget the analysis and the rendered output of the templates, for example because they changed."""
+        names = set(template_names)
+        for name in names:
+            self._usages.pop(name, None)
+        self._rendered = {k: v for k, v in self._rendered.items() if k[0] not in names}
+
+    def render(self, template_name: str, values: Dict[str, str], namespace: str) -> str:
+        return "".join(self.generate(template_name, values, namespace))
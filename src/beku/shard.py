@@ -0,0 +1,94 @@
+"""Split the test cases of a test suite into balanced shards."""
+
+from __future__ import annotations
+
+import json
+import logging
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from statistics import median
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Sequence
+
+if TYPE_CHECKING:
+    from .kuttl import TestCase
+
+# Cost of a test case when no cost map is given.
+DEFAULT_COST: float = 1.0
+
+
+@dataclass(frozen=True)
+class Shard:
+    """One of count shards of a test suite.
+
+    Attributes:
+        index (int) : Index of the shard, starting with 1.
+        count (int) : Total number of shards.
+    """
+
+    index: int
+    count: int
+
+    def __post_init__(self) -> None:
+        if self.count < 1 or not 1 <= self.index <= self.count:
+            raise ValueError(f"Invalid shard [{self.index}/{self.count}]")
+
+    @classmethod
+    def parse(cls, value: str) -> Shard:
+        """Parse a shard given as INDEX/COUNT, for example 2/4."""
+        index, sep, count = value.partition("/")
+        if not (sep and index.strip().isdigit() and count.strip().isdigit()):
+            raise ValueError(f"Invalid shard [{value}], expected INDEX/COUNT")
+        return cls(index=int(index), count=int(count))
+
+    def select(self, test_cases: Iterable[TestCase], costs: Optional[Dict[str, float]] = None) -> List[TestCase]:
+        """Return the test cases of this shard in their original order."""
+        all_test_cases = list(test_cases)
+        members = set(assign([tc.tid for tc in all_test_cases], self.count, costs)[self.index - 1])
+        logging.info("Shard %d/%d has %d of %d test cases", self.index, self.count, len(members), len(all_test_cases))
+        return [tc for tc in all_test_cases if tc.tid in members]
+
+
+def assign(tids: Sequence[str], count: int, costs: Optional[Dict[str, float]] = None) -> List[List[str]]:
+    """Distribute the test case ids to count shards so that the sum of the costs of every shard is about the same.
+
+    The most expensive test cases are assigned first, each one to the shard with the lowest total cost so far.
+    Ties are broken by the test case id and the shard index, so the result only depends on the ids and the costs.
+    Test cases without a cost get the median of the known costs.
+    """
+    costs = costs or {}
+    known = [costs[tid] for tid in tids if tid in costs]
+    default = median(known) if known else DEFAULT_COST
+    shards: List[List[str]] = [[] for _ in range(count)]
+    totals = [0.0] * count
+    for tid in sorted(set(tids), key=lambda tid: (-costs.get(tid, default), tid)):
+        target = min(range(count), key=lambda i: (totals[i], i))
+        shards[target].append(tid)
+        totals[target] += costs.get(tid, default)
+    for i, total in enumerate(totals):
+        logging.debug("Shard %d/%d has an estimated cost of %.2f", i + 1, count, total)
+    return shards
+
+
+def load_costs(file_name: str) -> Dict[str, float]:
+    """Load the cost of the test cases from a JSON object mapping test case ids to seconds or from a JUnit XML
+    report written by kuttl. In JUnit reports, the name of every test case is the last path element of its name
+    attribute and the durations of test cases with the same name are added."""
+    with open(file_name, mode="rb") as stream:
+        content = stream.read()
+    if content.lstrip().startswith(b"<"):
+        return _costs_from_junit(content)
+    costs = json.loads(content)
+    if not isinstance(costs, dict):
+        raise ValueError(f"Expected a JSON object with test case costs in [{file_name}]")
+    return {str(tid): float(cost) for tid, cost in costs.items()}
+
+
+def _costs_from_junit(content: bytes) -> Dict[str, float]:
+    costs: Dict[str, float] = {}
+    for testcase in ET.fromstring(content).iter("testcase"):
+        name = testcase.get("name")
+        if not name:
+            continue
+        tid = name.rstrip("/").rsplit("/", 1)[-1]
+        costs[tid] = costs.get(tid, 0.0) + float(testcase.get("time") or 0.0)
+    return costs
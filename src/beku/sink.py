@@ -0,0 +1,586 @@
+"""Destinations for the files of an expansion: a directory, a tar or zip archive or memory."""
+
+from __future__ import annotations
+
+import gzip
+import io
+import logging
+import os
+import stat
+import sys
+import tarfile
+import zipfile
+from hashlib import sha256
+from os import makedirs, path
+from shutil import copy2, copystat
+from queue import Queue
+from threading import Thread, get_ident
+from typing import IO, Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+# Size of the write buffer for rendered templates.
+RENDER_BUFFER_SIZE: int = 64 * 1024
+
+# How static test files are placed into the test case directories.
+LINK_MODES: List[str] = ["copy", "hardlink", "symlink", "reflink"]
+
+# Formats of the expanded test suite. "dir" writes the files to the output folder.
+OUTPUT_FORMATS: List[str] = ["dir", "tar", "tar.gz", "zip"]
+
+# Maximum number of files waiting for the writer threads of a BackgroundSink.
+DEFAULT_WRITE_QUEUE_DEPTH: int = 64
+
+# Mode of files and directories in archives when it is not taken from a source file.
+DEFAULT_FILE_MODE: int = 0o644
+DEFAULT_DIR_MODE: int = 0o755
+
+# Timestamp of the entries in a zip archive. Zip can't represent dates before 1980.
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# Folder of the content-addressed store of a DedupeSink, below the output folder.
+STORE_DIR: str = ".beku-store"
+
+# ioctl request to clone a file on Linux file systems that support reflinks (btrfs, xfs, ...)
+_FICLONE: int = 0x40049409
+
+
+def link_file(source: str, dest: str, link_mode: str) -> None:
+    """Place the source file at dest according to the link mode. The file mode is preserved.
+
+    * copy : copy the file contents.
+    * hardlink : create a hard link to the source. Falls back to copy if that is not possible.
+    * symlink : create a symbolic link to the absolute source path.
+    * reflink : clone the file (copy-on-write). Falls back to copy_file_range and then to copy.
+    """
+    if link_mode == "hardlink":
+        try:
+            os.link(source, dest)
+            return
+        except OSError as exc:
+            logging.debug("Cannot hard link %s, falling back to copy: %s", source, exc)
+    elif link_mode == "symlink":
+        os.symlink(path.abspath(source), dest)
+        return
+    elif link_mode == "reflink":
+        try:
+            _clone_file(source, dest)
+            copystat(source, dest)
+            return
+        except OSError as exc:
+            logging.debug("Cannot clone %s, falling back to copy: %s", source, exc)
+    elif link_mode != "copy":
+        raise ValueError(f"Unknown link mode [{link_mode}]")
+    # copy2 also preserves the file mode
+    copy2(source, dest)
+
+
+def _clone_file(source: str, dest: str) -> None:
+    """Clone source to dest with a reflink or with copy_file_range(), without reading the data in user space."""
+    with open(source, mode="rb") as src, open(dest, mode="wb") as dst:
+        try:
+            import fcntl
+
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+            return
+        except (ImportError, OSError) as exc:
+            logging.debug("Cannot reflink %s: %s", source, exc)
+        if not hasattr(os, "copy_file_range"):
+            raise OSError(f"copy_file_range() is not available to clone [{source}]")
+        remaining = os.fstat(src.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+            if copied == 0:
+                raise OSError(f"copy_file_range() stopped early while cloning [{source}]")
+            remaining -= copied
+
+
+def write_rendered(dest: str, chunks: Iterable[str]) -> None:
+    """Write the output of a template to dest as it is generated, followed by a newline (like print() does).
+    At most RENDER_BUFFER_SIZE bytes are buffered before they are written to the file.
+    """
+    with open(dest, encoding="utf8", mode="w", buffering=RENDER_BUFFER_SIZE) as stream:
+        for chunk in chunks:
+            stream.write(chunk)
+        stream.write("\n")
+
+
+class OutputSink:
+    """Receives the directories and files of an expansion.
+
+    Files are addressed by their path in the output folder. Sinks that don't write to the file system store
+    them by their path relative to root, with "/" as separator.
+
+    Attributes:
+        root (str) : The output folder.
+        bytes_written (int) : Number of bytes written so far. Symbolic links are not counted.
+        parallel_safe (bool) : True if worker processes can write to the sink directly. Otherwise the files of
+                               the workers are collected in memory and replayed into the sink.
+        is_directory (bool) : True if the files end up in a directory of the file system.
+    """
+
+    parallel_safe: bool = False
+    is_directory: bool = False
+
+    def __init__(self, root: str = "") -> None:
+        self.root = root
+        self.bytes_written = 0
+
+    def mkdir(self, dir_name: str) -> None:
+        """Create the directory and its parents if they don't exist yet."""
+        raise NotImplementedError
+
+    def write_bytes(self, file_name: str, data: bytes, mode: Optional[int] = None) -> None:
+        """Write the file with the given content. If mode is None, a default file mode is used."""
+        raise NotImplementedError
+
+    def write(self, file_name: str, chunks: Iterable[str], mode: Optional[int] = None) -> None:
+        """Write the output of a template followed by a newline (like print() does)."""
+        self.write_bytes(file_name, ("".join(chunks) + "\n").encode("utf8"), mode)
+
+    def copy(self, source: str, file_name: str, link_mode: str = "copy") -> None:
+        """Copy the source file including its mode. Sinks that are not directories ignore the link_mode."""
+        with open(source, mode="rb") as stream:
+            data = stream.read()
+        self.write_bytes(file_name, data, stat.S_IMODE(os.stat(source).st_mode))
+
+    def flush(self) -> None:
+        """Wait until all files handed to the sink are written. Raises the first error that happened meanwhile."""
+
+    def close(self) -> None:
+        """Finish the output. Nothing can be written afterwards."""
+
+    def name(self, file_name: str) -> str:
+        """Return the path of the file relative to root with "/" as separator."""
+        return "/".join(path.relpath(file_name, self.root or ".").split(os.sep))
+
+    def __enter__(self) -> OutputSink:
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+class DirectorySink(OutputSink):
+    """Write the files to the file system. Files that are not templates are placed according to the link mode."""
+
+    parallel_safe = True
+    is_directory = True
+
+    def mkdir(self, dir_name: str) -> None:
+        try:
+            logging.debug("Creating directory %s", dir_name)
+            makedirs(dir_name)
+        except FileExistsError:
+            pass
+
+    def write_bytes(self, file_name: str, data: bytes, mode: Optional[int] = None) -> None:
+        with open(file_name, mode="wb") as stream:
+            stream.write(data)
+        if mode is not None:
+            os.chmod(file_name, mode)
+        self.bytes_written += len(data)
+
+    def write(self, file_name: str, chunks: Iterable[str], mode: Optional[int] = None) -> None:
+        write_rendered(file_name, chunks)
+        if mode is not None:
+            logging.debug("Update file mode for %s", file_name)
+            os.chmod(file_name, mode)
+        self.bytes_written += path.getsize(file_name)
+
+    def copy(self, source: str, file_name: str, link_mode: str = "copy") -> None:
+        link_file(source, file_name, link_mode)
+        if link_mode != "symlink":
+            self.bytes_written += path.getsize(source)
+
+
+class DedupeSink(DirectorySink):
+    """Write every distinct file once to a content-addressed store below root and hard link it into the test case
+    directories. Files are stored by the hash of their content and their mode, because all links of a file share
+    the mode. Files that are not templates are stored as well unless the link_mode links them to their source.
+
+    The store is shared by all worker processes. A file is written to a temporary file first and then linked
+    into the store, so concurrent writers of the same content don't see partial files.
+    When the sink is closed, files in the store that are not linked anymore are removed and the bytes and
+    inodes saved in the whole output folder are logged.
+
+    Attributes:
+        store_dir (str) : Folder of the content-addressed store.
+        saved_bytes (int) : Bytes saved by the links, computed when the sink is closed.
+        saved_inodes (int) : Inodes saved by the links, computed when the sink is closed.
+    """
+
+    def __init__(self, root: str = "") -> None:
+        super().__init__(root)
+        self.store_dir = path.join(root, STORE_DIR)
+        self.saved_bytes = 0
+        self.saved_inodes = 0
+
+    def write_bytes(self, file_name: str, data: bytes, mode: Optional[int] = None) -> None:
+        if mode is None:
+            # The default mode depends on the umask, only files with an explicit mode are stored.
+            super().write_bytes(file_name, data, mode)
+            return
+        mode = stat.S_IMODE(mode)
+        stored = path.join(self.store_dir, f"{sha256(data).hexdigest()}-{mode:o}")
+        if not path.exists(stored):
+            self._store(stored, data, mode)
+        try:
+            _replace_link(stored, file_name)
+        except OSError as exc:
+            # For example when the file system doesn't support hard links or the file has too many of them
+            logging.debug("Cannot hard link %s, falling back to copy: %s", stored, exc)
+            super().write_bytes(file_name, data, mode)
+            return
+        self.bytes_written += len(data)
+
+    def write(self, file_name: str, chunks: Iterable[str], mode: Optional[int] = None) -> None:
+        OutputSink.write(self, file_name, chunks, mode)
+
+    def copy(self, source: str, file_name: str, link_mode: str = "copy") -> None:
+        if link_mode in ("copy", "reflink"):
+            OutputSink.copy(self, source, file_name, link_mode)
+        else:
+            super().copy(source, file_name, link_mode)
+
+    def close(self) -> None:
+        self.saved_bytes, self.saved_inodes = self.prune()
+        _log_savings(self.saved_bytes, self.saved_inodes)
+
+    def prune(self) -> Tuple[int, int]:
+        """Remove the files of the store that are not linked into the output folder anymore. Return the bytes and
+        inodes saved by the remaining links, taking the store folder itself into account."""
+        saved_bytes = saved_inodes = 0
+        try:
+            entries = list(os.scandir(self.store_dir))
+        except FileNotFoundError:
+            return 0, 0
+        for entry in entries:
+            st = entry.stat(follow_symlinks=False)
+            if st.st_nlink <= 1:
+                logging.debug("Removing unused file %s from the store", entry.path)
+                os.unlink(entry.path)
+            else:
+                saved_bytes += (st.st_nlink - 2) * st.st_size
+                saved_inodes += st.st_nlink - 2
+        return saved_bytes, max(0, saved_inodes - 1)
+
+    def _store(self, stored: str, data: bytes, mode: int) -> None:
+        makedirs(self.store_dir, exist_ok=True)
+        tmp = f"{stored}.{os.getpid()}-{get_ident()}.tmp"
+        with open(tmp, mode="wb") as stream:
+            stream.write(data)
+        try:
+            os.chmod(tmp, mode)
+            os.link(tmp, stored)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp)
+
+
+def _replace_link(source: str, dest: str) -> None:
+    """Hard link source to dest, replacing dest if it exists."""
+    try:
+        os.link(source, dest)
+    except FileExistsError:
+        os.unlink(dest)
+        os.link(source, dest)
+
+
+def _log_savings(saved_bytes: int, saved_inodes: int) -> None:
+    logging.info("Deduplication saved %d bytes and %d inodes", saved_bytes, saved_inodes)
+
+
+class MemorySink(OutputSink):
+    """Keep the files in memory. Meant for library callers and to collect the files of worker processes.
+
+    Attributes:
+        dirs (List[str]) : Directories in the order they were created.
+        files (Dict[str, bytes]) : File contents in the order they were written.
+        modes (Dict[str, int]) : Permission bits of the files.
+        events (List[Tuple[str, Optional[bytes], int]]) : Created directories and written files in order, as name,
+                                                          content and permission bits. The content of directories
+                                                          is None.
+    """
+
+    def __init__(self, root: str = "") -> None:
+        super().__init__(root)
+        self.dirs: List[str] = []
+        self.files: Dict[str, bytes] = {}
+        self.modes: Dict[str, int] = {}
+        self.events: List[Tuple[str, Optional[bytes], int]] = []
+
+    def mkdir(self, dir_name: str) -> None:
+        name = self.name(dir_name)
+        if name == "." or name in self.dirs:
+            return
+        self.mkdir(path.dirname(dir_name))
+        self.dirs.append(name)
+        self.events.append((name, None, DEFAULT_DIR_MODE))
+
+    def write_bytes(self, file_name: str, data: bytes, mode: Optional[int] = None) -> None:
+        name = self.name(file_name)
+        self.files[name] = data
+        self.modes[name] = DEFAULT_FILE_MODE if mode is None else stat.S_IMODE(mode)
+        self.events.append((name, data, self.modes[name]))
+        self.bytes_written += len(data)
+
+    def replay(self, sink: OutputSink) -> None:
+        """Create the directories and write the files to the sink, below its root, in the order they were created
+        here. Archives then do not depend on how the test cases were split between the worker processes."""
+        for name, data, mode in self.events:
+            if data is None:
+                sink.mkdir(path.join(sink.root, name))
+            else:
+                sink.write_bytes(path.join(sink.root, name), data, mode)
+
+
+class _ArchiveSink(OutputSink):
+    """Base class of the archive sinks. Entries are written in the order they are created, so the archive only
+    depends on the expanded files. Parent directories are added before their children."""
+
+    def __init__(self, stream: IO[bytes], root: str = "", close_stream: bool = False) -> None:
+        super().__init__(root)
+        self._stream = stream
+        self._close_stream = close_stream
+        self._dirs: Set[str] = {"."}
+
+    def mkdir(self, dir_name: str) -> None:
+        name = self.name(dir_name)
+        if name in self._dirs:
+            return
+        self.mkdir(path.dirname(dir_name))
+        self._dirs.add(name)
+        self._add(name, None, DEFAULT_DIR_MODE)
+
+    def write_bytes(self, file_name: str, data: bytes, mode: Optional[int] = None) -> None:
+        self._add(self.name(file_name), data, DEFAULT_FILE_MODE if mode is None else stat.S_IMODE(mode))
+        self.bytes_written += len(data)
+
+    def _add(self, name: str, data: Optional[bytes], mode: int) -> None:
+        """Add a file or, if data is None, a directory to the archive."""
+        raise NotImplementedError
+
+    def _finish(self) -> None:
+        """Write the end of the archive."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        try:
+            self._finish()
+        finally:
+            if self._close_stream:
+                self._stream.close()
+            else:
+                self._stream.flush()
+
+
+class TarSink(_ArchiveSink):
+    """Stream the files to a tar archive, optionally compressed with gzip.
+
+    All entries belong to root and have the same modification time, SOURCE_DATE_EPOCH or 0, so the same
+    expansion always produces the same archive.
+
+    With dedupe, a file with the same content and mode as an earlier one is added as a hard link to it.
+
+    Attributes:
+        saved_bytes (int) : Bytes of file content replaced by hard links.
+        saved_inodes (int) : Number of files replaced by hard links.
+    """
+
+    def __init__(
+        self,
+        stream: IO[bytes],
+        root: str = "",
+        compress: bool = False,
+        close_stream: bool = False,
+        dedupe: bool = False,
+    ) -> None:
+        super().__init__(stream, root, close_stream)
+        self._gzip = gzip.GzipFile(filename="", mode="wb", fileobj=stream, mtime=0) if compress else None
+        self._tar = tarfile.open(fileobj=self._gzip or stream, mode="w|", format=tarfile.PAX_FORMAT)
+        self._mtime = int(os.environ.get("SOURCE_DATE_EPOCH", "0"))
+        # Name of the first entry by content hash and mode
+        self._links: Optional[Dict[Tuple[bytes, int], str]] = {} if dedupe else None
+        self.saved_bytes = 0
+        self.saved_inodes = 0
+
+    def _add(self, name: str, data: Optional[bytes], mode: int) -> None:
+        info = tarfile.TarInfo(name)
+        info.mode = mode
+        info.mtime = self._mtime
+        if data is None:
+            info.type = tarfile.DIRTYPE
+            self._tar.addfile(info)
+            return
+        if self._links is not None:
+            first = self._links.setdefault((sha256(data).digest(), mode), name)
+            if first != name:
+                info.type = tarfile.LNKTYPE
+                info.linkname = first
+                self._tar.addfile(info)
+                self.saved_bytes += len(data)
+                self.saved_inodes += 1
+                return
+        info.size = len(data)
+        self._tar.addfile(info, io.BytesIO(data))
+
+    def _finish(self) -> None:
+        self._tar.close()
+        if self._gzip is not None:
+            self._gzip.close()
+        if self._links is not None:
+            _log_savings(self.saved_bytes, self.saved_inodes)
+
+
+class ZipSink(_ArchiveSink):
+    """Write the files to a zip archive. All entries have the same timestamp, so the same expansion always
+    produces the same archive."""
+
+    def __init__(self, stream: IO[bytes], root: str = "", close_stream: bool = False) -> None:
+        super().__init__(stream, root, close_stream)
+        self._zip = zipfile.ZipFile(stream, mode="w", compression=zipfile.ZIP_DEFLATED)
+
+    def _add(self, name: str, data: Optional[bytes], mode: int) -> None:
+        info = zipfile.ZipInfo(name + "/" if data is None else name, date_time=ZIP_DATE_TIME)
+        info.create_system = 3  # Unix, so the file mode in external_attr is used on extraction
+        if data is None:
+            info.external_attr = (stat.S_IFDIR | mode) << 16 | 0x10  # MS-DOS directory flag
+            self._zip.writestr(info, b"")
+        else:
+            info.external_attr = (stat.S_IFREG | mode) << 16
+            info.compress_type = zipfile.ZIP_DEFLATED
+            self._zip.writestr(info, data)
+
+    def _finish(self) -> None:
+        self._zip.close()
+
+
+class BackgroundSink(OutputSink):
+    """Write the files of a directory sink in writer threads, so the next template is rendered while the previous
+    files are written. This helps when the file system has a high latency.
+
+    Templates are rendered to memory and handed to a queue of at most queue_depth files. When the queue is full,
+    the rendering thread waits for the writers. Directories are created on the calling thread, before the files
+    in them are queued. The first error of a writer is raised by the next call that queues a file or by flush(),
+    so it may be raised while a later file is handed to the sink.
+    The writer threads are started when a file is queued and stopped by flush(), so no writer is running when
+    worker processes are forked. Worker processes start their own writers.
+    """
+
+    def __init__(self, target: OutputSink, writers: int = 1, queue_depth: int = DEFAULT_WRITE_QUEUE_DEPTH) -> None:
+        if not target.is_directory:
+            raise ValueError("Background writers can only write to a directory")
+        if writers < 1 or queue_depth < 1:
+            raise ValueError(f"Invalid number of writers [{writers}] or queue depth [{queue_depth}]")
+        super().__init__(target.root)
+        self.target = target
+        self.writers = writers
+        self.queue_depth = queue_depth
+        self.parallel_safe = target.parallel_safe
+        self.is_directory = target.is_directory
+        self._queue: Optional[Queue[Optional[Tuple[Callable[..., None], Tuple[Any, ...]]]]] = None
+        self._threads: List[Thread] = []
+        self._error: Optional[BaseException] = None
+        # Process that started the writer threads
+        self._pid = 0
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {**self.__dict__, "_queue": None, "_threads": [], "_error": None, "_pid": 0}
+
+    def mkdir(self, dir_name: str) -> None:
+        self.target.mkdir(dir_name)
+
+    def write_bytes(self, file_name: str, data: bytes, mode: Optional[int] = None) -> None:
+        self._submit(self.target.write_bytes, file_name, data, mode)
+        self.bytes_written += len(data)
+
+    def copy(self, source: str, file_name: str, link_mode: str = "copy") -> None:
+        self._submit(self.target.copy, source, file_name, link_mode)
+        if link_mode != "symlink":
+            self.bytes_written += path.getsize(source)
+
+    def flush(self) -> None:
+        """Wait until all queued files are written and stop the writer threads. Raises the first error."""
+        if self._queue is not None and self._pid == os.getpid():
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+        self._queue = None
+        self._threads = []
+        self._raise_error()
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            self.target.close()
+
+    def _submit(self, func: Callable[..., None], *args: Any) -> None:
+        self._raise_error()
+        if self._queue is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._queue = Queue(maxsize=self.queue_depth)
+            self._threads = [
+                Thread(target=self._drain, args=(self._queue,), name=f"beku-writer-{i}", daemon=True)
+                for i in range(self.writers)
+            ]
+            for thread in self._threads:
+                thread.start()
+        self._queue.put((func, args))
+
+    def _drain(self, queue: Queue[Optional[Tuple[Callable[..., None], Tuple[Any, ...]]]]) -> None:
+        while (item := queue.get()) is not None:
+            func, args = item
+            try:
+                # Files queued after an error are dropped, the error is raised anyway.
+                if self._error is None:
+                    func(*args)
+            except BaseException as exc:
+                self._error = self._error or exc
+            finally:
+                queue.task_done()
+        queue.task_done()
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+
+def output_format(output: str, fmt: Optional[str] = None) -> str:
+    """Return the output format, guessed from the name of the output if fmt is not given.
+    The output "-" is the standard output and defaults to tar."""
+    if fmt:
+        return fmt
+    if output == "-" or output.endswith(".tar"):
+        return "tar"
+    if output.endswith((".tar.gz", ".tgz")):
+        return "tar.gz"
+    if output.endswith(".zip"):
+        return "zip"
+    return "dir"
+
+
+def open_sink(output: str, fmt: str, dedupe: bool = False) -> OutputSink:
+    """Open the sink for the output in the given format. The output "-" is the standard output.
+    Archive entries are named relative to the output folder, for example "tests/<test>/<test case id>/...".
+    With dedupe, identical files are hard linked to a single copy.
+    """
+    if fmt == "dir":
+        return DedupeSink(output) if dedupe else DirectorySink(output)
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format [{fmt}]")
+    if fmt == "zip" and dedupe:
+        raise ValueError("Cannot deduplicate files in a zip archive because it cannot contain hard links")
+    if output == "-":
+        if fmt == "zip":
+            raise ValueError("Cannot write a zip archive to the standard output")
+        stream = sys.stdout.buffer
+    else:
+        stream = open(output, mode="wb")
+    # The output is not a directory but the paths given to the sink are still built below it, so the archive
+    # entries are named relative to it.
+    if fmt == "zip":
+        return ZipSink(stream, root=output, close_stream=output != "-")
+    return TarSink(stream, root=output, compress=fmt == "tar.gz", close_stream=output != "-", dedupe=dedupe)
@@ -0,0 +1,42 @@
+import os
+import tempfile
+import unittest
+
+from beku.benchmark.runner import PHASES, compare, run
+from beku.benchmark.workload import Workload
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_workload_is_deterministic(self):
+        workload = Workload(dimensions=3, values=2, tests=2, dims_per_test=2, files=4, file_size=256)
+        trees = []
+        for _ in range(2):
+            with tempfile.TemporaryDirectory() as root:
+                tests_dir = workload.generate(root)
+                tree = {}
+                for dir_path, _, files in os.walk(tests_dir):
+                    for file_name in files:
+                        with open(os.path.join(dir_path, file_name), encoding="utf8") as stream:
+                            tree[os.path.relpath(os.path.join(dir_path, file_name), tests_dir)] = stream.read()
+                trees.append(tree)
+        self.assertEqual(trees[0], trees[1])
+        self.assertEqual(2 + 2 * 4, len(trees[0]))
+
+    def test_run_times_all_phases(self):
+        workload = Workload(dimensions=2, values=2, tests=2, dims_per_test=2, files=4, file_size=256)
+        with tempfile.TemporaryDirectory() as root:
+            result = run(workload.generate(root), repeat=1)
+        self.assertEqual(PHASES, list(result["phases"]))
+        self.assertEqual(8, result["stats"]["test_cases"])
+        self.assertEqual(16, result["stats"]["templates"])
+
+    def test_compare(self):
+        baseline = {"phases": {"render": {"min": 1.0}, "write": {"min": 0.001}}}
+        result = {"phases": {"render": {"min": 1.05}, "write": {"min": 0.002}, "expand": {"min": 1.0}}}
+        self.assertEqual([], compare(baseline, result, 0.1))
+        result["phases"]["render"]["min"] = 1.2
+        self.assertEqual(1, len(compare(baseline, result, 0.1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from jinja2 import DictLoader
+
+from beku.cache import SuiteCache, TemplateCache
+from beku.kuttl import make_test_env, renderer_from_file
+from beku.render import RenderCache, TemplateUsage
+
+
+class TestTemplateCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.loader = DictLoader({"a.yaml.j2": "a: {{ NAMESPACE }}", "b.yaml.j2": "b: {{ NAMESPACE }}"})
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_warm_environment_loads_compiled_template(self):
+        cold = make_test_env("", self.loader, TemplateCache(self.tmp.name))
+        self.assertEqual("a: ns", cold.get_template("a.yaml.j2").render(NAMESPACE="ns"))
+        self.assertEqual(1, len(os.listdir(self.tmp.name)))
+
+        warm = make_test_env("", self.loader, TemplateCache(self.tmp.name))
+        warm.compile = None  # type: ignore[method-assign]
+        self.assertEqual("a: ns", warm.get_template("a.yaml.j2").render(NAMESPACE="ns"))
+
+    def test_warm_render_cache_loads_template_usage(self):
+        loader = DictLoader({"a.yaml.j2": "a: {{ test_scenario['values']['a'] }}", "c.yaml.j2": "{% include 'x' %}"})
+        cold = RenderCache(make_test_env("", loader, TemplateCache(self.tmp.name)), True)
+        usages = [cold.usage("a.yaml.j2"), cold.usage("c.yaml.j2")]
+        self.assertEqual([TemplateUsage(keys=frozenset(["a"]), namespace=False), None], usages)
+
+        warm = RenderCache(make_test_env("", loader, TemplateCache(self.tmp.name)), True)
+        with patch("beku.render.analyse_template") as analyse:
+            self.assertEqual(usages, [warm.usage("a.yaml.j2"), warm.usage("c.yaml.j2")])
+        analyse.assert_not_called()
+
+    def test_changed_source_gets_new_entry(self):
+        cache = TemplateCache(self.tmp.name)
+        make_test_env("", self.loader, cache).get_template("a.yaml.j2")
+        changed = make_test_env("", DictLoader({"a.yaml.j2": "a: changed"}), cache)
+        self.assertEqual("a: changed", changed.get_template("a.yaml.j2").render())
+        self.assertEqual(2, len(os.listdir(self.tmp.name)))
+
+    def test_evict_least_recently_used(self):
+        cache = TemplateCache(self.tmp.name)
+        env = make_test_env("", self.loader, cache)
+        env.get_template("a.yaml.j2")
+        (entry_a,) = os.listdir(self.tmp.name)
+        os.utime(os.path.join(self.tmp.name, entry_a), (0, 0))
+        cache.max_size = os.path.getsize(os.path.join(self.tmp.name, entry_a))
+        env.get_template("b.yaml.j2")
+        self.assertNotIn(entry_a, os.listdir(self.tmp.name))
+        self.assertEqual(1, len(os.listdir(self.tmp.name)))
+
+
+class TestSuiteCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.test_definition = os.path.join(self.tmp.name, "test-definition.yaml")
+        with open(self.test_definition, mode="w", encoding="utf8") as stream:
+            stream.write(
+                "dimensions: [{name: druid, values: ['1', '2']}]\ntests: [{name: smoke, dimensions: [druid]}]\n"
+            )
+        self.cache = SuiteCache(os.path.join(self.tmp.name, "cache"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_cached_suites_are_equal_to_resolved_suites(self):
+        resolved = renderer_from_file(self.test_definition, "default")
+        self.assertEqual(resolved, renderer_from_file(self.test_definition, "default", self.cache))
+        with patch("beku.kuttl.renderer_from_stream") as render:
+            self.assertEqual(resolved, renderer_from_file(self.test_definition, "default", self.cache))
+        render.assert_not_called()
+
+    def test_changed_definition_is_resolved_again(self):
+        renderer_from_file(self.test_definition, "default", self.cache)
+        with open(self.test_definition, mode="a", encoding="utf8") as stream:
+            stream.write("suites: [{name: latest, patch: [{dimensions: [{expr: last}]}]}]\n")
+        (ets,) = renderer_from_file(self.test_definition, "latest", self.cache)
+        self.assertEqual(1, len(ets.test_cases))
+
+
+if __name__ == "__main__":
+    unittest.main()
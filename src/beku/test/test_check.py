@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+
+from beku.check import check, representative_test_cases
+from beku.kuttl import renderer_from_stream
+
+TEST_DEFINITION = """
+dimensions:
+  - name: a
+    values: ["1", "2", "3"]
+tests:
+  - name: smoke
+    dimensions: [a]
+  - name: other
+    dimensions: [a]
+"""
+
+
+class TestCheck(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.template_dir = os.path.join(self.tmp.name, "templates")
+        self.kuttl_tests = os.path.join(self.tmp.name, "kuttl-test.yaml.jinja2")
+        for name in ["smoke", "other", "unused"]:
+            os.makedirs(os.path.join(self.template_dir, name))
+        self._write("smoke/00-install.yaml.j2", "a: {{ test_scenario['values']['a'] }}\nns: {{ NAMESPACE }}\n")
+        self._write("smoke/00-assert.yaml", "static: {{ not a template")
+        self._write("other/00-install.yaml.j2", "a: {{ test_scenario['values']['a'] }}\n")
+        self._write("kuttl-test.yaml.jinja2", "tests: {{ testinput.tests | map(attribute='name') | list }}\n")
+        self.ets = renderer_from_stream(TEST_DEFINITION)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, name, content):
+        file_name = os.path.join(self.template_dir, name) if "/" in name else os.path.join(self.tmp.name, name)
+        with open(file_name, mode="w", encoding="utf8") as stream:
+            stream.write(content)
+
+    def _check(self, jobs=1):
+        return [str(e) for e in check(["default"], self.ets, self.template_dir, self.kuttl_tests, "", jobs)]
+
+    def test_valid_templates(self):
+        self.assertEqual([], self._check())
+
+    def test_representative_test_cases(self):
+        self.assertEqual(
+            {"smoke": "smoke_a-1", "other": "other_a-1"},
+            {name: tc.tid for name, tc in representative_test_cases(self.ets).items()},
+        )
+
+    def test_errors_are_reported_with_file_and_line(self):
+        self._write("smoke/sub.j2", "{% if true %}\n  open\n")
+        self._write(
+            "other/00-install.yaml.j2", "a: {{ test_scenario['values']['a'] }}\nb: {{ test_scenario['values']['b'] }}\n"
+        )
+        self._write("unused/00-install.yaml.j2", "{{ missing }}\n{{ broken(\n")
+        self._write("kuttl-test.yaml.jinja2", "{{ unknown_variable }}\n")
+        for jobs in [1, 3]:
+            with self.subTest(jobs=jobs):
+                errors = self._check(jobs)
+                self.assertEqual(4, len(errors), errors)
+                self.assertTrue(
+                    errors[0].startswith(os.path.join(self.template_dir, "other", "00-install.yaml.j2:2: "))
+                )
+                self.assertIn("'dict object' has no attribute 'b'", errors[0])
+                self.assertTrue(errors[1].startswith(os.path.join(self.template_dir, "smoke", "sub.j2:")))
+                # Templates of test definitions without test cases are only compiled
+                self.assertTrue(
+                    errors[2].startswith(os.path.join(self.template_dir, "unused", "00-install.yaml.j2:2: "))
+                )
+                self.assertTrue(errors[3].startswith(f"{self.kuttl_tests}:1: UndefinedError"))
+
+    def test_missing_test_definition_and_kuttl_template(self):
+        os.rmdir(os.path.join(self.template_dir, "unused"))
+        os.remove(os.path.join(self.template_dir, "other", "00-install.yaml.j2"))
+        os.rmdir(os.path.join(self.template_dir, "other"))
+        os.remove(self.kuttl_tests)
+        self.assertEqual(
+            [
+                f"{os.path.join(self.template_dir, 'other')}: Test definition directory not found",
+                f"{self.kuttl_tests}: Kuttl test config template not found",
+            ],
+            self._check(),
+        )
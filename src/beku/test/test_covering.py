@@ -0,0 +1,62 @@
+import textwrap
+import unittest
+from itertools import combinations, product
+
+from beku.covering import covering_array
+from beku.kuttl import EffectiveTestSuite, renderer_from_stream
+
+
+class TestCoveringArray(unittest.TestCase):
+    def assertCovers(self, sizes, strength, rows):
+        for cols in combinations(range(len(sizes)), min(strength, len(sizes))):
+            expected = set(product(*(range(sizes[c]) for c in cols)))
+            self.assertEqual(expected, {tuple(row[c] for c in cols) for row in rows}, f"Columns {cols}")
+
+    def test_covers_all_combinations(self):
+        for sizes, strength in [([3] * 4, 2), ([2] * 10, 2), ([5, 4, 3, 2, 2], 2), ([4] * 6, 3), ([4, 1, 3, 2], 2)]:
+            with self.subTest(sizes=sizes, strength=strength):
+                rows = covering_array(sizes, strength)
+                self.assertCovers(sizes, strength, rows)
+                self.assertLess(len(rows), len(list(product(*(range(s) for s in sizes)))))
+                self.assertEqual(rows, covering_array(sizes, strength), "Deterministic")
+
+    def test_full_product_if_strength_is_not_smaller(self):
+        self.assertEqual(list(product(range(2), range(3))), covering_array([2, 3], 2))
+        self.assertEqual([], covering_array([2, 0, 3], 2))
+
+    def test_suite_reduce(self):
+        fixture = textwrap.dedent("""
+            ---
+            dimensions:
+              - name: a
+                values: ["1", "2", "3"]
+              - name: b
+                values: ["1", "2", "3"]
+              - name: c
+                values: ["1", "2", "3"]
+              - name: d
+                values: ["1", "2", "3"]
+            tests:
+              - name: smoke
+                dimensions: [a, b, c, d]
+              - name: small
+                dimensions: [a, b]
+            suites:
+              - name: pairwise
+                reduce: pairwise
+              - name: triples
+                n-wise: 3
+            """)
+        pairwise, triples, full = renderer_from_stream(fixture)
+        self.assertEqual(81 + 9, len(full.test_cases))
+        self.assertEqual(len(covering_array([3] * 4, 2)) + 9, len(pairwise.test_cases))
+        self.assertEqual(len(covering_array([3] * 4, 3)) + 9, len(triples.test_cases))
+        rows = [[tc.values[d] for d in "abcd"] for tc in pairwise.test_cases if tc.name == "smoke"]
+        self.assertCovers([3] * 4, 2, [[int(v) - 1 for v in row] for row in rows])
+        self.assertEqual(list(pairwise.test_cases), list(EffectiveTestSuite.from_dict(pairwise.to_dict()).test_cases))
+        self.assertEqual(pairwise.test_cases[-10:], list(pairwise.test_cases)[-10:])
+
+    def test_invalid_reduce(self):
+        for suite in ["reduce: triplewise", "n-wise: 0", "reduce: pairwise\n    n-wise: 2"]:
+            with self.subTest(suite=suite), self.assertRaises(ValueError):
+                renderer_from_stream(f"dimensions: []\ntests: []\nsuites:\n  - name: s\n    {suite}\n")
@@ -0,0 +1,289 @@
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+
+from beku.kuttl import (
+    EffectiveTestSuite,
+    TestDefinitionIndex,
+    TestCase,
+    determine_namespace,
+    expand,
+    expand_suites,
+    make_test_env,
+)
+from beku.sink import STORE_DIR, LINK_MODES, BackgroundSink, DedupeSink, DirectorySink, MemorySink, TarSink
+from beku.timings import Timings
+
+
+class TestExpand(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.template_dir = os.path.join(self.tmp.name, "templates")
+        self.output_dir = os.path.join(self.tmp.name, "out")
+        os.makedirs(os.path.join(self.template_dir, "smoke", "sub"))
+        self._write("smoke/00-install.yaml.j2", "version: {{ test_scenario['values']['druid'] }}\nns: {{ NAMESPACE }}")
+        self._write("smoke/sub/01-nested.yaml.j2", "nested: {{ test_scenario['values']['druid'] }}")
+        self._write("smoke/00-assert.yaml", "static: true\n")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, name, content):
+        with open(os.path.join(self.template_dir, name), mode="w", encoding="utf8") as stream:
+            stream.write(content)
+
+    def _tree(self, root):
+        result = {}
+        for dir_path, _, files in os.walk(root):
+            for file_name in files:
+                file_path = os.path.join(dir_path, file_name)
+                with open(file_path, mode="rb") as stream:
+                    result[os.path.relpath(file_path, root)] = (stream.read(), os.stat(file_path).st_mode)
+        return result
+
+    def _expand(self, test_cases, output_dir, jobs, incremental=False, timings=None, sink=None):
+        kuttl_tests = os.path.join(self.tmp.name, "kuttl-test.yaml.jinja2")
+        with open(kuttl_tests, mode="w", encoding="utf8") as stream:
+            stream.write("tests: {{ testinput.tests | map(attribute='name') | list }}")
+        ets = [EffectiveTestSuite(name="default", test_cases=test_cases)]
+        return expand(
+            "default",
+            ets,
+            self.template_dir,
+            os.path.join(output_dir, "tests"),
+            kuttl_tests,
+            "",
+            jobs=jobs,
+            incremental=incremental,
+            timings=timings,
+            sink=sink,
+        )
+
+    def _read(self, *names):
+        with open(os.path.join(self.output_dir, *names), encoding="utf8") as stream:
+            return stream.read()
+
+    def test_shared_env_renders_namespace_per_test_case(self):
+        env = make_test_env(os.path.join(self.template_dir, "smoke"))
+        test_cases = [TestCase(name="smoke", values={"druid": v}) for v in ["24.0.0", "26.0.0"]]
+        for tc in test_cases:
+            tc.expand(self.template_dir, self.output_dir, "", env)
+
+        for tc in test_cases:
+            self.assertEqual(
+                f"version: {tc.values['druid']}\nns: {determine_namespace(tc.tid, '')}\n",
+                self._read("smoke", tc.tid, "00-install.yaml"),
+            )
+            self.assertEqual(f"nested: {tc.values['druid']}\n", self._read("smoke", tc.tid, "sub", "01-nested.yaml"))
+            self.assertEqual("static: true\n", self._read("smoke", tc.tid, "00-assert.yaml"))
+
+    def test_shared_env_compiles_templates_once(self):
+        env = make_test_env(os.path.join(self.template_dir, "smoke"))
+        self.assertIs(env.get_template("00-install.yaml.j2"), env.get_template("00-install.yaml.j2"))
+
+    def test_parallel_expansion_is_identical_to_serial(self):
+        test_cases = [TestCase(name="smoke", values={"druid": str(v)}) for v in range(8)]
+        serial = os.path.join(self.tmp.name, "serial")
+        parallel = os.path.join(self.tmp.name, "parallel")
+        self._expand(test_cases, serial, 1)
+        self._expand(test_cases, parallel, 4)
+        self.assertEqual(self._tree(serial), self._tree(parallel))
+
+    def test_timings_cover_phases_test_cases_and_templates(self):
+        test_cases = [TestCase(name="smoke", values={"druid": str(v)}) for v in range(4)]
+        for jobs in [1, 2]:
+            with self.subTest(jobs=jobs):
+                timings = Timings()
+                self._expand(test_cases, os.path.join(self.tmp.name, f"out-{jobs}"), jobs, timings=timings)
+                report = timings.report(top=2)
+                self.assertTrue({"sanity_checks", "kuttl_test", "test_cases"}.issubset(report["phases"]))
+                self.assertNotIn("manifest", report["phases"], "Inputs are only hashed in incremental mode.")
+                self.assertEqual(4, report["totals"]["test_cases"])
+                self.assertEqual(8, report["totals"]["renders"])
+                self.assertEqual(2, len(report["slowest_test_cases"]))
+                install = os.path.join(self.template_dir, "smoke", "00-install.yaml.j2")
+                self.assertEqual(4, timings.templates[install]["renders"])
+                self.assertEqual(
+                    os.path.getsize(
+                        os.path.join(self.tmp.name, f"out-{jobs}", "tests", "smoke", "smoke_druid-0", "00-install.yaml")
+                    ),
+                    timings.templates[install]["bytes"] / 4,
+                )
+
+    def test_background_writers_are_identical_to_serial(self):
+        test_cases = [TestCase(name="smoke", values={"druid": str(v)}) for v in range(8)]
+        serial = os.path.join(self.tmp.name, "serial")
+        self._expand(test_cases, serial, 1)
+        for jobs in [1, 2]:
+            with self.subTest(jobs=jobs):
+                output_dir = os.path.join(self.tmp.name, f"background-{jobs}")
+                with BackgroundSink(DirectorySink(output_dir), writers=2, queue_depth=2) as sink:
+                    self._expand(test_cases, output_dir, jobs, sink=sink)
+                self.assertEqual(self._tree(serial), self._tree(output_dir))
+
+    def test_background_writers_overlap_test_cases(self):
+        flushes = []
+
+        class CountingSink(BackgroundSink):
+            def flush(self):
+                flushes.append(len(self._threads))
+                super().flush()
+
+        test_cases = [TestCase(name="smoke", values={"druid": str(v)}) for v in range(8)]
+        with CountingSink(DirectorySink(self.output_dir), writers=2) as sink:
+            self._expand(test_cases, self.output_dir, 1, sink=sink)
+        # After the kuttl test suite, after the only chunk of test cases and when the sink is closed
+        self.assertEqual([2, 2, 0], flushes)
+
+    def test_dedupe_is_identical_to_serial(self):
+        test_cases = [TestCase(name="smoke", values={"druid": str(v % 2), "run": str(v)}) for v in range(8)]
+        serial = os.path.join(self.tmp.name, "serial")
+        self._expand(test_cases, serial, 1)
+        for jobs in [1, 2]:
+            with self.subTest(jobs=jobs):
+                output_dir = os.path.join(self.tmp.name, f"dedupe-{jobs}")
+                with DedupeSink(output_dir) as sink:
+                    self._expand(test_cases, output_dir, jobs, sink=sink)
+                self.assertEqual(
+                    self._tree(os.path.join(serial, "tests")), self._tree(os.path.join(output_dir, "tests"))
+                )
+                # The install files differ by namespace, the nested files by druid version and the static file is shared
+                self.assertEqual(8 + 2 + 1, len(os.listdir(os.path.join(output_dir, STORE_DIR))))
+                self.assertEqual(2 * 3 + 7 - 1, sink.saved_inodes)
+
+    def test_failing_test_cases_are_collected(self):
+        self._write("smoke/02-fail.yaml.j2", "{{ 1 / test_scenario['values']['druid'] | int }}")
+        test_cases = [TestCase(name="smoke", values={"druid": v}) for v in ["0", "1", "0"]]
+        for jobs in [1, 2]:
+            with self.subTest(jobs=jobs), self.assertLogs(level="ERROR") as logs:
+                with self.assertRaisesRegex(ValueError, "Failed to expand 2 test case"):
+                    self._expand(test_cases, os.path.join(self.tmp.name, f"out-{jobs}"), jobs)
+                self.assertEqual(2, len(logs.records))
+                self.assertIn("ZeroDivisionError", logs.output[0])
+                self.assertTrue(
+                    os.path.isfile(
+                        os.path.join(self.tmp.name, f"out-{jobs}", "tests", "smoke", "smoke_druid-1", "02-fail.yaml")
+                    )
+                )
+
+    def test_incremental_expansion_only_rewrites_changed_test_cases(self):
+        os.makedirs(os.path.join(self.template_dir, "other"))
+        self._write("other/00-install.yaml.j2", "other: {{ test_scenario['values']['druid'] }}")
+        test_cases = [TestCase(name=name, values={"druid": v}) for name in ["smoke", "other"] for v in ["1", "2"]]
+        self._expand(test_cases, self.output_dir, 1, incremental=True)
+
+        self._write("smoke/00-assert.yaml", "static: false\n")
+        with self.assertLogs(level="INFO") as logs:
+            self._expand(test_cases[:3], self.output_dir, 1, incremental=True)
+        expanded = [r.args[0] for r in logs.records if r.msg.startswith("Expanding test case")]
+        self.assertEqual(["smoke_druid-1", "smoke_druid-2"], expanded)
+
+        fresh = os.path.join(self.tmp.name, "fresh")
+        self._expand(test_cases[:3], fresh, 1)
+        incremental = self._tree(self.output_dir)
+        del incremental[".beku-manifest.json"]
+        self.assertEqual(self._tree(fresh), incremental, "Only incremental expansions write a manifest.")
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, "tests", "other", "other_druid-2")))
+
+    def test_link_modes(self):
+        source = os.path.join(self.template_dir, "smoke", "00-assert.yaml")
+        os.chmod(source, 0o750)
+        tc = TestCase(name="smoke", values={"druid": "1"})
+        for link_mode in LINK_MODES:
+            with self.subTest(link_mode=link_mode):
+                output_dir = os.path.join(self.tmp.name, link_mode)
+                tc.expand(self.template_dir, output_dir, "", link_mode=link_mode)
+                dest = os.path.join(output_dir, "smoke", tc.tid, "00-assert.yaml")
+                with open(dest, encoding="utf8") as stream:
+                    self.assertEqual("static: true\n", stream.read())
+                self.assertEqual(0o750, os.stat(dest).st_mode & 0o777)
+                self.assertEqual(link_mode == "symlink", os.path.islink(dest))
+                self.assertEqual(link_mode in ["hardlink", "symlink"], os.path.samefile(source, dest))
+                self.assertFalse(os.path.islink(os.path.join(output_dir, "smoke", tc.tid, "00-install.yaml")))
+
+    def test_expand_suites_shares_test_cases(self):
+        kuttl_tests = os.path.join(self.tmp.name, "kuttl-test.yaml.jinja2")
+        with open(kuttl_tests, mode="w", encoding="utf8") as stream:
+            stream.write("tests: {{ testinput.tests | map(attribute='name') | list }}")
+        ets = [
+            EffectiveTestSuite(name="all", test_cases=[TestCase(name="smoke", values={"druid": v}) for v in "123"]),
+            EffectiveTestSuite(name="last", test_cases=[TestCase(name="smoke", values={"druid": "3"})]),
+        ]
+        for jobs in [1, 2]:
+            with self.subTest(jobs=jobs):
+                output_dir = os.path.join(self.tmp.name, f"suites-{jobs}")
+                output_dirs = {suite.name: os.path.join(output_dir, suite.name, "tests") for suite in ets}
+                with self.assertLogs(level="INFO") as logs:
+                    expand_suites(output_dirs, ets, self.template_dir, kuttl_tests, "", jobs=jobs)
+                if jobs == 1:
+                    # Worker processes don't log to this process
+                    expanded = [r.args[0] for r in logs.records if r.msg.startswith("Expanding test case")]
+                    self.assertEqual(["smoke_druid-1", "smoke_druid-2", "smoke_druid-3"], expanded)
+                self.assertIn("Copying test case [smoke_druid-3]", "\n".join(logs.output))
+                for suite in ets:
+                    separate = os.path.join(self.tmp.name, f"separate-{suite.name}")
+                    expand(suite.name, ets, self.template_dir, os.path.join(separate, "tests"), kuttl_tests, "")
+                    self.assertEqual(self._tree(separate), self._tree(os.path.join(output_dir, suite.name)))
+
+    def test_expand_to_memory(self):
+        os.chmod(os.path.join(self.template_dir, "smoke", "00-assert.yaml"), 0o750)
+        test_cases = [TestCase(name="smoke", values={"druid": str(v)}) for v in range(4)]
+        for jobs in [1, 2]:
+            with self.subTest(jobs=jobs):
+                sink = MemorySink(self.output_dir)
+                self._expand(test_cases, self.output_dir, jobs, sink=sink)
+                self.assertFalse(os.path.exists(self.output_dir))
+                self.assertEqual(b"tests: ['smoke']\n", sink.files["kuttl-test.yaml"])
+                self.assertEqual(b"nested: 3\n", sink.files["tests/smoke/smoke_druid-3/sub/01-nested.yaml"])
+                self.assertEqual(0o750, sink.modes["tests/smoke/smoke_druid-0/00-assert.yaml"])
+                self.assertEqual(
+                    ["tests", "tests/smoke", "tests/smoke/smoke_druid-0", "tests/smoke/smoke_druid-0/sub"],
+                    sink.dirs[:4],
+                )
+                self.assertEqual(1 + 3 * 4, len(sink.files))
+
+    def test_parallel_tar_is_identical_to_serial(self):
+        # Enough test cases for chunks of several test cases, whose size depends on the number of workers
+        test_cases = [TestCase(name="smoke", values={"druid": str(v)}) for v in range(32)]
+        archives = []
+        for jobs in [1, 2, 4]:
+            stream = io.BytesIO()
+            with TarSink(stream, self.output_dir) as sink:
+                self._expand(test_cases, self.output_dir, jobs, sink=sink)
+            archives.append(stream.getvalue())
+        self.assertEqual(archives[0], archives[1])
+        self.assertEqual(archives[0], archives[2])
+        serial = os.path.join(self.tmp.name, "serial")
+        self._expand(test_cases, serial, 1)
+        with tarfile.open(fileobj=io.BytesIO(archives[0])) as tar:
+            tar.extractall(self.output_dir, filter="tar")
+        self.assertEqual(self._tree(serial), self._tree(self.output_dir))
+
+    def test_archives_are_not_incremental(self):
+        test_cases = [TestCase(name="smoke", values={"druid": "1"})]
+        with self.assertRaisesRegex(ValueError, "incrementally"):
+            self._expand(test_cases, self.output_dir, 1, incremental=True, sink=MemorySink(self.output_dir))
+
+    def test_index_lists_directories_and_files(self):
+        index = TestDefinitionIndex.scan(os.path.join(self.template_dir, "smoke"))
+        self.assertEqual(("sub",), index.dirs)
+        self.assertEqual(
+            {("", "00-install.yaml.j2", "00-install.yaml.j2"), ("sub", "01-nested.yaml.j2", "sub/01-nested.yaml.j2")},
+            {(e.rel_dir, e.file_name, e.template_name) for e in index.entries if e.template_name},
+        )
+        self.assertEqual(["00-assert.yaml"], [e.file_name for e in index.entries if not e.template_name])
+
+    def test_index_limits_depth_not_width(self):
+        for i in range(10):
+            os.makedirs(os.path.join(self.template_dir, "smoke", f"wide-{i}"))
+        self.assertEqual(11, len(TestDefinitionIndex.scan(os.path.join(self.template_dir, "smoke")).dirs))
+
+        os.makedirs(os.path.join(self.template_dir, "smoke", *["deep"] * 7))
+        with self.assertRaisesRegex(ValueError, "Maximum recursive level"):
+            TestDefinitionIndex.scan(os.path.join(self.template_dir, "smoke"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+
+from beku.kuttl import determine_namespace, renderer_from_stream
+from beku.plan import format_plan, plan
+from beku.shard import Shard
+
+TEST_DEFINITION = """
+dimensions:
+  - name: a
+    values: ["1", "2", "3"]
+  - name: b
+    values: ["x", "y"]
+tests:
+  - name: smoke
+    dimensions: [a, b]
+  - name: other
+    dimensions: [a]
+"""
+
+
+class TestPlan(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.template_dir = os.path.join(self.tmp.name, "templates")
+        self.kuttl_tests = os.path.join(self.tmp.name, "kuttl-test.yaml.jinja2")
+        self.output_dir = os.path.join(self.tmp.name, "out")
+        for name in ["smoke", "other"]:
+            os.makedirs(os.path.join(self.template_dir, name))
+        self._write("smoke/00-install.yaml.j2", "a: {{ test_scenario['values']['a'] }}\n")
+        self._write("smoke/00-assert.yaml", "0123456789")
+        self._write("other/00-assert.yaml", "01234")
+        with open(self.kuttl_tests, mode="w", encoding="utf8") as stream:
+            stream.write("")
+        self.ets = renderer_from_stream(TEST_DEFINITION)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, name, content):
+        with open(os.path.join(self.template_dir, name), mode="w", encoding="utf8") as stream:
+            stream.write(content)
+
+    def test_plan(self):
+        result = plan("default", self.ets, self.template_dir, self.kuttl_tests, "")
+        self.assertEqual(9, result["test_cases"])
+        self.assertEqual(6, result["rendered_files"])
+        self.assertEqual(9, result["copied_files"])
+        smoke, other = result["tests"]
+        self.assertEqual(
+            {"name": "smoke", "test_cases": 6, "rendered_files": 6, "copied_files": 6, "estimated_bytes": 6 * 48},
+            {k: v for k, v in smoke.items() if k != "test_case_ids"},
+        )
+        self.assertEqual(
+            {"tid": "other_a-1", "namespace": determine_namespace("other_a-1", "")}, other["test_case_ids"][0]
+        )
+        self.assertFalse(os.path.exists(self.output_dir))
+        text = format_plan(result)
+        self.assertIn("Test suite [default]: 9 test cases, 6 rendered files, 9 copied files", text)
+        self.assertIn("    smoke_a-3_b-y kuttl-", text)
+
+    def test_stats_with_shard(self):
+        result = plan(
+            "default", self.ets, self.template_dir, self.kuttl_tests, "ns", Shard(1, 2), with_test_cases=False
+        )
+        self.assertEqual(5, result["test_cases"])
+        self.assertNotIn("test_case_ids", result["tests"][0])
+        self.assertIn("ns", format_plan(plan("default", self.ets, self.template_dir, self.kuttl_tests, "ns")))
+
+    def test_unknown_test_definition(self):
+        os.rename(os.path.join(self.template_dir, "other"), os.path.join(self.template_dir, "renamed"))
+        with self.assertRaisesRegex(ValueError, "Test definition directory not found"):
+            plan("default", self.ets, self.template_dir, self.kuttl_tests, "")
@@ -0,0 +1,51 @@
+import unittest
+
+from jinja2 import DictLoader
+
+from beku.kuttl import make_test_env
+from beku.render import RenderCache, TemplateUsage, analyse_template
+
+
+class TestAnalyseTemplate(unittest.TestCase):
+    def _usage(self, source):
+        return analyse_template(make_test_env("", DictLoader({"t.j2": source})), "t.j2")
+
+    def test_referenced_values(self):
+        self.assertEqual(
+            TemplateUsage(keys=frozenset(["druid", "zookeeper"]), namespace=False),
+            self._usage("{{ test_scenario['values']['druid'] }}{% if test_scenario['values'].zookeeper %}x{% endif %}"),
+        )
+        self.assertEqual(TemplateUsage(keys=frozenset(), namespace=True), self._usage("ns: {{ NAMESPACE }}"))
+        self.assertEqual(TemplateUsage(keys=frozenset(), namespace=False), self._usage("{{ lookup('env', 'X') }}"))
+
+    def test_unknown_usage(self):
+        for source in [
+            "{% for k, v in test_scenario['values'].items() %}{{ v }}{% endfor %}",
+            "{{ test_scenario['values'][name] }}",
+            "{{ test_scenario }}",
+            "{% set NAMESPACE = 'x' %}{{ NAMESPACE }}",
+            "{% include 'other.j2' %}",
+        ]:
+            with self.subTest(source=source):
+                self.assertIsNone(self._usage(source))
+
+
+class TestRenderCache(unittest.TestCase):
+    def test_render_once_per_used_values(self):
+        env = make_test_env("", DictLoader({"t.j2": "druid: {{ test_scenario['values']['druid'] }}"}))
+        cache = RenderCache(env, shared_namespace=False)
+        for druid in ["1", "2"]:
+            for zk in ["a", "b", "c"]:
+                self.assertEqual(f"druid: {druid}", cache.render("t.j2", {"druid": druid, "zk": zk}, "ns-" + zk))
+        self.assertEqual(4, cache.hits)
+
+    def test_no_cache_for_unique_output(self):
+        env = make_test_env("", DictLoader({"t.j2": "{{ NAMESPACE }}"}))
+        cache = RenderCache(env, shared_namespace=False)
+        self.assertEqual("a", cache.render("t.j2", {"druid": "1"}, "a"))
+        self.assertEqual("b", cache.render("t.j2", {"druid": "1"}, "b"))
+        self.assertEqual(0, cache.hits)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,21 @@
+import pickle
+import random
 import textwrap
 import unittest
+from dataclasses import FrozenInstanceError
+from unittest.mock import patch
 
-from beku.kuttl import renderer_from_stream, EffectiveTestSuite, TestCase
+from beku.kuttl import (
+    renderer_from_stream,
+    EffectiveTestSuite,
+    TestCase,
+    TestCaseFilter,
+    TestDimension,
+    TestMatrix,
+    TestSuite,
+    determine_namespace,
+    _resolve_effective_test_suites,
+)
 
 
 class TestRenderFromStream(unittest.TestCase):
@@ -310,6 +324,226 @@ class TestRenderFromStream(unittest.TestCase):
 
         self.assertEqual(expected, ets[0])
 
+    def test_test_cases_are_lazy_and_indexable(self):
+        fixture = textwrap.dedent("""
+            ---
+            dimensions:
+              - name: a
+                values: ["1", "2", "3"]
+              - name: b
+                values: ["x", "y"]
+              - name: c
+                values: ["p", "q", "r", "s"]
+            tests:
+              - name: smoke
+                dimensions: [a, b, c]
+              - name: other
+                dimensions: [b]
+            """)
+        test_cases = renderer_from_stream(fixture)[0].test_cases
+        materialized = list(test_cases)
+        self.assertEqual(26, len(test_cases))
+        self.assertEqual(materialized, list(test_cases), "Test cases can be iterated again.")
+        self.assertEqual(materialized, [test_cases[i] for i in range(-len(test_cases), 0)])
+        self.assertEqual(materialized[20:25], test_cases[20:25])
+        self.assertEqual(TestCase(name="smoke", values={"a": "1", "b": "y", "c": "q"}), test_cases[5])
+        with self.assertRaises(IndexError):
+            test_cases[26]
+
+    def test_compact_test_cases(self):
+        matrix = TestMatrix("smoke", [TestDimension("a", ["1", "x/y"]), TestDimension("b", ["p:q", "r"])])
+        for i, tc in enumerate(matrix):
+            plain = TestCase(name="smoke", values=dict(tc.values))
+            self.assertEqual(plain, tc)
+            self.assertEqual(plain.tid, tc.tid)
+            self.assertEqual(hash(plain), hash(tc))
+            self.assertEqual(tc, matrix[i])
+            self.assertEqual(determine_namespace(tc.tid, ""), tc.namespace(""))
+            self.assertEqual("ns", tc.namespace("ns"))
+            self.assertIs(matrix.dimension_names, tc.dimension_names)
+        self.assertEqual("smoke_a-x_y_b-p_q", matrix[2].tid)
+
+        tc = TestCase(name="smoke", values={"a": "1", "b": "2"})
+        self.assertEqual(TestCase(name="smoke", values={"b": "2", "a": "1"}), tc, "The order of values is ignored.")
+        self.assertNotEqual(TestCase(name="other", values={"a": "1", "b": "2"}), tc)
+        self.assertNotEqual(TestCase(name="smoke", values={"a": "1"}), tc)
+        self.assertEqual(tc, pickle.loads(pickle.dumps(tc)))
+        self.assertEqual("TestCase(name='smoke', values={'a': '1', 'b': '2'})", repr(tc))
+        with self.assertRaises(FrozenInstanceError):
+            tc.name = "other"
+        tc.values["a"] = "changed"
+        self.assertEqual("1", tc.values["a"], "Values can't be changed.")
+
+    def test_numbers_and_booleans_as_values(self):
+        fixture = textwrap.dedent("""
+            ---
+            dimensions:
+              - name: replicas
+                values: [30, 2.5]
+              - name: openshift
+                values:
+                  - false
+            tests:
+              - name: smoke
+                dimensions: [replicas, openshift]
+            suites:
+              - name: three
+                patch:
+                  - dimensions:
+                      - name: replicas
+                        expr: 3
+            """)
+        three, default = renderer_from_stream(fixture)
+        self.assertEqual(
+            [
+                TestCase(name="smoke", values={"replicas": 30, "openshift": False}),
+                TestCase(name="smoke", values={"replicas": 2.5, "openshift": False}),
+            ],
+            default.test_cases,
+        )
+        self.assertEqual(
+            ["smoke_replicas-30_openshift-False", "smoke_replicas-2.5_openshift-False"],
+            [tc.tid for tc in default.test_cases],
+        )
+        self.assertEqual([TestCase(name="smoke", values={"replicas": 3, "openshift": False})], three.test_cases)
+
+    def test_filter_numbers_and_booleans(self):
+        fixture = textwrap.dedent("""
+            ---
+            dimensions:
+              - name: replicas
+                values: [30, 2.5]
+              - name: openshift
+                values: [false, true]
+            tests:
+              - name: smoke
+                dimensions: [replicas, openshift]
+            """)
+        test_filter = TestCaseFilter.from_criteria(where=[("replicas", "30"), ("openshift", "False")])
+        self.assertEqual(
+            [TestCase(name="smoke", values={"replicas": 30, "openshift": False})],
+            renderer_from_stream(fixture, "default", test_filter=test_filter)[0].test_cases,
+        )
+
+    def test_resolve_single_suite(self):
+        fixture = textwrap.dedent("""
+            ---
+            dimensions:
+              - name: druid
+                values:
+                  - 24.0.0-stackable0.0.0-dev
+                  - 26.0.0-stackable0.0.0-dev
+            tests:
+              - name: smoke
+                dimensions:
+                  - druid
+            suites:
+              - name: latest
+                patch:
+                  - dimensions:
+                      - expr: last
+              - name: broken
+                patch:
+                  - dimensions:
+                      - name: druid
+                        expr: first
+            """)
+        with patch("beku.kuttl._resolve_effective_test_suites", wraps=_resolve_effective_test_suites) as resolve:
+            ets = renderer_from_stream(fixture, "latest")
+        self.assertEqual(["latest"], [s.name for s in resolve.call_args.args[2]], "Only one suite is resolved.")
+        expected = EffectiveTestSuite(
+            name="latest", test_cases=[TestCase(name="smoke", values={"druid": "26.0.0-stackable0.0.0-dev"})]
+        )
+        self.assertEqual([expected], ets)
+        with self.assertRaisesRegex(ValueError, r"Cannot expand test suite \[nightly\]"):
+            renderer_from_stream(fixture, "nightly")
+
+    def test_filter_test_cases(self):
+        fixture = textwrap.dedent("""
+            ---
+            dimensions:
+              - name: druid
+                values:
+                  - 24.0.0
+                  - 26.0.0
+              - name: openshift
+                values:
+                  - "false"
+                  - "true"
+              - name: path
+                values:
+                  - a/b
+            tests:
+              - name: smoke
+                dimensions:
+                  - druid
+                  - openshift
+              - name: ldap
+                dimensions:
+                  - druid
+                  - path
+            """)
+
+        def tids(test_filter):
+            return [tc.tid for tc in renderer_from_stream(fixture, "default", test_filter=test_filter)[0].test_cases]
+
+        self.assertEqual(
+            ["smoke_druid-24.0.0_openshift-false", "smoke_druid-24.0.0_openshift-true"],
+            tids(TestCaseFilter.from_criteria(tests=["smoke"], where=[("druid", "24.0.0")])),
+        )
+        self.assertEqual(
+            ["smoke_druid-24.0.0_openshift-true", "smoke_druid-26.0.0_openshift-true"],
+            tids(TestCaseFilter.from_criteria(where=[("openshift", "true")])),
+            "Tests without the dimension are not selected.",
+        )
+        self.assertEqual(
+            ["smoke_druid-26.0.0_openshift-false", "ldap_druid-24.0.0_path-a_b"],
+            tids(
+                TestCaseFilter.from_criteria(tids=["ldap_druid-24.0.0_path-a_b", "smoke_druid-26.0.0_openshift-false"])
+            ),
+        )
+        with self.assertLogs(level="WARNING") as logs:
+            self.assertEqual(
+                [], tids(TestCaseFilter.from_criteria(tests=["smoke"], tids=["ldap_druid-24.0.0_path-a_b"]))
+            )
+        self.assertIn("does not select any test case", logs.output[0])
+
+    def test_filter_prunes_the_product(self):
+        dimensions = "\n".join(
+            f"  - name: d{i}\n    values: [{', '.join(str(v) for v in range(10))}]" for i in range(8)
+        )
+        fixture = f"dimensions:\n{dimensions}\ntests:\n  - name: big\n    dimensions: [{', '.join(f'd{i}' for i in range(8))}]\n"
+        tid = "big_d0-1_d1-2_d2-3_d3-4_d4-5_d5-6_d6-7_d7-8"
+        ets = renderer_from_stream(fixture, "default", test_filter=TestCaseFilter.from_criteria(tids=[tid]))[0]
+        self.assertEqual([tid], [tc.tid for tc in ets.test_cases])
+        self.assertEqual(1, len(ets.to_dict()["matrices"]))
+
+    def test_compiled_patches_apply_in_order(self):
+        dims = [TestDimension(name=n, values=["1", "2", "3"]) for n in ("a", "b", "c")]
+        exprs = [None, "", "first", "last", "9"]
+        rnd = random.Random(23)
+        for _ in range(500):
+            suite = TestSuite.from_dict(
+                {
+                    "name": "random",
+                    "patch": [
+                        {
+                            "test": rnd.choice([None, "t1", "t2"]),
+                            "dimensions": [
+                                {"name": rnd.choice([None, "a", "b", "x"]), "expr": rnd.choice(exprs)}
+                                for _ in range(rnd.randint(0, 3))
+                            ],
+                        }
+                        for _ in range(rnd.randint(0, 4))
+                    ],
+                }
+            )
+            for test_name in ("t1", "t2", "t3"):
+                expected = dims
+                for p in suite.patches:
+                    expected = p.patch_dimensions(test_name, expected)
+                self.assertEqual(expected, suite.patch_dimensions(test_name, dims), suite)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,101 @@
+import json
+import os
+import tempfile
+import unittest
+
+from beku.kuttl import EffectiveTestSuite, TestCase, expand
+from beku.shard import Shard, assign, load_costs
+
+JUNIT_REPORT = """<?xml version="1.0" encoding="UTF-8"?>
+<testsuites name="" tests="3" failures="0" time="70">
+  <testsuite tests="3" failures="0" time="70" name="tests">
+    <testcase classname="smoke" name="smoke_a-1" time="50"></testcase>
+    <testcase classname="smoke" name="tests/smoke_a-2" time="15"></testcase>
+    <testcase classname="smoke" name="smoke_a-2" time="5"></testcase>
+  </testsuite>
+</testsuites>
+"""
+
+
+class TestShard(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_parse(self):
+        self.assertEqual(Shard(index=2, count=4), Shard.parse("2/4"))
+        for value in ["2", "0/4", "5/4", "a/4", "1/0"]:
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                Shard.parse(value)
+
+    def test_shards_partition_the_test_cases(self):
+        tids = [f"tc-{i}" for i in range(11)]
+        shards = assign(tids, 3)
+        self.assertEqual(sorted(tids), sorted(tid for shard in shards for tid in shard))
+        self.assertEqual([4, 4, 3], [len(shard) for shard in shards])
+        self.assertEqual(shards, assign(list(reversed(tids)), 3))
+
+    def test_shards_are_balanced_by_cost(self):
+        costs = {"slow": 10.0, "a": 4.0, "b": 3.0, "c": 3.0}
+        shards = assign(["a", "b", "c", "slow"], 2, costs)
+        self.assertEqual([["slow"], ["a", "b", "c"]], shards)
+        # Unknown test cases cost the median of the known costs
+        shards = assign(["a", "b", "c", "slow", "new"], 2, costs)
+        self.assertEqual([["slow", "c"], ["a", "new", "b"]], shards)
+
+    def test_load_costs(self):
+        junit = os.path.join(self.tmp.name, "report.xml")
+        with open(junit, mode="w", encoding="utf8") as stream:
+            stream.write(JUNIT_REPORT)
+        self.assertEqual({"smoke_a-1": 50.0, "smoke_a-2": 20.0}, load_costs(junit))
+        costs = os.path.join(self.tmp.name, "costs.json")
+        with open(costs, mode="w", encoding="utf8") as stream:
+            json.dump({"smoke_a-1": 1}, stream)
+        self.assertEqual({"smoke_a-1": 1.0}, load_costs(costs))
+
+    def test_expand_shard(self):
+        template_dir = os.path.join(self.tmp.name, "templates")
+        for name in ["smoke", "other"]:
+            os.makedirs(os.path.join(template_dir, name))
+            with open(os.path.join(template_dir, name, "00-install.yaml.j2"), mode="w", encoding="utf8") as stream:
+                stream.write("a: {{ test_scenario['values']['a'] }}")
+        kuttl_tests = os.path.join(self.tmp.name, "kuttl-test.yaml.jinja2")
+        with open(kuttl_tests, mode="w", encoding="utf8") as stream:
+            stream.write("tests: {{ testinput.tests | map(attribute='name') | sort | list }}")
+        test_cases = [TestCase(name="smoke", values={"a": str(v)}) for v in range(3)]
+        test_cases.append(TestCase(name="other", values={"a": "0"}))
+        ets = [EffectiveTestSuite(name="default", test_cases=test_cases)]
+        costs = {"other_a-0": 10.0, "smoke_a-0": 3.0, "smoke_a-1": 3.0, "smoke_a-2": 3.0}
+        expanded = []
+        for index in [1, 2]:
+            output_dir = os.path.join(self.tmp.name, f"out-{index}")
+            expand(
+                "default",
+                ets,
+                template_dir,
+                os.path.join(output_dir, "tests"),
+                kuttl_tests,
+                "",
+                shard=Shard(index=index, count=2),
+                costs=costs,
+            )
+            with open(os.path.join(output_dir, "kuttl-test.yaml"), encoding="utf8") as stream:
+                expanded.append(
+                    (
+                        stream.read(),
+                        sorted(
+                            tid
+                            for name in os.listdir(os.path.join(output_dir, "tests"))
+                            for tid in os.listdir(os.path.join(output_dir, "tests", name))
+                        ),
+                    )
+                )
+        self.assertEqual(
+            [
+                ("tests: ['other']\n", ["other_a-0"]),
+                ("tests: ['smoke']\n", ["smoke_a-0", "smoke_a-1", "smoke_a-2"]),
+            ],
+            expanded,
+        )
@@ -0,0 +1,185 @@
+import io
+import os
+import stat
+import tarfile
+import tempfile
+import threading
+import unittest
+import zipfile
+
+from beku.sink import (
+    STORE_DIR,
+    BackgroundSink,
+    DedupeSink,
+    DirectorySink,
+    MemorySink,
+    TarSink,
+    ZipSink,
+    open_sink,
+    output_format,
+)
+
+
+class TestSink(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, "script.sh")
+        with open(self.source, mode="w", encoding="utf8") as stream:
+            stream.write("#!/bin/sh\n")
+        os.chmod(self.source, 0o755)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _fill(self, sink):
+        sink.mkdir("out/tests/a/b")
+        sink.write("out/tests/a/b/00-install.yaml", ["key: ", "value"])
+        sink.copy(self.source, "out/tests/a/script.sh")
+        sink.write("out/kuttl-test.yaml", ["tests: []"], 0o600)
+
+    def test_output_format(self):
+        self.assertEqual("tar", output_format("-"))
+        self.assertEqual("tar", output_format("suite.tar"))
+        self.assertEqual("tar.gz", output_format("suite.tgz"))
+        self.assertEqual("zip", output_format("suite.zip"))
+        self.assertEqual("dir", output_format("tests/_work"))
+        self.assertEqual("zip", output_format("tests/_work", "zip"))
+        with self.assertRaisesRegex(ValueError, "standard output"):
+            open_sink("-", "zip")
+
+    def test_memory_sink_replays_into_directory(self):
+        memory = MemorySink("out")
+        self._fill(memory)
+        self.assertEqual(["tests", "tests/a", "tests/a/b"], memory.dirs)
+        self.assertEqual(b"key: value\n", memory.files["tests/a/b/00-install.yaml"])
+        self.assertEqual(0o755, memory.modes["tests/a/script.sh"])
+        self.assertEqual(0o600, memory.modes["kuttl-test.yaml"])
+
+        root = os.path.join(self.tmp.name, "out")
+        directory = DirectorySink(root)
+        memory.replay(directory)
+        self.assertEqual(memory.bytes_written, directory.bytes_written)
+        self.assertEqual(0o755, stat.S_IMODE(os.stat(os.path.join(root, "tests", "a", "script.sh")).st_mode))
+        with open(os.path.join(root, "tests", "a", "b", "00-install.yaml"), encoding="utf8") as stream:
+            self.assertEqual("key: value\n", stream.read())
+
+    def test_tar_is_reproducible_and_keeps_modes(self):
+        archives = []
+        for compress in [False, False, True, True]:
+            stream = io.BytesIO()
+            with TarSink(stream, "out", compress=compress) as sink:
+                self._fill(sink)
+            archives.append(stream.getvalue())
+        self.assertEqual(archives[0], archives[1])
+        self.assertEqual(archives[2], archives[3])
+        with tarfile.open(fileobj=io.BytesIO(archives[2])) as tar:
+            members = {m.name: m for m in tar.getmembers()}
+        self.assertEqual(
+            ["tests", "tests/a", "tests/a/b", "tests/a/b/00-install.yaml", "tests/a/script.sh", "kuttl-test.yaml"],
+            list(members),
+        )
+        self.assertTrue(members["tests/a"].isdir())
+        self.assertEqual(0o755, members["tests/a/script.sh"].mode)
+        self.assertEqual(0o600, members["kuttl-test.yaml"].mode)
+        self.assertEqual(
+            (0, 0, 0), (members["tests/a/script.sh"].mtime, members["tests/a"].uid, members["tests/a"].gid)
+        )
+
+    def test_zip_is_reproducible_and_keeps_modes(self):
+        archives = []
+        for _ in range(2):
+            stream = io.BytesIO()
+            with ZipSink(stream, "out") as sink:
+                self._fill(sink)
+            archives.append(stream.getvalue())
+        self.assertEqual(archives[0], archives[1])
+        with zipfile.ZipFile(io.BytesIO(archives[0])) as archive:
+            self.assertEqual(b"key: value\n", archive.read("tests/a/b/00-install.yaml"))
+            self.assertTrue(archive.getinfo("tests/a/").is_dir())
+            self.assertEqual(0o755, stat.S_IMODE(archive.getinfo("tests/a/script.sh").external_attr >> 16))
+            self.assertEqual(0o600, stat.S_IMODE(archive.getinfo("kuttl-test.yaml").external_attr >> 16))
+
+    def test_dedupe_sink_links_identical_files_to_the_store(self):
+        root = os.path.join(self.tmp.name, "out")
+        sink = DedupeSink(root)
+        for name in ["a", "b", "c"]:
+            sink.mkdir(os.path.join(root, name))
+            sink.write(os.path.join(root, name, "same.yaml"), ["same"], 0o644)
+            sink.write(os.path.join(root, name, "mode.yaml"), ["same"], 0o600 if name == "c" else 0o644)
+            sink.copy(self.source, os.path.join(root, name, "script.sh"))
+        sink.write(os.path.join(root, "a", "unique.yaml"), ["unique"], 0o644)
+        sink.write_bytes(os.path.join(root, "a", "orphan.yaml"), b"orphan", 0o644)
+        sink.write_bytes(os.path.join(root, "a", "orphan.yaml"), b"replaced", 0o644)
+        sink.close()
+
+        same = os.stat(os.path.join(root, "a", "same.yaml"))
+        self.assertEqual(same.st_ino, os.stat(os.path.join(root, "b", "mode.yaml")).st_ino)
+        self.assertEqual(6, same.st_nlink)
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(os.path.join(root, "c", "mode.yaml")).st_mode))
+        self.assertEqual(0o755, stat.S_IMODE(os.stat(os.path.join(root, "c", "script.sh")).st_mode))
+        with open(os.path.join(root, "a", "orphan.yaml"), mode="rb") as stream:
+            self.assertEqual(b"replaced", stream.read())
+        # same (644), same (600), script, unique, replaced
+        self.assertEqual(5, len(os.listdir(os.path.join(root, STORE_DIR))))
+        self.assertEqual((4 * 5 + 2 * 10, 4 + 2 - 1), (sink.saved_bytes, sink.saved_inodes))
+
+    def test_tar_dedupe_adds_hard_links(self):
+        stream = io.BytesIO()
+        with TarSink(stream, "out", dedupe=True) as sink:
+            self._fill(sink)
+            sink.copy(self.source, "out/tests/a/b/script.sh")
+            sink.write("out/tests/a/b/01-install.yaml", ["key: value"], 0o600)
+        self.assertEqual((10, 1), (sink.saved_bytes, sink.saved_inodes))
+        target = os.path.join(self.tmp.name, "extracted")
+        with tarfile.open(fileobj=io.BytesIO(stream.getvalue())) as tar:
+            link = tar.getmember("tests/a/b/script.sh")
+            self.assertTrue(link.islnk())
+            self.assertEqual("tests/a/script.sh", link.linkname)
+            self.assertTrue(tar.getmember("tests/a/b/01-install.yaml").isfile())
+            tar.extractall(target, filter="tar")
+        self.assertEqual(2, os.stat(os.path.join(target, "tests", "a", "b", "script.sh")).st_nlink)
+        with self.assertRaisesRegex(ValueError, "hard links"):
+            open_sink(os.path.join(self.tmp.name, "out.zip"), "zip", dedupe=True)
+
+    def test_background_sink_writes_and_raises_errors(self):
+        root = os.path.join(self.tmp.name, "out")
+        with BackgroundSink(DirectorySink(root), writers=2, queue_depth=1) as sink:
+            sink.mkdir(os.path.join(root, "tests"))
+            for i in range(10):
+                sink.write(os.path.join(root, "tests", f"{i}.yaml"), [f"i: {i}"], 0o600)
+            sink.copy(self.source, os.path.join(root, "tests", "script.sh"))
+            sink.flush()
+            self.assertEqual(11, len(os.listdir(os.path.join(root, "tests"))))
+            with open(os.path.join(root, "tests", "9.yaml"), encoding="utf8") as stream:
+                self.assertEqual("i: 9\n", stream.read())
+            self.assertEqual(0o600, stat.S_IMODE(os.stat(os.path.join(root, "tests", "9.yaml")).st_mode))
+            self.assertEqual(0o755, stat.S_IMODE(os.stat(os.path.join(root, "tests", "script.sh")).st_mode))
+
+            sink.write(os.path.join(root, "missing", "0.yaml"), ["i: 0"])
+            with self.assertRaises(FileNotFoundError):
+                sink.flush()
+            # The error is only raised once
+            sink.flush()
+        with self.assertRaisesRegex(ValueError, "directory"):
+            BackgroundSink(MemorySink())
+
+    def test_background_sink_waits_for_writers(self):
+        release = threading.Event()
+
+        class SlowSink(DirectorySink):
+            def write_bytes(self, file_name, data, mode=None):
+                release.wait()
+                super().write_bytes(file_name, data, mode)
+
+        sink = BackgroundSink(SlowSink(self.tmp.name), writers=1, queue_depth=1)
+        producer = threading.Thread(
+            target=lambda: [sink.write(os.path.join(self.tmp.name, f"{i}.yaml"), ["x"]) for i in range(3)]
+        )
+        producer.start()
+        # One file is being written and one is queued, so the third one has to wait
+        producer.join(timeout=0.2)
+        self.assertTrue(producer.is_alive())
+        release.set()
+        producer.join()
+        sink.close()
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp.name, "2.yaml")))
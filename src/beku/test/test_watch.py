@@ -0,0 +1,155 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from jinja2 import Environment
+
+from beku.kuttl import renderer_from_file
+from beku.watch import InotifyWatcher, PollingWatcher, WatchSession
+
+TEST_DEFINITION = """
+dimensions:
+  - name: a
+    values: [{values}]
+tests:
+  - name: smoke
+    dimensions: [a]
+"""
+
+
+class TestWatchSession(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        self.test_definition = os.path.join(self.root, "test-definition.yaml")
+        self.kuttl_tests = os.path.join(self.root, "kuttl-test.yaml.jinja2")
+        self.template_dir = os.path.join(self.root, "templates")
+        self.output_dir = os.path.join(self.root, "out", "tests")
+        os.makedirs(os.path.join(self.template_dir, "smoke"))
+        self._write(self.test_definition, TEST_DEFINITION.format(values='"1", "2"'))
+        self._write(self.kuttl_tests, "tests: {{ testinput.tests | map(attribute='name') | list }}")
+        self._write(
+            self._template("00-install.yaml.j2"), "{% include 'common.txt' %}a: {{ test_scenario['values']['a'] }}"
+        )
+        self._write(self._template("01-other.yaml.j2"), "other: {{ test_scenario['values']['a'] }}")
+        self._write(self._template("common.txt"), "common: 1\n")
+        self.session = WatchSession(
+            self.test_definition, "default", self.template_dir, self.output_dir, self.kuttl_tests, ""
+        )
+        self.session.expand_all(incremental=False)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _template(self, name):
+        return os.path.join(self.template_dir, "smoke", name)
+
+    def _write(self, file_name, content):
+        with open(file_name, mode="w", encoding="utf8") as stream:
+            stream.write(content)
+
+    def _read(self, tid, name):
+        with open(os.path.join(self.output_dir, "smoke", tid, name), encoding="utf8") as stream:
+            return stream.read()
+
+    def test_update_included_file_in_place(self):
+        env = self.session.expander.environment("smoke")[0]
+        other = os.stat(os.path.join(self.output_dir, "smoke", "smoke_a-1", "01-other.yaml"))
+        self._write(self._template("common.txt"), "common: 2\n")
+        self.session.rebuild({self._template("common.txt")})
+        self.assertEqual("common: 2a: 1\n", self._read("smoke_a-1", "00-install.yaml"))
+        self.assertEqual("common: 2\n", self._read("smoke_a-2", "common.txt"))
+        self.assertEqual(
+            other.st_ino, os.stat(os.path.join(self.output_dir, "smoke", "smoke_a-1", "01-other.yaml")).st_ino
+        )
+        self.assertIs(env, self.session.expander.environment("smoke")[0], "The environment is kept.")
+
+    def test_new_file_and_test_definition_change(self):
+        self._write(self._template("02-new.yaml"), "new: true\n")
+        self.session.rebuild({self._template("02-new.yaml")})
+        self.assertEqual("new: true\n", self._read("smoke_a-2", "02-new.yaml"))
+        self._write(self.test_definition, TEST_DEFINITION.format(values='"2", "3"'))
+        self.session.rebuild({self.session.test_definition})
+        self.assertEqual(["smoke_a-2", "smoke_a-3"], sorted(os.listdir(os.path.join(self.output_dir, "smoke"))))
+        self.assertEqual("new: true\n", self._read("smoke_a-3", "02-new.yaml"))
+
+    def test_rebuilds_reuse_the_resolved_suite_and_environments(self):
+        env = self.session.expander.environment("smoke")[0]
+        with patch("beku.watch.renderer_from_file", wraps=renderer_from_file) as resolve:
+            self._write(self._template("02-new.yaml"), "new: true\n")
+            self.session.rebuild({self._template("02-new.yaml")})
+            self.assertEqual(0, resolve.call_count, "The test definition is not resolved again.")
+            env = self.session.expander.environment("smoke")[0]
+            self._write(self.test_definition, TEST_DEFINITION.format(values='"2", "3"'))
+            with patch.object(Environment, "compile", autospec=True, side_effect=Environment.compile) as compile:
+                self.session.rebuild({self.session.test_definition})
+            self.assertEqual(1, resolve.call_count)
+            self.assertEqual(0, compile.call_count, "The unchanged templates are not compiled again.")
+        self.assertEqual("new: true\n", self._read("smoke_a-3", "02-new.yaml"))
+        self.assertIs(env, self.session.expander.environment("smoke")[0], "The environment is kept.")
+
+    def test_template_and_test_definition_change_together(self):
+        self._write(self._template("common.txt"), "common: 2\n")
+        self.session.rebuild({self._template("common.txt")})
+        self._write(self._template("00-install.yaml.j2"), "{% include 'common.txt' %}v2")
+        self._write(self.test_definition, TEST_DEFINITION.format(values='"1", "2", "3"'))
+        self.session.rebuild({self._template("00-install.yaml.j2"), self.session.test_definition})
+        self.assertEqual("common: 2v2\n", self._read("smoke_a-3", "00-install.yaml"))
+        self._write(self._template("common.txt"), "common: 3\n")
+        self.session.rebuild({self._template("common.txt")})
+        self.assertEqual("common: 3v2\n", self._read("smoke_a-1", "00-install.yaml"))
+
+    def test_failures_are_logged(self):
+        self._write(self._template("01-other.yaml.j2"), "{{ 1 / 0 }}")
+        with self.assertLogs(level="ERROR") as logs:
+            self.session.rebuild({self._template("01-other.yaml.j2")})
+        self.assertEqual(2, len(logs.records))
+        self._write(self._template("01-other.yaml.j2"), "fixed")
+        self.session.rebuild({self._template("01-other.yaml.j2")})
+        self.assertEqual("fixed\n", self._read("smoke_a-1", "01-other.yaml"))
+
+
+class TestWatchers(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp.name, "root")
+        os.makedirs(self.root)
+        self.file = os.path.join(self.tmp.name, "single.yaml")
+        with open(self.file, mode="w", encoding="utf8") as stream:
+            stream.write("a")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _check(self, watcher):
+        try:
+            self.assertEqual(set(), watcher.poll(0.05))
+            new_dir = os.path.join(self.root, "new")
+            os.makedirs(new_dir)
+            self.assertIn(new_dir, watcher.poll(1.0))
+            time.sleep(0.01)
+            with open(os.path.join(new_dir, "t.yaml"), mode="w", encoding="utf8") as stream:
+                stream.write("b")
+            self.assertIn(os.path.join(new_dir, "t.yaml"), watcher.poll(1.0))
+            with open(os.path.join(self.tmp.name, "ignored.yaml"), mode="w", encoding="utf8") as stream:
+                stream.write("c")
+            with open(self.file, mode="w", encoding="utf8") as stream:
+                stream.write("changed")
+            changes = set()
+            while more := watcher.poll(0.2):
+                changes |= more
+            self.assertEqual({self.file}, changes)
+        finally:
+            watcher.close()
+
+    def test_polling_watcher(self):
+        self._check(PollingWatcher([self.root], [self.file], interval=0.01))
+
+    def test_inotify_watcher(self):
+        try:
+            watcher = InotifyWatcher([self.root], [self.file])
+        except (OSError, AttributeError) as exc:
+            self.skipTest(f"inotify is not available: {exc}")
+        self._check(watcher)
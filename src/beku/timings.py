@@ -0,0 +1,101 @@
+"""Record where the time of an expansion is spent."""
+
+from __future__ import annotations
+
+import json
+import logging
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+from typing import Any, ContextManager, Dict, Iterator, List, Optional
+
+# Number of entries in the lists of slowest test cases and templates.
+DEFAULT_TOP: int = 10
+
+
+class Timings:
+    """Wall time of the expansion phases, of every test case and of every template.
+
+    Attributes:
+        phases (Dict[str, float]) : Seconds spent in each phase, in the order the phases were entered.
+        test_cases (Dict[str, Dict[str, float]]) : Seconds and bytes written by test case id.
+        templates (Dict[str, Dict[str, float]]) : Compile and render seconds, number of renders and bytes written
+                                                  by template source file.
+    """
+
+    def __init__(self) -> None:
+        self.phases: Dict[str, float] = {}
+        self.test_cases: Dict[str, Dict[str, float]] = {}
+        self.templates: Dict[str, Dict[str, float]] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + perf_counter() - start
+
+    def add_test_case(self, tid: str, seconds: float, bytes_written: int) -> None:
+        self.test_cases[tid] = {"seconds": seconds, "bytes": bytes_written}
+
+    def add_template(self, source: str, compile_seconds: float, render_seconds: float, bytes_written: int) -> None:
+        entry = self.templates.setdefault(source, {"compile": 0.0, "render": 0.0, "renders": 0, "bytes": 0})
+        entry["compile"] += compile_seconds
+        entry["render"] += render_seconds
+        entry["renders"] += 1
+        entry["bytes"] += bytes_written
+
+    def drain(self) -> Dict[str, Any]:
+        """Return the recorded test cases and templates and forget them. Used to send them from a worker process
+        to the main process."""
+        result = {"test_cases": self.test_cases, "templates": self.templates}
+        self.test_cases = {}
+        self.templates = {}
+        return result
+
+    def merge(self, drained: Dict[str, Any]) -> None:
+        """Add the test cases and templates returned by drain()."""
+        self.test_cases.update(drained["test_cases"])
+        for source, t in drained["templates"].items():
+            entry = self.templates.setdefault(source, {"compile": 0.0, "render": 0.0, "renders": 0, "bytes": 0})
+            for k, v in t.items():
+                entry[k] += v
+
+    def report(self, top: int = DEFAULT_TOP) -> Dict[str, Any]:
+        """Return the report with the phases, the totals and the slowest test cases and templates."""
+        slowest_test_cases: List[Dict[str, Any]] = [
+            {"tid": tid, **t}
+            for tid, t in sorted(self.test_cases.items(), key=lambda item: item[1]["seconds"], reverse=True)[:top]
+        ]
+        slowest_templates: List[Dict[str, Any]] = [
+            {"source": source, **t}
+            for source, t in sorted(
+                self.templates.items(), key=lambda item: item[1]["compile"] + item[1]["render"], reverse=True
+            )[:top]
+        ]
+        return {
+            "phases": self.phases,
+            "totals": {
+                "test_cases": len(self.test_cases),
+                "test_case_seconds": sum(t["seconds"] for t in self.test_cases.values()),
+                "bytes": sum(t["bytes"] for t in self.test_cases.values()),
+                "templates": len(self.templates),
+                "compile_seconds": sum(t["compile"] for t in self.templates.values()),
+                "render_seconds": sum(t["render"] for t in self.templates.values()),
+                "renders": sum(t["renders"] for t in self.templates.values()),
+            },
+            "slowest_test_cases": slowest_test_cases,
+            "slowest_templates": slowest_templates,
+        }
+
+    def write(self, file_name: str, top: int = DEFAULT_TOP) -> None:
+        logging.info("Writing timings to %s", file_name)
+        with open(file_name, encoding="utf8", mode="w") as stream:
+            json.dump(self.report(top), stream, indent=2)
+
+
+def phase(timings: Optional[Timings], name: str) -> ContextManager[None]:
+    """Record the time of the phase if timings is given."""
+    if timings is None:
+        return nullcontext()
+    return timings.phase(name)
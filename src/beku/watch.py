@@ -0,0 +1,438 @@
+"""Expand a test suite again whenever its inputs change."""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+from os import path
+from shutil import rmtree
+from time import perf_counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from jinja2 import BytecodeCache, Environment, meta
+
+from .kuttl import (
+    EffectiveTestSuite,
+    MemoryLoader,
+    TestCase,
+    TestCaseExpander,
+    TestCaseFilter,
+    TestSourceEntry,
+    _expand_kuttl_tests,
+    expand,
+    renderer_from_file,
+)
+from .manifest import MANIFEST_FILE, Manifest, hash_test_case, hash_test_definition
+from .shard import Shard
+
+# Seconds without further changes before a rebuild starts.
+DEFAULT_DEBOUNCE: float = 0.2
+
+# Seconds between two scans of the watched files when inotify is not available.
+POLL_INTERVAL: float = 0.5
+
+# inotify event masks, see inotify(7)
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ISDIR = 0x40000000
+_IN_MASK = (
+    _IN_MODIFY
+    | _IN_ATTRIB
+    | _IN_CLOSE_WRITE
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+    | _IN_DELETE_SELF
+    | _IN_MOVE_SELF
+)
+_EVENT = struct.Struct("iIII")
+
+
+class PollingWatcher:
+    """Detect changes of files and directories by comparing their stat results at regular intervals.
+
+    Attributes:
+        roots (List[str]) : Directories that are watched recursively.
+        files (List[str]) : Single files that are watched.
+    """
+
+    def __init__(self, roots: List[str], files: List[str], interval: float = POLL_INTERVAL) -> None:
+        self.roots = roots
+        self.files = files
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self) -> Dict[str, Tuple[int, int, int, int]]:
+        result = {}
+        paths = list(self.files)
+        for root in self.roots:
+            for dir_path, dirs, files in os.walk(root):
+                paths.append(dir_path)
+                paths.extend(path.join(dir_path, f) for f in files)
+        for p in paths:
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue
+            result[p] = (st.st_mtime_ns, st.st_size, st.st_mode, st.st_ino)
+        return result
+
+    def poll(self, timeout: Optional[float]) -> Set[str]:
+        """Return the paths that changed. Wait up to timeout seconds, or until a change is found if timeout is
+        None."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.interval if deadline is None else max(0.0, min(self.interval, deadline - time.monotonic()))
+            time.sleep(wait)
+            snapshot = self._scan()
+            changes = {p for p in snapshot.keys() | self._snapshot.keys() if snapshot.get(p) != self._snapshot.get(p)}
+            self._snapshot = snapshot
+            if changes or (deadline is not None and time.monotonic() >= deadline):
+                return changes
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """Detect changes of files and directories with the Linux inotify API.
+
+    New directories below the roots are watched as soon as they are created. Single files are watched through
+    their parent directory, so they are also detected when an editor replaces them.
+    Raises OSError if inotify is not available.
+    """
+
+    def __init__(self, roots: List[str], files: List[str]) -> None:
+        self.roots = roots
+        self.files = set(files)
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs: Dict[int, str] = {}
+        try:
+            for root in roots:
+                self._add_tree(root)
+            # Only the events of the watched files are reported for their parent directories.
+            for file_name in files:
+                self._add(path.dirname(file_name))
+        except OSError:
+            self.close()
+            raise
+
+    def _add(self, dir_name: str) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(dir_name), _IN_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"Cannot watch [{dir_name}]")
+        self._dirs[wd] = dir_name
+
+    def _add_tree(self, root: str) -> None:
+        for dir_path, _, _ in os.walk(root):
+            self._add(dir_path)
+
+    def _in_roots(self, p: str) -> bool:
+        return any(p == root or p.startswith(root + os.sep) for root in self.roots)
+
+    def poll(self, timeout: Optional[float]) -> Set[str]:
+        """Return the paths that changed. Wait up to timeout seconds, or until a change is found if timeout is
+        None."""
+        changes: Set[str] = set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not changes:
+            wait = None if deadline is None else max(0.0, deadline - time.monotonic())
+            ready, _, _ = select.select([self._fd], [], [], wait)
+            if not ready:
+                break
+            data = os.read(self._fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                name = data[offset + _EVENT.size : offset + _EVENT.size + length].rstrip(b"\0")
+                offset += _EVENT.size + length
+                if mask & _IN_Q_OVERFLOW:
+                    # Events were lost, everything may have changed.
+                    changes.update(self.roots)
+                    changes.update(self.files)
+                    continue
+                dir_name = self._dirs.get(wd)
+                if dir_name is None:
+                    continue
+                p = path.join(dir_name, os.fsdecode(name)) if name else dir_name
+                if self._in_roots(p):
+                    changes.add(p)
+                    if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                        try:
+                            self._add_tree(p)
+                        except OSError as exc:
+                            logging.debug("Cannot watch %s: %s", p, exc)
+                elif p in self.files:
+                    changes.add(p)
+        return changes
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def make_watcher(roots: List[str], files: List[str]) -> InotifyWatcher | PollingWatcher:
+    """Watch with inotify if possible and fall back to polling otherwise."""
+    try:
+        return InotifyWatcher(roots, files)
+    except (OSError, AttributeError) as exc:
+        logging.info("Cannot use inotify, polling for changes every %ss: %s", POLL_INTERVAL, exc)
+        return PollingWatcher(roots, files)
+
+
+class WatchSession:
+    """Expand a test suite and then expand the parts of it that are affected by changes of the test definition
+    file, the kuttl test suite template or the test templates.
+
+    The Jinja environments, the render caches and the resolved test suite are kept in memory between rebuilds.
+    When a file of a test definition changes, only that file and the templates that include it are rendered
+    again for the test cases of that test definition. When files or directories are added or removed, when the
+    test definition file changes or when a test definition can't be updated in place, the suite is expanded
+    incrementally, which only expands test cases whose inputs changed.
+    """
+
+    def __init__(
+        self,
+        test_definition: str,
+        suite: str,
+        template_dir: str,
+        output_dir: str,
+        kuttl_tests: str,
+        namespace: str,
+        bytecode_cache: Optional[BytecodeCache] = None,
+        jobs: int = 1,
+        link_mode: str = "copy",
+        test_filter: Optional[TestCaseFilter] = None,
+        shard: Optional[Shard] = None,
+        costs: Optional[Dict[str, float]] = None,
+    ) -> None:
+        self.test_definition = path.abspath(test_definition)
+        self.suite = suite
+        self.template_dir = path.abspath(template_dir)
+        self.output_dir = output_dir
+        self.kuttl_tests = path.abspath(kuttl_tests)
+        self.namespace = namespace
+        self.bytecode_cache = bytecode_cache
+        self.jobs = jobs
+        self.link_mode = link_mode
+        self.test_filter = test_filter
+        self.shard = shard
+        self.costs = costs
+        self.expander = TestCaseExpander(self.template_dir, output_dir, namespace, bytecode_cache, link_mode)
+        self.effective_test_suites: Optional[List[EffectiveTestSuite]] = None
+        self.test_cases: Dict[str, List[TestCase]] = {}
+
+    def expand_all(self, incremental: bool, effective_test_suites: Optional[List[EffectiveTestSuite]] = None) -> None:
+        """Expand the test suite. If effective_test_suites are not given, the test suites resolved before are
+        expanded, or the test definition file is resolved if there are none. The Jinja environments of the
+        test definitions are reused. Raises ValueError if test cases cannot be expanded."""
+        if effective_test_suites is not None:
+            self.effective_test_suites = effective_test_suites
+        elif self.effective_test_suites is None:
+            self.effective_test_suites = renderer_from_file(
+                self.test_definition, self.suite, test_filter=self.test_filter
+            )
+        effective_test_suites = self.effective_test_suites
+        try:
+            ets = next((s for s in effective_test_suites if self.suite == s.name))
+        except StopIteration as exc:
+            raise ValueError(f"Cannot expand test suite [{self.suite}] because cannot find it") from exc
+        selected = self.shard.select(ets.test_cases, self.costs) if self.shard else list(ets.test_cases)
+        self.test_cases = {}
+        for tc in selected:
+            self.test_cases.setdefault(tc.name, []).append(tc)
+        for name in list(self.expander.test_indexes):
+            if name not in self.test_cases:
+                self._forget(name)
+        if not incremental:
+            # Expand from scratch but write a manifest, so the rebuilds can be incremental
+            rmtree(self.output_dir, ignore_errors=True)
+            _remove(path.join(path.dirname(self.output_dir), MANIFEST_FILE))
+        expand(
+            self.suite,
+            [EffectiveTestSuite(name=self.suite, test_cases=selected)],
+            self.template_dir,
+            self.output_dir,
+            self.kuttl_tests,
+            self.namespace,
+            self.bytecode_cache,
+            self.jobs,
+            True,
+            self.link_mode,
+            expander=self.expander,
+        )
+
+    def _forget(self, name: str) -> None:
+        self.expander.test_envs.pop(name, None)
+        self.expander.render_caches.pop(name, None)
+        self.expander.test_indexes.pop(name, None)
+
+    def rebuild(self, changes: Set[str]) -> None:
+        """Expand the parts of the test suite affected by the changed paths."""
+        start = perf_counter()
+        by_test: Dict[str, Set[str]] = {}
+        for p in changes:
+            rel_path = path.relpath(p, self.template_dir)
+            if rel_path == "." or rel_path.startswith(os.pardir):
+                continue
+            name, _, rel_file = rel_path.partition(os.sep)
+            if name in self.test_cases:
+                by_test.setdefault(name, set()).add(rel_file)
+        if path.normpath(self.template_dir) in changes:
+            logging.info("Template folder changed")
+            self._expand_incremental(list(self.test_cases))
+        elif self.test_definition in changes:
+            logging.info("Test definition changed")
+            self.effective_test_suites = None
+            # Templates that changed at the same time must not be taken from the environments
+            self._expand_incremental(list(by_test))
+        else:
+            updated = [name for name, rel_files in sorted(by_test.items()) if self._update_in_place(name, rel_files)]
+            outdated = [name for name in by_test if name not in updated]
+            if outdated:
+                self._expand_incremental(outdated)
+            elif self.kuttl_tests in changes:
+                logging.info("Kuttl test suite template changed")
+                self.expander.kuttl_envs.clear()
+                _expand_kuttl_tests(
+                    [tc for tcs in self.test_cases.values() for tc in tcs],
+                    self.output_dir,
+                    self.kuttl_tests,
+                    env=self.expander.kuttl_environment(self.kuttl_tests),
+                )
+            elif not updated:
+                return
+        logging.info("Rebuild finished in %.3fs", perf_counter() - start)
+
+    def _expand_incremental(self, names: List[str]) -> None:
+        for name in names:
+            self._forget(name)
+        try:
+            self.expand_all(incremental=True)
+        except Exception as exc:
+            logging.error("Failed to expand test suite [%s]: %s", self.suite, exc)
+
+    def _update_in_place(self, name: str, rel_files: Set[str]) -> bool:
+        """Build the changed files of the test definition again for all its test cases.
+        Return False if the files or directories of the test definition changed, which needs a new expansion."""
+        td_root = path.join(self.template_dir, name)
+        index = self.expander.test_indexes.get(name)
+        self.expander.test_indexes.pop(name, None)
+        try:
+            if index is None or index != self.expander.index(name):
+                return False
+        except (OSError, ValueError) as exc:
+            logging.debug("Cannot scan %s: %s", td_root, exc)
+            return False
+        changed = {"/".join(rel_file.split(os.sep)) for rel_file in rel_files}
+        env, render_cache = self.expander.environment(name)
+        if isinstance(env.loader, MemoryLoader):
+            for template_name in changed:
+                env.loader.invalidate(template_name)
+        templates = _dependent_templates(env, [e.template_name for e in index.entries if e.template_name], changed)
+        render_cache.invalidate(templates | changed)
+        entries = [e for e in index.entries if _entry_name(e) in changed or e.template_name in templates]
+        if not entries:
+            return True
+        start = perf_counter()
+        manifest = Manifest.load(path.dirname(self.output_dir))
+        definition_hash = hash_test_definition(td_root)
+        failed = 0
+        for tc in self.test_cases[name]:
+            tc_root = path.join(self.output_dir, name, tc.tid)
+            tc_namespace = tc.namespace(self.namespace)
+            try:
+                for entry in entries:
+                    _remove(entry.destination(tc_root))
+                    entry.make_test_source(
+                        td_root, tc_root, env, tc.values, tc_namespace, self.link_mode, render_cache
+                    ).build_destination()
+            except Exception as exc:
+                failed += 1
+                logging.error("Failed to expand test case [%s]: %s: %s", tc.tid, type(exc).__name__, exc)
+                if manifest is not None:
+                    manifest.test_cases.pop(tc.tid, None)
+                continue
+            if manifest is not None and tc.tid in manifest.test_cases:
+                manifest.test_cases[tc.tid]["hash"] = hash_test_case(
+                    definition_hash, tc.tid, tc.values, tc_namespace, self.link_mode
+                )
+        if manifest is not None:
+            manifest.save()
+        logging.info(
+            "Updated %d file(s) of %d test case(s) of test [%s] in %.3fs%s",
+            len(entries),
+            len(self.test_cases[name]),
+            name,
+            perf_counter() - start,
+            f", {failed} failed" if failed else "",
+        )
+        return True
+
+    def run(self, debounce: float = DEFAULT_DEBOUNCE) -> None:
+        """Watch the inputs and rebuild on every change until interrupted."""
+        watcher = make_watcher([self.template_dir], [self.test_definition, self.kuttl_tests])
+        logging.info("Watching %s, %s and %s for changes", self.template_dir, self.test_definition, self.kuttl_tests)
+        try:
+            while True:
+                changes = watcher.poll(None)
+                while more := watcher.poll(debounce):
+                    changes |= more
+                logging.debug("Changed: %s", sorted(changes))
+                self.rebuild(changes)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+
+
+def _entry_name(entry: TestSourceEntry) -> str:
+    return "/".join(path.join(entry.rel_dir, entry.file_name).split(os.sep))
+
+
+def _dependent_templates(env: Environment, template_names: List[str], changed: Set[str]) -> Set[str]:
+    """Return the templates that include, import or extend one of the changed files, directly or indirectly.
+    Templates that reference templates by names that can't be determined statically are always included."""
+    references: Dict[str, Set[Optional[str]]] = {}
+    for template_name in template_names:
+        try:
+            source, _, _ = env.loader.get_source(env, template_name)  # type: ignore[union-attr]
+            references[template_name] = set(meta.find_referenced_templates(env.parse(source)))
+        except Exception as exc:
+            logging.debug("Cannot parse template %s: %s", template_name, exc)
+            references[template_name] = {None}
+    result: Set[str] = set()
+    pending = set(changed)
+    while pending:
+        dependents = {
+            t for t, refs in references.items() if t not in result and (None in refs or not refs.isdisjoint(pending))
+        }
+        result.update(dependents)
+        pending = dependents
+    return result
+
+
+def _remove(file_name: str) -> None:
+    """Remove the file so it can be linked or written again."""
+    try:
+        os.remove(file_name)
+    except FileNotFoundError:
+        pass